@@ -0,0 +1 @@
+# This file is required to make Python treat the directory as a package.
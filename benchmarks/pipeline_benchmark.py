@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import statistics
+from typing import Any, Callable, Dict, List, Optional
+
+from processing.comparison import build_comparison_video
+from processing.decoded_audio import decode_audio
+from processing.ffmpeg import run_ffmpeg
+from processing.proxy_cache import get_proxy
+from processing.video import replace_audio_in_video
+from utils.profiling import profile
+from utils.speech_detection import detect_speech_segments_in_file
+
+# Benchmarks of the media paths of the pipeline on synthetic fixtures.
+#
+# Fixtures are generated with ffmpeg's lavfi sources, so no sample media is needed: a
+# testsrc2 video with a tone soundtrack (h264/aac MP4), a speech-like WAV (modulated tone
+# bursts separated by silences) for the VAD, and a shorter "TTS take" for muxing. Each case
+# runs a few times under utils.profiling and the median is kept. Results can be saved as a
+# baseline and later runs compared against it:
+#
+#   python -m benchmarks.pipeline_benchmark --duration 30 --resolution 1280x720 --save-baseline bench.json
+#   python -m benchmarks.pipeline_benchmark --duration 30 --resolution 1280x720 --baseline bench.json
+#
+# Baselines are machine specific; compare runs made on the same host with the same settings.
+
+CASES = ("extraction", "downscale", "mux_copy", "mux_reencode", "concat", "grid", "vad")
+COMPARED_METRICS = ("wall_seconds", "peak_rss_mb")
+
+
+def generate_fixtures(directory: str, duration: float, resolution: str, fps: int) -> Dict[str, str]:
+    """
+    Creates the synthetic fixtures in a directory, reusing those already generated.
+
+    Returns:
+        Paths of the 'video', 'speech' and 'take' fixtures.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tag = f"{duration:g}s_{resolution}_{fps}fps"
+    fixtures = {
+        'video': os.path.join(directory, f"video_{tag}.mp4"),
+        'speech': os.path.join(directory, f"speech_{duration:g}s.wav"),
+        'take': os.path.join(directory, f"take_{duration:g}s.wav"),
+    }
+    # 2.5s of amplitude-modulated harmonics every 4s, with a little noise in the gaps
+    speech = (
+        "(0.3*sin(2*PI*140*t)+0.2*sin(2*PI*280*t)+0.1*sin(2*PI*420*t))*(0.6+0.4*sin(2*PI*4*t))*lt(mod(t,4),2.5)"
+        "+0.002*(2*random(0)-1)"
+    )
+    commands = {
+        'video': [
+            "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate={fps}:duration={duration}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+            "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", str(2 * fps),
+            "-c:a", "aac", "-shortest", fixtures['video']
+        ],
+        'speech': ["-f", "lavfi", "-i", f"aevalsrc='{speech}':s=16000:d={duration}", fixtures['speech']],
+        'take': ["-f", "lavfi", "-i", f"aevalsrc='{speech}':s=24000:d={0.8 * duration}", fixtures['take']],
+    }
+    for name, args in commands.items():
+        if not os.path.exists(fixtures[name]):
+            run_ffmpeg(args, f"{name} fixture")
+    return fixtures
+
+
+def _cases(fixtures: Dict[str, str]) -> Dict[str, Callable[[str], Any]]:
+    # Each case gets a fresh scratch folder, so caches (proxies) never hit
+    video = fixtures['video']
+    return {
+        'extraction': lambda d: decode_audio(video).to_wav(os.path.join(d, "audio.wav")),
+        'downscale': lambda d: get_proxy(video, 50, d),
+        'mux_copy': lambda d: replace_audio_in_video(video, fixtures['take'], os.path.join(d, "muxed.mp4"), "copy"),
+        'mux_reencode': lambda d: replace_audio_in_video(video, fixtures['take'], os.path.join(d, "muxed.mp4"), "reencode"),
+        'concat': lambda d: build_comparison_video([video] * 3, os.path.join(d, "comparison.mp4")),
+        'grid': lambda d: build_comparison_video([video] * 4, os.path.join(d, "grid.mp4"), layout="grid"),
+        'vad': lambda d: detect_speech_segments_in_file(fixtures['speech']),
+    }
+
+
+def run_case(name: str, fn: Callable[[str], Any], work_dir: str, repeat: int, duration: float) -> Dict[str, Any]:
+    """Runs one case `repeat` times and returns the median of each measure (max of the peak RSS)."""
+    records = []
+    for i in range(repeat):
+        scratch = tempfile.mkdtemp(prefix=f"{name}_{i}_", dir=work_dir)
+        try:
+            with profile(name) as block:
+                fn(scratch)
+            records.append(block.record)
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    result: Dict[str, Any] = {'runs': repeat}
+    for key in ("wall_seconds", "cpu_thread_seconds", "cpu_children_seconds", "subprocess_seconds", "read_bytes", "write_bytes"):
+        result[key] = round(statistics.median(r.get(key, 0) for r in records), 3)
+    result['peak_rss_mb'] = max(r['peak_rss_mb'] for r in records)
+    result['realtime_factor'] = round(duration / result['wall_seconds'], 1) if result['wall_seconds'] else None
+    return result
+
+
+def compare_to_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Returns a message per measure that got worse than the baseline by more than `tolerance`."""
+    if baseline.get('config') != results['config']:
+        print(f"Warning: baseline config {baseline.get('config')} differs from {results['config']}")
+    regressions = []
+    for case, measures in results['cases'].items():
+        reference = baseline.get('cases', {}).get(case)
+        if not reference:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = reference.get(metric), measures.get(metric)
+            if before and after and after > before * (1 + tolerance):
+                regressions.append(f"{case}: {metric} {before} -> {after} (+{after / before - 1:.0%})")
+    return regressions
+
+
+def run(
+    duration: float,
+    resolution: str,
+    fps: int,
+    cases: List[str],
+    repeat: int,
+    fixtures_dir: str,
+    baseline_file: Optional[str],
+    save_baseline: Optional[str],
+    output_file: Optional[str],
+    tolerance: float
+) -> int:
+    fixtures = generate_fixtures(fixtures_dir, duration, resolution, fps)
+    work_dir = tempfile.mkdtemp(prefix="pipeline_benchmark_")
+    available = _cases(fixtures)
+    results = {'config': {'duration': duration, 'resolution': resolution, 'fps': fps}, 'cases': {}}
+    try:
+        print(f"{'case':<14}{'wall s':>9}{'cpu s':>9}{'ffmpeg cpu s':>14}{'peak MB':>10}{'MB read':>10}{'MB written':>12}{'x realtime':>12}")
+        for name in cases:
+            measures = run_case(name, available[name], work_dir, repeat, duration)
+            results['cases'][name] = measures
+            print(
+                f"{name:<14}{measures['wall_seconds']:>9.2f}{measures['cpu_thread_seconds']:>9.2f}"
+                f"{measures['cpu_children_seconds']:>14.2f}{measures['peak_rss_mb']:>10.1f}"
+                f"{measures['read_bytes'] / 2 ** 20:>10.1f}{measures['write_bytes'] / 2 ** 20:>12.1f}"
+                f"{measures['realtime_factor'] or 0:>12.1f}"
+            )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for path in filter(None, (output_file, save_baseline)):
+        with open(path, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {path}")
+
+    if baseline_file:
+        with open(baseline_file, encoding='utf-8') as baseline:
+            regressions = compare_to_baseline(results, json.load(baseline), tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regression beyond {tolerance:.0%} against {baseline_file}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline's media paths on synthetic fixtures.")
+    parser.add_argument("--duration", type=float, default=20.0, help="Fixture length in seconds")
+    parser.add_argument("--resolution", default="1280x720", help="Fixture video size, WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--cases", default=",".join(CASES), help=f"Comma separated subset of {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is reported")
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "deepfake_bench_fixtures"))
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--save-baseline", help="Write the results as a new baseline")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    selected = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = set(selected) - set(CASES)
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+    sys.exit(run(
+        args.duration, args.resolution, args.fps, selected, args.repeat, args.fixtures,
+        args.baseline, args.save_baseline, args.output, args.tolerance
+    ))
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import statistics
+import subprocess
+from time import perf_counter, sleep
+from typing import Any, Dict, List
+from urllib.error import URLError
+from urllib.request import urlopen
+from benchmarks.pipeline_benchmark import compare_to_baseline
+from utils.startup import HEAVY_MODULES
+
+# Cold-start benchmark of the entry points.
+#
+# Each case runs in a fresh interpreter, since a warm process says nothing about startup:
+#
+#   import_pipeline, import_api, import_ui   time to import the module, and which heavy
+#                                            libraries (torch, TTS, whisper, gradio) it pulled in
+#   headless                                 `main.py --headless` until /health answers, plus
+#                                            the server-side milestones from /startup
+#   ui                                       `main.py` until the Gradio page is served
+#
+# wall_seconds is measured from the outside: process spawn to import done or first HTTP
+# response. With --warm-up the headless case also waits for the TTS warm-up to finish and
+# reports its duration. --import-time N lists the N slowest imports of the UI module.
+#
+#   python -m benchmarks.startup_benchmark --save-baseline startup.json
+#   python -m benchmarks.startup_benchmark --baseline startup.json
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_CASES = {
+    'import_pipeline': "processing.pipeline",
+    'import_api': "processing.api",
+    'import_ui': "ui.app",
+}
+CASES = tuple(IMPORT_CASES) + ("headless", "ui")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get_json(url: str) -> Any:
+    with urlopen(url, timeout=5) as response:
+        return json.load(response)
+
+
+def time_import(module: str) -> Dict[str, Any]:
+    """Imports a module in a fresh interpreter and returns the time taken and the heavy modules loaded."""
+    code = (
+        "import sys, json, time\n"
+        "started = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = time.perf_counter() - started\n"
+        f"print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}")
+    measures = json.loads(result.stdout.strip().splitlines()[-1])
+    return {'wall_seconds': measures['seconds'], 'heavy_modules': measures['loaded']}
+
+
+def time_server(headless: bool, timeout: float, wait_warm_up: bool) -> Dict[str, Any]:
+    """Starts main.py, polls it until it answers and returns the time to first response and its milestones."""
+    port = _free_port()
+    command = [sys.executable, "main.py", "--host", "127.0.0.1", "--port", str(port)]
+    command += ["--headless"] if headless else ["--no-share"]
+    if headless and not wait_warm_up:
+        command.append("--no-warm-up")
+    probe_url = f"http://127.0.0.1:{port}/health" if headless else f"http://127.0.0.1:{port}/"
+
+    started = perf_counter()
+    process = subprocess.Popen(command, cwd=REPO, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"main.py exited with code {process.returncode}: {process.stderr.read().strip()[-500:]}")
+            if perf_counter() - started > timeout:
+                raise RuntimeError(f"no response on port {port} after {timeout:.0f}s")
+            try:
+                with urlopen(probe_url, timeout=1):
+                    break
+            except (URLError, OSError):
+                sleep(0.02)
+        result: Dict[str, Any] = {'wall_seconds': perf_counter() - started}
+        if not headless:
+            return result
+
+        report = _get_json(f"http://127.0.0.1:{port}/startup")
+        while wait_warm_up and any(w['status'] == "running" for w in report['warm_ups'].values()):
+            if perf_counter() - started > timeout:
+                break
+            sleep(0.2)
+            report = _get_json(f"http://127.0.0.1:{port}/startup")
+        result['milestones'] = report['milestones']
+        result['heavy_modules'] = [name for name, loaded in report['heavy_modules_loaded'].items() if loaded]
+        for name, state in report['warm_ups'].items():
+            result[f"warm_up_{name}_seconds"] = state.get('seconds')
+            result[f"warm_up_{name}_status"] = state['status']
+        return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def slowest_imports(module: str, count: int) -> List[str]:
+    """The `count` top-level imports with the highest cumulative time (python -X importtime)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=REPO, capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # Top-level imports only, nested ones are indented further
+            rows.append((int(cumulative), name.strip()))
+    return [f"{us / 1e6:8.3f}s  {name}" for us, name in sorted(rows, reverse=True)[:count]]
+
+
+def run(cases: List[str], repeat: int, timeout: float, wait_warm_up: bool) -> Dict[str, Any]:
+    results: Dict[str, Any] = {'config': {'python': sys.version.split()[0], 'warm_up': wait_warm_up}, 'cases': {}}
+    for name in cases:
+        runs = []
+        try:
+            for _ in range(repeat):
+                if name in IMPORT_CASES:
+                    runs.append(time_import(IMPORT_CASES[name]))
+                else:
+                    runs.append(time_server(name == "headless", timeout, wait_warm_up))
+        except Exception as e:
+            print(f"{name:<18}skipped: {e}")
+            continue
+        measures = dict(runs[-1])
+        measures['wall_seconds'] = round(statistics.median(r['wall_seconds'] for r in runs), 3)
+        measures['runs'] = repeat
+        results['cases'][name] = measures
+
+        details = []
+        if 'heavy_modules' in measures:
+            details.append(f"heavy modules: {', '.join(measures['heavy_modules']) or 'none'}")
+        if 'milestones' in measures:
+            details.extend(f"{key} {value:.2f}s" for key, value in measures['milestones'].items())
+        print(f"{name:<18}{measures['wall_seconds']:>8.2f}s   {'; '.join(details)}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cold start and time to first request of the entry points.")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"Comma separated subset of {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is reported")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for a server to answer")
+    parser.add_argument("--warm-up", action="store_true", help="Headless case: also wait for and time the TTS warm-up")
+    parser.add_argument("--import-time", type=int, default=0, metavar="N", help="List the N slowest imports of ui.app")
+    parser.add_argument("--baseline", help="Results file to compare against")
+    parser.add_argument("--save-baseline", help="Write the results as a new baseline")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    selected = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = set(selected) - set(CASES)
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+
+    results = run(selected, args.repeat, args.timeout, args.warm_up)
+    if args.import_time:
+        print("\nSlowest imports of ui.app:")
+        for row in slowest_imports("ui.app", args.import_time):
+            print(f"  {row}")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline:
+            regressions = compare_to_baseline(results, json.load(baseline), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regression beyond {args.tolerance:.0%} against {args.baseline}")
@@ -0,0 +1,86 @@
+import os
+import glob
+import argparse
+from time import time
+from utils.speech_detection import detect_speech_segments_in_file
+
+# Compares the offline VAD against the previous detect_speech_start implementation
+# (pydub split_on_silence + one Google Speech Recognition request per chunk) on GRID
+# corpus clips. The legacy path needs pydub, SpeechRecognition and network access; pass
+# --skip-legacy to time the offline detector alone.
+#
+# Usage: python -m benchmarks.vad_benchmark --corpus gridcorpus/audio --limit 50
+
+
+def legacy_speech_start(wav_file, min_speech_duration=1):
+    from pydub import AudioSegment
+    from pydub.silence import split_on_silence
+    import speech_recognition as sr
+
+    audio = AudioSegment.from_wav(wav_file)
+    chunks = split_on_silence(audio, min_silence_len=500, silence_thresh=-40)
+    recognizer = sr.Recognizer()
+    current_time = 0
+    for chunk in chunks:
+        chunk_duration = len(chunk) / 1000
+        if chunk_duration >= min_speech_duration:
+            with chunk.export(format="wav") as chunk_file:
+                with sr.AudioFile(chunk_file) as source:
+                    audio_data = recognizer.record(source)
+                    try:
+                        recognizer.recognize_google(audio_data)
+                        return current_time
+                    except sr.UnknownValueError:
+                        pass
+        current_time += chunk_duration
+    return None
+
+
+def vad_speech_start(wav_file, min_speech_duration=1):
+    for start, end in detect_speech_segments_in_file(wav_file):
+        if end - start >= min_speech_duration:
+            return start
+    return None
+
+
+def run(corpus_dir, limit, skip_legacy, min_speech_duration):
+    clips = sorted(glob.glob(os.path.join(corpus_dir, "**", "*.wav"), recursive=True))[:limit]
+    if not clips:
+        print(f"No WAV clips found under {corpus_dir}. Run dataset_downloader.py first.")
+        return
+
+    totals = {'vad': 0.0, 'legacy': 0.0}
+    differences = []
+    for clip in clips:
+        start_time = time()
+        vad_start = vad_speech_start(clip, min_speech_duration)
+        totals['vad'] += time() - start_time
+
+        line = f"{os.path.basename(clip):<20} vad={vad_start}"
+        if not skip_legacy:
+            start_time = time()
+            legacy_start = legacy_speech_start(clip, min_speech_duration)
+            totals['legacy'] += time() - start_time
+            line += f" legacy={legacy_start}"
+            if vad_start is not None and legacy_start is not None:
+                differences.append(abs(vad_start - legacy_start))
+        print(line)
+
+    print(f"\n{len(clips)} clips")
+    print(f"Offline VAD: {totals['vad']:.2f}s total, {1000 * totals['vad'] / len(clips):.1f} ms/clip")
+    if not skip_legacy:
+        print(f"Legacy:      {totals['legacy']:.2f}s total, {1000 * totals['legacy'] / len(clips):.1f} ms/clip")
+        if totals['vad'] > 0:
+            print(f"Speed-up:    {totals['legacy'] / totals['vad']:.1f}x")
+        if differences:
+            print(f"Mean |start difference|: {sum(differences) / len(differences):.3f}s over {len(differences)} clips")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the offline VAD against the legacy speech start detector.")
+    parser.add_argument("--corpus", default="gridcorpus/audio", help="Directory containing GRID WAV clips")
+    parser.add_argument("--limit", type=int, default=50, help="Maximum number of clips to process")
+    parser.add_argument("--min-speech-duration", type=float, default=1.0)
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the offline VAD")
+    args = parser.parse_args()
+    run(args.corpus, args.limit, args.skip_legacy, args.min_speech_duration)
@@ -1,33 +1,560 @@
 import os
-import zipfile
-import subprocess
+import io
+import sys
+import json
+import zlib
+import shutil
+import struct
+import hashlib
+import argparse
 import tarfile
+import threading
+import http.client
+import urllib.error
+import urllib.request
+from time import sleep, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
 
-#reference https://gist.github.com/KarthikMAM/d8ebde4db84a72b083df0e14242edb1a
+# GRID corpus downloader.
+#
+# reference https://gist.github.com/KarthikMAM/d8ebde4db84a72b083df0e14242edb1a
+#
+# Each speaker has an audio tar and a video zip. Archives are downloaded over a pool of
+# concurrent connections and extracted while the bytes arrive (tar in stream mode, zip with
+# a local-header reader), so the raw archives never need to be stored. Dropped connections
+# are resumed with HTTP Range requests; with --keep-archives the raw bytes are also written
+# to gridcorpus/raw/, and an interrupted run resumes from that partial file.
+#
+# Every archive's size is checked against the server's Content-Length and its sha256 against
+# gridcorpus/SHA256SUMS, which records the digests seen on first download. An archive is
+# extracted into "<target>.partial" and only renamed into place once verified.
+#
+# Usage: python dataset_downloader.py --speakers 1-34 --connections 4
+#        python dataset_downloader.py --speakers 1-2 --base-url http://127.0.0.1:8000  (local mirror)
 
-# Create directories
-os.makedirs("gridcorpus/raw/audio", exist_ok=True)
-os.makedirs("gridcorpus/raw/video", exist_ok=True)
-os.makedirs("gridcorpus/audio", exist_ok=True)
-os.makedirs("gridcorpus/video", exist_ok=True)
+DEFAULT_BASE_URL = "https://spandh.dcs.shef.ac.uk/gridcorpus"
+DEFAULT_ROOT = "gridcorpus"
+CHUNK_BYTES = 256 * 1024
+COMPLETE_MARKER = ".complete"
+CHECKSUMS_FILE = "SHA256SUMS"
 
-# Define range of speakers 1 to 34
-start_speaker = int(input("Enter the starting speaker number: "))
-end_speaker = int(input("Enter the ending speaker number: "))
-extract_files = input("Do you want to extract files after downloading? (y/n): ")
 
-for i in range(start_speaker, end_speaker + 1):
-    print(f"\n\n------------------------- Downloading {i}th speaker -------------------------\n\n")
+class DownloadError(RuntimeError):
+    pass
 
-    # Download audio and video files
-    subprocess.run(["curl", f"https://spandh.dcs.shef.ac.uk/gridcorpus/s{i}/audio/s{i}.tar", "-o", f"gridcorpus/raw/audio/s{i}.tar"])
-    subprocess.run(["curl", f"https://spandh.dcs.shef.ac.uk/gridcorpus/s{i}/video/s{i}.mpg_vcd.zip", "-o", f"gridcorpus/raw/video/s{i}.zip"])
 
-    # Extract files if requested
-    if extract_files.lower() == "y":
-        with zipfile.ZipFile(f"gridcorpus/raw/video/s{i}.zip", 'r') as zip_ref:
-            zip_ref.extractall(f"gridcorpus/video/s{i}")
-        with tarfile.open(f"gridcorpus/raw/audio/s{i}.tar", 'r') as tar_ref:
-            tar_ref.extractall(f"gridcorpus/audio/s{i}")
+class Archive:
+    """One archive of the corpus and where it goes."""
 
-print("Download completed.")
\ No newline at end of file
+    def __init__(self, speaker: int, kind: str, base_url: str, root: str):
+        self.speaker = speaker
+        self.kind = kind
+        if kind == "audio":
+            self.name = f"s{speaker}.tar"
+            self.url = f"{base_url}/s{speaker}/audio/s{speaker}.tar"
+        else:
+            self.name = f"s{speaker}.mpg_vcd.zip"
+            self.url = f"{base_url}/s{speaker}/video/s{speaker}.mpg_vcd.zip"
+        self.target = os.path.join(root, kind, f"s{speaker}")
+        self.raw_file = os.path.join(root, "raw", kind, self.name)
+
+    @property
+    def label(self) -> str:
+        return f"s{self.speaker} {self.kind}"
+
+
+class Progress:
+    """Byte counters per speaker, printed periodically with their throughput."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.speakers: Dict[int, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self, speaker: int, total: Optional[int]) -> None:
+        with self._lock:
+            state = self.speakers.setdefault(speaker, {'done': 0, 'total': 0, 'start': time(), 'last': 0})
+            state['total'] += total or 0
+
+    def add(self, speaker: int, count: int) -> None:
+        with self._lock:
+            self.speakers[speaker]['done'] += count
+
+    def line(self, speaker: int) -> str:
+        state = self.speakers[speaker]
+        elapsed = max(time() - state['start'], 1e-6)
+        total = f"/{state['total'] / 2 ** 20:.1f}" if state['total'] else ""
+        return f"s{speaker}: {state['done'] / 2 ** 20:.1f}{total} MB, {state['done'] / 2 ** 20 / elapsed:.1f} MB/s"
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                moving = [s for s, state in self.speakers.items() if state['done'] != state['last']]
+                for speaker in moving:
+                    self.speakers[speaker]['last'] = self.speakers[speaker]['done']
+                lines = [self.line(s) for s in sorted(moving)]
+            for line in lines:
+                print(line, flush=True)
+
+    def __enter__(self) -> "Progress":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+
+
+class RangeStream(io.RawIOBase):
+    """
+    Readable HTTP body that reconnects with a Range request when the connection drops.
+
+    Args:
+        url: URL to fetch.
+        offset: First byte to request.
+        retries: Reconnections allowed in a row without progress.
+        timeout: Socket timeout in seconds.
+    """
+
+    def __init__(self, url: str, offset: int = 0, retries: int = 5, timeout: float = 60.0):
+        self.url = url
+        self.offset = offset
+        self.retries = retries
+        self.timeout = timeout
+        self.total: Optional[int] = None
+        self._response = None
+        self._connect()
+
+    def _connect(self) -> None:
+        failures = 0
+        while True:
+            request = urllib.request.Request(self.url, headers={'User-Agent': "gridcorpus-downloader"})
+            if self.offset:
+                request.add_header('Range', f"bytes={self.offset}-")
+            try:
+                response = urllib.request.urlopen(request, timeout=self.timeout)
+                break
+            except urllib.error.HTTPError as e:
+                if e.code == 416 and self.offset:
+                    # Nothing left after the offset: the partial file already holds everything
+                    self.total = int((e.headers.get('Content-Range') or "/0").rsplit("/", 1)[1] or 0) or self.offset
+                    if self.offset >= self.total:
+                        self._response = None
+                        return
+                if e.code < 500 or failures >= self.retries:
+                    raise DownloadError(f"{self.url}: HTTP {e.code} {e.reason}") from e
+            except (urllib.error.URLError, OSError) as e:
+                if failures >= self.retries:
+                    raise DownloadError(f"{self.url}: {e}") from e
+            failures += 1
+            sleep(min(2 ** failures, 30))
+
+        if self.offset and response.status == 200:
+            # The server ignored the Range header: skip what was already received
+            remaining = self.offset
+            while remaining:
+                skipped = len(response.read(min(remaining, CHUNK_BYTES)))
+                if not skipped:
+                    raise DownloadError(f"{self.url}: body shorter than the resume offset")
+                remaining -= skipped
+        content_range = response.headers.get('Content-Range')
+        if content_range and "/" in content_range and not content_range.endswith("/*"):
+            self.total = int(content_range.rsplit("/", 1)[1])
+        elif response.headers.get('Content-Length') and response.status == 200:
+            self.total = int(response.headers['Content-Length'])
+        self._response = response
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        failures = 0
+        while self._response is not None:
+            try:
+                count = self._response.readinto(buffer)
+            except (http.client.HTTPException, OSError):
+                count = None
+            if count:
+                self.offset += count
+                return count
+            if count == 0 and (self.total is None or self.offset >= self.total):
+                return 0
+            # Dropped or truncated connection: resume from the current offset
+            failures += 1
+            if failures > self.retries:
+                raise DownloadError(f"{self.url}: connection lost at byte {self.offset}")
+            self._response.close()
+            sleep(min(2 ** failures, 30))
+            self._connect()
+        return 0
+
+    def close(self) -> None:
+        if self._response is not None:
+            self._response.close()
+        super().close()
+
+
+class VerifyingStream(io.RawIOBase):
+    """
+    Hashes and counts the bytes read through it, optionally copying the new ones to a file.
+
+    Args:
+        source: Stream of the archive bytes, positioned after `prefix`.
+        prefix: Already stored bytes (resumed partial file) read before `source`.
+        tee: File the bytes read from `source` are appended to.
+        on_bytes: Called with the number of bytes of every read from `source`.
+    """
+
+    def __init__(self, source, prefix=None, tee=None, on_bytes=None):
+        self.source = source
+        self.prefix = prefix
+        self.tee = tee
+        self.on_bytes = on_bytes
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)
+        count = self.prefix.readinto(view) if self.prefix is not None else 0
+        if not count:
+            self.prefix = None
+            count = self.source.readinto(view)
+            if self.tee is not None and count:
+                self.tee.write(view[:count])
+            if self.on_bytes and count:
+                self.on_bytes(count)
+        self.digest.update(view[:count])
+        self.size += count
+        return count
+
+
+def _safe_path(root: str, name: str) -> str:
+    root = os.path.normpath(os.path.abspath(root))
+    path = os.path.normpath(os.path.join(root, name))
+    if os.path.isabs(name) or os.path.commonpath([root, path]) != root:
+        raise DownloadError(f"Refusing to extract {name!r} outside {root}")
+    return path
+
+
+def extract_tar_stream(stream, target: str) -> int:
+    """Extracts a tar archive from a non-seekable stream; returns the number of files."""
+    count = 0
+    with tarfile.open(fileobj=stream, mode="r|*") as tar:
+        for member in tar:
+            _safe_path(target, member.name)
+            if not (member.isfile() or member.isdir()):
+                continue  # Links and devices have no place in the corpus
+            tar.extract(member, target, set_attrs=False)
+            count += member.isfile()
+    return count
+
+
+class _PushbackReader:
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = b""
+
+    def read(self, size: int) -> bytes:
+        data, self.pending = self.pending[:size], self.pending[size:]
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read_exact(self, size: int) -> bytes:
+        data = self.read(size)
+        if len(data) != size:
+            raise DownloadError("Truncated zip stream")
+        return data
+
+    def unread(self, data: bytes) -> None:
+        self.pending = data + self.pending
+
+
+def _copy_stored_until_descriptor(reader: _PushbackReader, output) -> Tuple[int, int]:
+    # A stored entry followed by a data descriptor does not announce its length: the data
+    # ends at the first descriptor signature whose CRC and sizes match the bytes before it.
+    crc, written, buffer = 0, 0, b""
+    while True:
+        chunk = reader.read(CHUNK_BYTES)
+        if not chunk:
+            raise DownloadError("Truncated zip stream")
+        buffer += chunk
+        position, search = -1, 0
+        while True:
+            position = buffer.find(b"PK\x07\x08", search)
+            if position < 0 or position + 16 > len(buffer):
+                break
+            entry_crc, compressed, size = struct.unpack("<III", buffer[position + 4:position + 16])
+            if size == compressed == written + position and zlib.crc32(buffer[:position], crc) == entry_crc:
+                output.write(buffer[:position])
+                reader.unread(buffer[position:])
+                return entry_crc, size
+            search = position + 1
+        # Keep the tail, where a descriptor may have started
+        keep = max(len(buffer) - 15, 0) if position < 0 else min(position, max(len(buffer) - 15, 0))
+        output.write(buffer[:keep])
+        crc, written, buffer = zlib.crc32(buffer[:keep], crc), written + keep, buffer[keep:]
+
+
+def _copy_zip_entry(reader: _PushbackReader, output, method: int, size: Optional[int]) -> Tuple[int, int]:
+    # Returns (crc32, bytes written). size is None when it is only given in a data descriptor.
+    crc, written = 0, 0
+    if method == 0:
+        if size is None:
+            return _copy_stored_until_descriptor(reader, output)
+        remaining = size
+        while remaining:
+            data = reader.read_exact(min(remaining, CHUNK_BYTES))
+            output.write(data)
+            crc, written, remaining = zlib.crc32(data, crc), written + len(data), remaining - len(data)
+        return crc, written
+    if method != 8:
+        raise DownloadError(f"Unsupported zip compression method {method}")
+
+    inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+    remaining = size
+    while not inflater.eof:
+        chunk = reader.read(CHUNK_BYTES if remaining is None else min(remaining, CHUNK_BYTES))
+        if not chunk:
+            raise DownloadError("Truncated zip stream")
+        if remaining is not None:
+            remaining -= len(chunk)
+        data = inflater.decompress(chunk)
+        output.write(data)
+        crc, written = zlib.crc32(data, crc), written + len(data)
+    if inflater.unused_data:
+        reader.unread(inflater.unused_data)
+    return crc, written
+
+
+def extract_zip_stream(stream, target: str) -> int:
+    """
+    Extracts a zip archive from a non-seekable stream by walking its local file headers.
+
+    Entries must be stored or deflated; the central directory at the end is not needed.
+    Returns the number of files.
+    """
+    reader = _PushbackReader(stream)
+    count = 0
+    while True:
+        signature = reader.read(4)
+        if signature != b"PK\x03\x04":
+            break  # Central directory (PK\x01\x02) or end of archive
+        (_, flags, method, _, _, crc, compressed, size, name_length, extra_length) = struct.unpack(
+            "<HHHHHIIIHH", reader.read_exact(26)
+        )
+        name = reader.read_exact(name_length).decode('utf-8' if flags & 0x800 else 'cp437')
+        reader.read_exact(extra_length)
+        if 0xFFFFFFFF in (compressed, size):
+            raise DownloadError(f"Zip64 entry {name} is not supported")
+        has_descriptor = bool(flags & 0x08)
+        if flags & 0x01:
+            raise DownloadError(f"Encrypted zip entry {name}")
+
+        path = _safe_path(target, name)
+        is_dir = name.endswith("/")
+        os.makedirs(path if is_dir else os.path.dirname(path), exist_ok=True)
+        # Directory entries can still carry an (empty) compressed stream
+        with open(os.devnull if is_dir else path, 'wb') as output:
+            entry_crc, written = _copy_zip_entry(
+                reader, output, method, None if has_descriptor else compressed
+            )
+        count += not is_dir
+        if has_descriptor:
+            descriptor = reader.read_exact(12)
+            if descriptor[:4] == b"PK\x07\x08":
+                descriptor = descriptor[4:] + reader.read_exact(4)
+            crc, _, size = struct.unpack("<III", descriptor)
+        if entry_crc != crc or written != size:
+            raise DownloadError(f"Zip entry {name} failed its CRC/size check")
+    return count
+
+
+def read_checksums(path: str) -> Dict[str, str]:
+    checksums = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as lines:
+            for line in lines:
+                digest, _, name = line.strip().partition("  ")
+                if name:
+                    checksums[name] = digest
+    return checksums
+
+
+def write_checksums(path: str, checksums: Dict[str, str]) -> None:
+    with open(f"{path}.partial", 'w', encoding='utf-8') as output:
+        for name in sorted(checksums):
+            output.write(f"{checksums[name]}  {name}\n")
+    os.replace(f"{path}.partial", path)
+
+
+def fetch(
+    archive: Archive,
+    progress: Progress,
+    expected_sha256: Optional[str],
+    extract: bool = True,
+    keep_archive: bool = False,
+    retries: int = 5
+) -> Dict[str, object]:
+    """
+    Downloads one archive, extracting it on the fly, and verifies its size and checksum.
+
+    Returns:
+        The archive's name, size, sha256 and extracted file count.
+    """
+    keep_archive = keep_archive or not extract
+    part_file = f"{archive.raw_file}.part"
+    prefix, tee = None, None
+    offset = 0
+    if keep_archive:
+        os.makedirs(os.path.dirname(part_file), exist_ok=True)
+        offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        tee = open(part_file, 'ab')
+        prefix = open(part_file, 'rb') if offset else None
+
+    staging = f"{archive.target}.partial"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        source = RangeStream(archive.url, offset, retries)
+        progress.start(archive.speaker, source.total)
+        progress.add(archive.speaker, offset)
+        verifying = VerifyingStream(source, prefix, tee, lambda count: progress.add(archive.speaker, count))
+        buffered = io.BufferedReader(verifying, CHUNK_BYTES)
+        files = 0
+        if extract:
+            os.makedirs(staging)
+            extractor = extract_tar_stream if archive.kind == "audio" else extract_zip_stream
+            files = extractor(buffered, staging)
+        # Whatever the parser left (tar padding, zip central directory) still counts
+        while buffered.read(CHUNK_BYTES):
+            pass
+        source.close()
+    finally:
+        for handle in (prefix, tee):
+            if handle is not None:
+                handle.close()
+
+    sha256 = verifying.digest.hexdigest()
+    problem = None
+    if source.total is not None and verifying.size != source.total:
+        problem = f"size {verifying.size} does not match the announced {source.total} bytes"
+    elif expected_sha256 and sha256 != expected_sha256:
+        problem = f"sha256 {sha256} does not match the expected {expected_sha256}"
+    if problem:
+        shutil.rmtree(staging, ignore_errors=True)
+        if keep_archive:
+            os.remove(part_file)  # Corrupt bytes must not be resumed from
+        raise DownloadError(f"{archive.name}: {problem}")
+
+    if keep_archive:
+        os.replace(part_file, archive.raw_file)
+    if extract:
+        with open(os.path.join(staging, COMPLETE_MARKER), 'w', encoding='utf-8') as marker:
+            json.dump({'url': archive.url, 'size': verifying.size, 'sha256': sha256}, marker)
+        shutil.rmtree(archive.target, ignore_errors=True)
+        os.replace(staging, archive.target)
+    return {'name': archive.name, 'size': verifying.size, 'sha256': sha256, 'files': files}
+
+
+def is_complete(archive: Archive, extract: bool) -> bool:
+    if extract:
+        return os.path.exists(os.path.join(archive.target, COMPLETE_MARKER))
+    return os.path.exists(archive.raw_file)
+
+
+def parse_speakers(spec: str) -> List[int]:
+    """Parses "1-5,8,10-12" into speaker numbers."""
+    speakers = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        first, _, last = part.partition("-")
+        speakers.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(speakers))
+
+
+def download(
+    speakers: List[int],
+    root: str = DEFAULT_ROOT,
+    base_url: str = DEFAULT_BASE_URL,
+    kinds: Tuple[str, ...] = ("audio", "video"),
+    connections: int = 4,
+    extract: bool = True,
+    keep_archives: bool = False,
+    retries: int = 5,
+    checksums_file: Optional[str] = None,
+    progress_interval: float = 5.0,
+    force: bool = False
+) -> List[str]:
+    """
+    Downloads the given speakers' archives concurrently.
+
+    Returns:
+        Error messages of the archives that failed (empty on success).
+    """
+    checksums_file = checksums_file or os.path.join(root, CHECKSUMS_FILE)
+    checksums = read_checksums(checksums_file)
+    archives = [Archive(s, kind, base_url.rstrip("/"), root) for s in speakers for kind in kinds]
+    pending = [a for a in archives if force or not is_complete(a, extract)]
+    for archive in archives:
+        if archive not in pending:
+            print(f"{archive.label}: already complete, skipping")
+
+    errors = []
+    lock = threading.Lock()
+    with Progress(progress_interval) as progress, ThreadPoolExecutor(max_workers=connections) as pool:
+        futures = {
+            pool.submit(fetch, a, progress, checksums.get(a.name), extract, keep_archives, retries): a
+            for a in pending
+        }
+        for future in as_completed(futures):
+            archive = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(f"{archive.label}: {e}")
+                print(f"{archive.label}: FAILED ({e})", flush=True)
+                continue
+            with lock:
+                checksums[result['name']] = result['sha256']
+                os.makedirs(os.path.dirname(os.path.abspath(checksums_file)), exist_ok=True)
+                write_checksums(checksums_file, checksums)
+            extracted = f", {result['files']} files" if extract else ""
+            print(f"{archive.label}: done, {result['size'] / 2 ** 20:.1f} MB{extracted} ({progress.line(archive.speaker)})", flush=True)
+    return errors
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Download and extract the GRID audio-visual corpus.")
+    parser.add_argument("--speakers", default="1-34", help="Speaker numbers, e.g. 1-5,8")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="Output folder")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL, help="Corpus URL (or a local mirror)")
+    parser.add_argument("--only", choices=("audio", "video"), help="Download a single kind of archive")
+    parser.add_argument("--connections", type=int, default=4, help="Archives downloaded at once")
+    parser.add_argument("--no-extract", action="store_true", help="Only store the raw archives")
+    parser.add_argument("--keep-archives", action="store_true", help="Also store the raw archives (enables resume across runs)")
+    parser.add_argument("--retries", type=int, default=5, help="Reconnections per archive without progress")
+    parser.add_argument("--checksums", help=f"sha256sum-style manifest (default <root>/{CHECKSUMS_FILE})")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="Seconds between progress lines")
+    parser.add_argument("--force", action="store_true", help="Download archives that are already complete")
+    args = parser.parse_args(argv)
+
+    start_time = time()
+    errors = download(
+        parse_speakers(args.speakers), args.root, args.base_url,
+        (args.only,) if args.only else ("audio", "video"), args.connections,
+        not args.no_extract, args.keep_archives, args.retries, args.checksums,
+        args.progress_interval, args.force
+    )
+    print(f"Download {'failed for ' + str(len(errors)) + ' archive(s)' if errors else 'completed'} in {time() - start_time:.0f}s.")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,60 @@
-from ui import app
+import logging
+import argparse
+import threading
+from utils import startup
+from processing import api
 
-if __name__ == "__main__":
+# Fast-start entry point. Only the task plumbing is imported up front: torch and Coqui TTS
+# load in a warm-up thread once the server is bound, and gradio is never imported in
+# headless mode. Startup milestones (see utils.startup) are logged and served at /startup
+# by the API.
+#
+#   python main.py                      Gradio UI on :7860
+#   python main.py --api-port 7861      UI, plus the headless API sharing its scheduler
+#   python main.py --headless           headless API only, on --port (7861 by default)
+#
+# The task API has no authentication and tasks name server paths, so it listens on
+# 127.0.0.1 unless --host is given explicitly (e.g. --host 0.0.0.0).
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="DeepFake EGC lip-sync pipeline.")
+    parser.add_argument("--headless", action="store_true", help="Serve the JSON/HTTP task API without the Gradio UI")
+    parser.add_argument("--host", help=f"Interface to bind (UI: 0.0.0.0, task API: {api.DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, help="UI port (7860), or API port with --headless (7861)")
+    parser.add_argument("--api-port", type=int, help="Also serve the task API on this port next to the UI")
+    parser.add_argument("--no-share", action="store_true", help="Do not create a public Gradio share link")
+    parser.add_argument("--no-warm-up", action="store_true", help="Load the TTS model on the first task instead")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    startup.mark("entry_point_imported")
+
+    if args.headless:
+        server = api.serve(host=args.host or api.DEFAULT_HOST, port=args.port or api.DEFAULT_PORT)
+        if not args.no_warm_up:
+            api.start_warm_up()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    if args.api_port:
+        server = api.serve(host=args.host or api.DEFAULT_HOST, port=args.api_port)
+        threading.Thread(target=server.serve_forever, name="task-api", daemon=True).start()
+
+    from ui import app
+    startup.mark("ui_imported")
     ui = app.build_ui()
-    ui.launch(share=True, server_name="0.0.0.0", server_port=7860)
+    ui.launch(share=not args.no_share, server_name=args.host or "0.0.0.0", server_port=args.port or 7860, prevent_thread_lock=True)
+    startup.mark("ui_bound")
+    if not args.no_warm_up:
+        api.start_warm_up()
+    ui.block_thread()
+
+
+if __name__ == "__main__":
+    main()
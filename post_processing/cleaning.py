@@ -1,7 +1,523 @@
-import librosa
+import os
+import sys
+import glob
+import logging
+import argparse
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
 import soundfile as sf
+from scipy.signal import lfilter
+
+# Block-streaming audio cleaning.
+#
+# Files are read and written in fixed-size blocks through a chain of filter stages. Each
+# stage keeps whatever state it needs across block boundaries (filter memory, resampler
+# history, sample counters), so memory stays bounded by the block size whatever the file
+# length. The default chain reproduces the former librosa-based `initial_cleaning`
+# (mono downmix + pre-emphasis) bit for bit.
+#
+# Stages that need to see the whole signal first (loudness normalisation, silence trim)
+# declare `needs_analysis`: the chain then streams the input once through the stages
+# before them to let them measure it, and a second time to produce the output.
+
+DEFAULT_BLOCK_FRAMES = 65536
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3", ".aiff", ".aif")
+
+_EMPTY = np.zeros(0, dtype=np.float32)
+
+
+class Stage:
+    """
+    A streaming filter stage working on mono float32 blocks.
+
+    Subclasses override `process` and, when they hold samples back, `flush`.
+    """
+
+    needs_analysis = False
+
+    def configure(self, sample_rate: int) -> int:
+        """Resets the streaming state for a new pass and returns the output sample rate."""
+        self.sample_rate = sample_rate
+        return sample_rate
+
+    def analyse(self, block: np.ndarray) -> None:
+        """Receives the stage's input during the analysis pass."""
+
+    def end_analysis(self) -> None:
+        """Called once the analysis pass has seen the whole input."""
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def flush(self) -> np.ndarray:
+        """Returns the samples still held back at the end of the input."""
+        return _EMPTY
+
+
+class Preemphasis(Stage):
+    """
+    First-order pre-emphasis filter, identical to `librosa.effects.preemphasis`.
+
+    The filter state is initialised by linear extrapolation from the first two samples,
+    as librosa does, and carried from one block to the next.
+    """
+
+    def __init__(self, coef: float = 0.97):
+        self.coef = coef
+
+    def configure(self, sample_rate: int) -> int:
+        self._zi = None
+        self._pending = _EMPTY
+        return super().configure(sample_rate)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        if self._zi is None:
+            block = np.concatenate([self._pending, block]) if len(self._pending) else block
+            self._pending = _EMPTY
+            if len(block) < 2:
+                self._pending = block
+                return _EMPTY
+            self._zi = 2 * block[0:1] - block[1:2]
+        b = np.asarray([1.0, -self.coef], dtype=block.dtype)
+        a = np.asarray([1.0], dtype=block.dtype)
+        output, self._zi = lfilter(b, a, block, zi=self._zi.astype(block.dtype))
+        return output
+
+    def flush(self) -> np.ndarray:
+        # Only reached for single-sample inputs, which have nothing to extrapolate from
+        pending, self._pending = self._pending, _EMPTY
+        return pending
+
+
+class Resample(Stage):
+    """Changes the sample rate with a streaming soxr resampler."""
+
+    def __init__(self, target_rate: int, quality: str = "HQ"):
+        self.target_rate = int(target_rate)
+        self.quality = quality
+
+    def configure(self, sample_rate: int) -> int:
+        super().configure(sample_rate)
+        self._stream = None
+        if sample_rate != self.target_rate:
+            import soxr
+            self._stream = soxr.ResampleStream(sample_rate, self.target_rate, 1, dtype='float32', quality=self.quality)
+        return self.target_rate
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        if self._stream is None:
+            return block
+        return self._stream.resample_chunk(block.astype(np.float32, copy=False))
+
+    def flush(self) -> np.ndarray:
+        if self._stream is None:
+            return _EMPTY
+        return self._stream.resample_chunk(_EMPTY, last=True)
+
+
+def _biquad_high_shelf(sample_rate: int, gain_db: float, q: float, fc: float) -> Tuple[np.ndarray, np.ndarray]:
+    a_gain = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0, sqrt_a = np.cos(w0), np.sqrt(a_gain)
+    b = [
+        a_gain * ((a_gain + 1) + (a_gain - 1) * cos_w0 + 2 * sqrt_a * alpha),
+        -2 * a_gain * ((a_gain - 1) + (a_gain + 1) * cos_w0),
+        a_gain * ((a_gain + 1) + (a_gain - 1) * cos_w0 - 2 * sqrt_a * alpha)
+    ]
+    a = [
+        (a_gain + 1) - (a_gain - 1) * cos_w0 + 2 * sqrt_a * alpha,
+        2 * ((a_gain - 1) - (a_gain + 1) * cos_w0),
+        (a_gain + 1) - (a_gain - 1) * cos_w0 - 2 * sqrt_a * alpha
+    ]
+    return np.asarray(b) / a[0], np.asarray(a) / a[0]
+
+
+def _biquad_high_pass(sample_rate: int, q: float, fc: float) -> Tuple[np.ndarray, np.ndarray]:
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    cos_w0 = np.cos(w0)
+    b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+    a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    return np.asarray(b) / a[0], np.asarray(a) / a[0]
+
+
+class LoudnessNormalize(Stage):
+    """
+    Applies a constant gain so the integrated loudness reaches `target_lufs`.
+
+    Loudness is measured as in ITU-R BS.1770: K-weighting, 400 ms blocks every 100 ms,
+    absolute gate at -70 LUFS and relative gate 10 LU below the ungated level. The gain
+    is reduced if needed so the sample peak stays under `peak_dbfs`.
+    """
+
+    needs_analysis = True
+
+    def __init__(self, target_lufs: float = -23.0, peak_dbfs: float = -1.0):
+        self.target_lufs = target_lufs
+        self.peak_dbfs = peak_dbfs
+        self.gain = 1.0
+        self.loudness: Optional[float] = None
+
+    def configure(self, sample_rate: int) -> int:
+        super().configure(sample_rate)
+        self._filters = [_biquad_high_shelf(sample_rate, 4.0, 1 / np.sqrt(2), 1500.0), _biquad_high_pass(sample_rate, 0.5, 38.0)]
+        self._states = [np.zeros(2) for _ in self._filters]
+        self._hop = max(1, int(round(0.1 * sample_rate)))
+        self._partial_sum, self._partial_count = 0.0, 0
+        self._hop_energies: List[float] = []
+        self._peak = 0.0
+        return sample_rate
+
+    def analyse(self, block: np.ndarray) -> None:
+        weighted = block.astype(np.float64)
+        for index, (b, a) in enumerate(self._filters):
+            weighted, self._states[index] = lfilter(b, a, weighted, zi=self._states[index])
+        if len(block):
+            self._peak = max(self._peak, float(np.max(np.abs(block))))
+
+        squares = weighted ** 2
+        position = 0
+        while position < len(squares):
+            take = min(self._hop - self._partial_count, len(squares) - position)
+            self._partial_sum += float(np.sum(squares[position:position + take]))
+            self._partial_count += take
+            position += take
+            if self._partial_count == self._hop:
+                self._hop_energies.append(self._partial_sum)
+                self._partial_sum, self._partial_count = 0.0, 0
+
+    def end_analysis(self) -> None:
+        hops = np.asarray(self._hop_energies)
+        if len(hops) >= 4:
+            blocks = np.convolve(hops, np.ones(4), mode="valid") / (4 * self._hop)
+        elif len(hops):
+            blocks = np.asarray([hops.sum() / (len(hops) * self._hop)])
+        else:
+            blocks = np.zeros(0)
+
+        with np.errstate(divide="ignore"):
+            block_loudness = -0.691 + 10 * np.log10(blocks)
+        gated = blocks[block_loudness > -70.0]
+        if len(gated):
+            relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+            gated = gated[-0.691 + 10 * np.log10(gated) > relative_gate]
+        if not len(gated):
+            logging.warning("Input is silent, loudness normalisation skipped")
+            self.loudness, self.gain = None, 1.0
+            return
+
+        self.loudness = -0.691 + 10 * np.log10(gated.mean())
+        gain_db = self.target_lufs - self.loudness
+        if self._peak > 0:
+            gain_db = min(gain_db, self.peak_dbfs - 20 * np.log10(self._peak))
+        self.gain = 10 ** (gain_db / 20)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        return (block * np.float32(self.gain)).astype(np.float32, copy=False)
+
+
+class TrimSilence(Stage):
+    """
+    Removes leading and trailing silence.
+
+    Frames of `frame_ms` whose RMS stays under `threshold_db` dBFS are silent; the kept
+    span starts `pad_ms` before the first loud frame and ends `pad_ms` after the last.
+    """
+
+    needs_analysis = True
+
+    def __init__(self, threshold_db: float = -50.0, frame_ms: float = 20.0, pad_ms: float = 50.0):
+        self.threshold_db = threshold_db
+        self.frame_ms = frame_ms
+        self.pad_ms = pad_ms
+        self.span: Optional[Tuple[int, int]] = None
+
+    def configure(self, sample_rate: int) -> int:
+        super().configure(sample_rate)
+        self._frame = max(1, int(sample_rate * self.frame_ms / 1000))
+        self._carry = _EMPTY
+        self._frames_seen = 0
+        self._first_loud: Optional[int] = None
+        self._last_loud: Optional[int] = None
+        self._position = 0
+        return sample_rate
+
+    def analyse(self, block: np.ndarray) -> None:
+        samples = np.concatenate([self._carry, block]) if len(self._carry) else block
+        count = len(samples) // self._frame
+        self._carry = samples[count * self._frame:]
+        if not count:
+            return
+        frames = samples[:count * self._frame].reshape(count, self._frame).astype(np.float64)
+        threshold = 10 ** (self.threshold_db / 20)
+        loud = np.flatnonzero(np.sqrt(np.mean(frames ** 2, axis=1)) > threshold)
+        if len(loud):
+            if self._first_loud is None:
+                self._first_loud = self._frames_seen + int(loud[0])
+            self._last_loud = self._frames_seen + int(loud[-1])
+        self._frames_seen += count
+
+    def end_analysis(self) -> None:
+        total = self._frames_seen * self._frame + len(self._carry)
+        if self._first_loud is None:
+            logging.warning("No sound above the silence threshold, nothing trimmed")
+            self.span = (0, total)
+            return
+        pad = int(self.sample_rate * self.pad_ms / 1000)
+        self.span = (
+            max(0, self._first_loud * self._frame - pad),
+            min(total, (self._last_loud + 1) * self._frame + pad)
+        )
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        start, end = self.span
+        block_start = self._position
+        self._position += len(block)
+        return block[max(0, start - block_start):max(0, end - block_start)]
+
+
+class CleaningChain:
+    """
+    A sequence of stages applied to a file block by block.
+
+    Input is decoded as float32 and downmixed to mono by averaging channels, as
+    `librosa.load` does, before the first stage.
+
+    Args:
+        stages: Stages applied in order.
+        block_frames: Number of input frames read at a time.
+    """
+
+    def __init__(self, stages: Sequence[Stage], block_frames: int = DEFAULT_BLOCK_FRAMES):
+        self.stages = list(stages)
+        self.block_frames = block_frames
+
+    def _configure(self, sample_rate: int, count: int) -> int:
+        for stage in self.stages[:count]:
+            sample_rate = stage.configure(sample_rate)
+        return sample_rate
+
+    def _read(self, input_file: Any) -> Iterator[np.ndarray]:
+        if not isinstance(input_file, str):
+            # Decoded buffer (processing.decoded_audio): already mono float32
+            for start in range(0, len(input_file.samples), self.block_frames):
+                yield np.asarray(input_file.samples[start:start + self.block_frames], dtype=np.float32)
+            return
+        for block in sf.blocks(input_file, blocksize=self.block_frames, dtype='float32', always_2d=True):
+            yield block[:, 0] if block.shape[1] == 1 else block.mean(axis=1)
+
+    def _stream(self, input_file: Any, count: int) -> Iterator[np.ndarray]:
+        # Runs the input through the first `count` stages, then flushes them in order so
+        # samples a stage held back still go through the stages after it
+        stages = self.stages[:count]
+        for block in self._read(input_file):
+            for stage in stages:
+                block = stage.process(block)
+            if len(block):
+                yield block
+        for index, stage in enumerate(stages):
+            block = stage.flush()
+            for downstream in stages[index + 1:]:
+                block = downstream.process(block)
+            if len(block):
+                yield block
+
+    def run(self, input_file: Any, output_file: str, subtype: Optional[str] = None) -> int:
+        """
+        Cleans `input_file` into `output_file`.
+
+        Args:
+            input_file: Audio file readable by libsndfile, or a DecodedAudio buffer.
+            output_file: Destination; the format follows its extension.
+            subtype: libsndfile subtype of the output (format default when None).
+
+        Returns:
+            The number of frames written.
+        """
+        sample_rate = sf.info(input_file).samplerate if isinstance(input_file, str) else input_file.sample_rate
+        for index, stage in enumerate(self.stages):
+            if stage.needs_analysis:
+                stage.configure(self._configure(sample_rate, index))
+                for block in self._stream(input_file, index):
+                    stage.analyse(block)
+                stage.end_analysis()
+
+        output_rate = self._configure(sample_rate, len(self.stages))
+        frames = 0
+        with sf.SoundFile(output_file, 'w', samplerate=output_rate, channels=1, subtype=subtype) as output:
+            for block in self._stream(input_file, len(self.stages)):
+                output.write(block)
+                frames += len(block)
+        return frames
+
+
+def build_chain(
+    preemphasis: Optional[float] = 0.97,
+    trim_db: Optional[float] = None,
+    resample_rate: Optional[int] = None,
+    loudness_lufs: Optional[float] = None,
+    block_frames: int = DEFAULT_BLOCK_FRAMES
+) -> CleaningChain:
+    """Builds a chain from the optional stages, in pre-emphasis, trim, resample, loudness order."""
+    stages: List[Stage] = []
+    if preemphasis is not None:
+        stages.append(Preemphasis(preemphasis))
+    if trim_db is not None:
+        stages.append(TrimSilence(trim_db))
+    if resample_rate:
+        stages.append(Resample(resample_rate))
+    if loudness_lufs is not None:
+        stages.append(LoudnessNormalize(loudness_lufs))
+    return CleaningChain(stages, block_frames)
+
 
 def initial_cleaning(input_file, output_file):
-    y, sr = librosa.load(input_file, sr=None)
-    y_smoothed = librosa.effects.preemphasis(y)
-    sf.write(output_file, y_smoothed, sr)
+    build_chain().run(input_file, output_file)
+
+
+def _clean_file(chain: CleaningChain, input_file: str, output_file: str, subtype: Optional[str]) -> Tuple[str, float, int]:
+    start_time = time()
+    frames = chain.run(input_file, output_file, subtype)
+    return output_file, time() - start_time, frames
+
+
+def find_audio_files(paths: Sequence[str]) -> List[str]:
+    """Expands directories (recursively) into the audio files they contain."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(glob.glob(os.path.join(path, "**", "*"), recursive=True)):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    files.append(name)
+        else:
+            files.append(path)
+    return files
+
+
+def output_paths(input_files: Sequence[str], output_dir: str, suffix: str = "_cleaned") -> List[str]:
+    """
+    Output file of each input: its path relative to the inputs' common folder, under `output_dir`.
+
+    Corpora such as GRID reuse file names across speaker folders, so the folder structure
+    is kept rather than flattened.
+
+    Raises:
+        ValueError: When two inputs map to the same output (e.g. `a.wav` and `a.flac`).
+    """
+    absolute = [os.path.abspath(f) for f in input_files]
+    try:
+        root = os.path.commonpath([os.path.dirname(f) for f in absolute]) if absolute else ""
+    except ValueError:  # Inputs on different Windows drives
+        root = ""
+    outputs = []
+    for input_file in absolute:
+        relative = os.path.relpath(input_file, root) if root else os.path.basename(input_file)
+        outputs.append(os.path.join(output_dir, f"{os.path.splitext(relative)[0]}{suffix}.wav"))
+
+    seen = {}
+    for input_file, output_file in zip(input_files, outputs):
+        if output_file in seen:
+            raise ValueError(f"{seen[output_file]} and {input_file} would both be written to {output_file}")
+        seen[output_file] = input_file
+    return outputs
+
+
+def clean_files(
+    input_files: Sequence[str],
+    output_dir: str,
+    chain: Optional[CleaningChain] = None,
+    workers: Optional[int] = None,
+    suffix: str = "_cleaned",
+    subtype: Optional[str] = None
+) -> List[Tuple[str, Optional[str], Optional[str]]]:
+    """
+    Cleans many files on a process pool.
+
+    Each worker streams one file at a time, so memory per worker is bounded by the
+    chain's block size.
+
+    Args:
+        input_files: Files to clean.
+        output_dir: Folder receiving `<name><suffix>.wav` for each input, in the same
+            subfolders as the input (see output_paths).
+        chain: Chain to apply (the default pre-emphasis chain when None).
+        workers: Number of processes (CPU count when None).
+        suffix: Appended to each output file name.
+        subtype: libsndfile subtype of the outputs.
+
+    Returns:
+        (input, output, error) for each input, in input order.
+
+    Raises:
+        ValueError: When two inputs map to the same output file.
+    """
+    chain = chain or build_chain()
+    outputs = output_paths(input_files, output_dir, suffix)
+    for folder in sorted({os.path.dirname(f) for f in outputs} | {output_dir}):
+        os.makedirs(folder, exist_ok=True)
+    results = {}
+    # Recycling workers bounds the memory a long batch can accumulate; the option only
+    # exists from Python 3.11 on
+    pool_options = {'max_tasks_per_child': 64} if sys.version_info >= (3, 11) else {}
+    with ProcessPoolExecutor(max_workers=workers, **pool_options) as executor:
+        futures = {}
+        for input_file, output_file in zip(input_files, outputs):
+            futures[executor.submit(_clean_file, chain, input_file, output_file, subtype)] = input_file
+        for future in as_completed(futures):
+            input_file = futures[future]
+            try:
+                output_file, elapsed, frames = future.result()
+                logging.info(f"Cleaned {input_file} -> {output_file} ({frames} frames, {elapsed:.2f}s)")
+                results[input_file] = (input_file, output_file, None)
+            except Exception as e:
+                logging.error(f"Failed to clean {input_file}: {e}")
+                results[input_file] = (input_file, None, str(e))
+    return [results[input_file] for input_file in input_files]
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Clean audio files block by block on a process pool.")
+    parser.add_argument("inputs", nargs="+", help="Audio files or directories to clean")
+    parser.add_argument("--output-dir", required=True, help="Folder receiving the cleaned files")
+    parser.add_argument("--suffix", default="_cleaned", help="Suffix appended to output file names")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--block-frames", type=int, default=DEFAULT_BLOCK_FRAMES, help="Frames read per block")
+    parser.add_argument("--preemphasis", type=float, default=0.97, help="Pre-emphasis coefficient")
+    parser.add_argument("--no-preemphasis", action="store_true", help="Disable pre-emphasis")
+    parser.add_argument("--trim-db", type=float, default=None, help="Trim leading/trailing audio under this dBFS level")
+    parser.add_argument("--resample", type=int, default=None, help="Output sample rate")
+    parser.add_argument("--loudness", type=float, default=None, help="Target integrated loudness in LUFS")
+    parser.add_argument("--subtype", default=None, help="Output subtype, e.g. PCM_16, PCM_24, FLOAT")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    input_files = find_audio_files(args.inputs)
+    if not input_files:
+        print("No audio files found.")
+        return 1
+
+    chain = build_chain(
+        preemphasis=None if args.no_preemphasis else args.preemphasis,
+        trim_db=args.trim_db,
+        resample_rate=args.resample,
+        loudness_lufs=args.loudness,
+        block_frames=args.block_frames
+    )
+    start_time = time()
+    try:
+        results = clean_files(input_files, args.output_dir, chain, args.workers, args.suffix, args.subtype)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    failures = [result for result in results if result[2]]
+    print(f"Cleaned {len(results) - len(failures)}/{len(results)} file(s) in {time() - start_time:.1f}s")
+    for input_file, _, error in failures:
+        print(f"  {input_file}: {error}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,41 +1,161 @@
-try:
-    import ctypes
-    print("ctypes imported successfully.")
-except Exception as e:
-    print(f"Failed to import ctypes: {e}")
-
-try:
-    import os
-    print("os imported successfully.")
-except Exception as e:
-    print(f"Failed to import os: {e}")
-
-try:
-    import torch
-    print("torch imported successfully.")
-except Exception as e:
-    print(f"Failed to import torch: {e}")
-
-try:
+import threading
+from typing import Any, Dict, List, Optional, Union
+import numpy as np
+from processing.model_registry import default_device, get_registry
+
+# Whisper decodes fixed 30 second windows. Long inputs are split into overlapping windows,
+# decoded in batches with timestamps, and stitched back together: each window only keeps
+# the segments whose midpoint falls in the part of the window it "owns", so words in the
+# overlap are neither lost at a window edge nor duplicated.
+#
+# torch and whisper are imported lazily so that importing this module stays cheap.
+
+SAMPLE_RATE = 16000
+WINDOW_SECONDS = 30
+OVERLAP_SECONDS = 5
+DEFAULT_MODEL = "base"
+
+
+def load_whisper_model(name: str = DEFAULT_MODEL, device: Optional[str] = None):
+    """Returns the resident Whisper model for (name, device) and its load time."""
     import whisper
-    print("whisper imported successfully.")
-except Exception as e:
-    print(f"Failed to import whisper: {e}")
+    device = device or default_device()
+    return get_registry().get(("whisper", name, device), lambda: whisper.load_model(name=name, device=device))
 
-import threading
+
+class WhisperTranscriber:
+    """
+    Long-form transcription engine around a resident Whisper model.
+
+    Args:
+        model_name: Whisper checkpoint name ("base", "small", ...).
+        device: Torch device; defaults to CUDA when available.
+        batch_size: Number of 30s windows decoded per `decode` call.
+        overlap_seconds: Overlap between consecutive windows.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        device: Optional[str] = None,
+        batch_size: int = 8,
+        overlap_seconds: float = OVERLAP_SECONDS
+    ):
+        self.model_name = model_name
+        self.device = device or default_device()
+        self.batch_size = batch_size
+        self.overlap_seconds = overlap_seconds
+
+    @property
+    def model(self):
+        return load_whisper_model(self.model_name, self.device)[0]
+
+    def transcribe(self, audio: Union[str, np.ndarray, Any], language: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Transcribes an audio file or 16 kHz mono float32 array of any length.
+
+        Args:
+            audio: Path to a file ffmpeg can decode, a PCM array at 16 kHz, or a
+                DecodedAudio buffer (resampled to 16 kHz in memory).
+            language: Language code; detected once from the first window when omitted.
+
+        Returns:
+            A dict with the detected 'language', the stitched 'text' and the list of
+            timestamped 'segments' ({'start', 'end', 'text'}).
+        """
+        import torch
+        import whisper
+        from whisper.tokenizer import get_tokenizer
+
+        if isinstance(audio, str):
+            audio = whisper.load_audio(audio)
+        elif hasattr(audio, 'resampled'):
+            audio = audio.resampled(SAMPLE_RATE).samples
+        audio = np.asarray(audio, dtype=np.float32)
+
+        window = WINDOW_SECONDS * SAMPLE_RATE
+        stride = int((WINDOW_SECONDS - self.overlap_seconds) * SAMPLE_RATE)
+        offsets = list(range(0, max(len(audio) - int(self.overlap_seconds * SAMPLE_RATE), 1), stride))
+
+        model = self.model
+        registry_key = ("whisper", self.model_name, self.device)
+        with get_registry().use_lock(registry_key):
+            mels = [
+                whisper.log_mel_spectrogram(whisper.pad_or_trim(audio[offset:offset + window]), model.dims.n_mels)
+                for offset in offsets
+            ]
+
+            if language is None:
+                _, probs = model.detect_language(mels[0].to(model.device))
+                language = max(probs, key=probs.get)
+
+            options = whisper.DecodingOptions(
+                language=language,
+                without_timestamps=False,
+                fp16=self.device != 'cpu'
+            )
+            tokenizer = get_tokenizer(model.is_multilingual, language=language, task=options.task)
+
+            results = []
+            for batch_start in range(0, len(mels), self.batch_size):
+                batch = torch.stack(mels[batch_start:batch_start + self.batch_size]).to(model.device)
+                results.extend(whisper.decode(model, batch, options))
+
+        segments = []
+        half_overlap = self.overlap_seconds / 2
+        for index, (offset, result) in enumerate(zip(offsets, results)):
+            window_start = offset / SAMPLE_RATE
+            own_start = window_start + half_overlap if index > 0 else 0.0
+            own_end = window_start + stride / SAMPLE_RATE + half_overlap if index < len(offsets) - 1 else float("inf")
+            for segment in _timestamped_segments(result.tokens, tokenizer, window_start):
+                midpoint = (segment['start'] + segment['end']) / 2
+                if own_start <= midpoint < own_end:
+                    segments.append(segment)
+
+        text = " ".join(segment['text'] for segment in segments if segment['text'])
+        return {'language': language, 'text': text, 'segments': segments}
+
+
+def _timestamped_segments(tokens: List[int], tokenizer, time_offset: float) -> List[Dict[str, Any]]:
+    # Timestamp tokens mark segment boundaries in 20 ms steps relative to the window start.
+    segments = []
+    text_tokens: List[int] = []
+    start = None
+    for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+            timestamp = time_offset + (token - tokenizer.timestamp_begin) * 0.02
+            if start is None:
+                start = timestamp
+            elif text_tokens:
+                segments.append({'start': start, 'end': timestamp, 'text': tokenizer.decode(text_tokens).strip()})
+                text_tokens = []
+                start = None
+            else:
+                start = timestamp
+        else:
+            text_tokens.append(token)
+
+    if text_tokens:
+        # Text left without a closing timestamp runs to the end of the window
+        segments.append({
+            'start': start if start is not None else time_offset,
+            'end': time_offset + WINDOW_SECONDS,
+            'text': tokenizer.decode(text_tokens).strip()
+        })
+    return segments
+
+
+_transcribers: Dict[str, WhisperTranscriber] = {}
+_transcribers_lock = threading.Lock()
+
+
+def get_transcriber(model_name: str = DEFAULT_MODEL) -> WhisperTranscriber:
+    """Returns a shared transcriber for `model_name`."""
+    with _transcribers_lock:
+        if model_name not in _transcribers:
+            _transcribers[model_name] = WhisperTranscriber(model_name)
+        return _transcribers[model_name]
 
 
 def run_local_whisper(mp3_filename):
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    print("CUDA Available:", torch.cuda.is_available())
-    print("CUDA Device Name:", torch.cuda.get_device_name(0) if torch.cuda.is_available() else "No GPU detected")
-
-    model = whisper.load_model(name="base", device=device)
-    audio = whisper.load_audio(mp3_filename)
-    audio = whisper.pad_or_trim(audio)
-    mel = whisper.log_mel_spectrogram(audio).to(model.device)
-    _, probs = model.detect_language(mel)
-    print(f"Detected language: {max(probs, key=probs.get)}")
-    options = whisper.DecodingOptions()
-    result = whisper.decode(model, mel, options)
-    return result.text
+    return get_transcriber().transcribe(mp3_filename)['text']
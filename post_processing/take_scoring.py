@@ -0,0 +1,80 @@
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence
+from post_processing.speech_to_text import DEFAULT_MODEL, get_transcriber
+
+# Intelligibility scores of TTS takes.
+#
+# A take is transcribed by the resident Whisper model and compared to the text it was
+# asked to say. Word and character error rates are computed on normalised text (case,
+# punctuation, apostrophes and Unicode forms folded), so "C'est l'été." and "c est l ete"
+# differ only by the accents, which French synthesis gets wrong audibly.
+
+DEFAULT_LANGUAGE = "fr"
+METRICS = ("wer", "cer")
+
+
+def normalize_text(text: str) -> str:
+    """Lower-cases, folds Unicode forms, and replaces punctuation with single spaces."""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"[’'`\-]", " ", text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def edit_distance(reference: Sequence[Any], hypothesis: Sequence[Any]) -> int:
+    """Levenshtein distance between two sequences (words or characters)."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_item in enumerate(reference, 1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_item in enumerate(hypothesis, 1):
+            current[j] = min(
+                previous[j] + 1,  # deletion
+                current[j - 1] + 1,  # insertion
+                previous[j - 1] + (ref_item != hyp_item)  # substitution
+            )
+        previous = current
+    return previous[-1]
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    reference_words = normalize_text(reference).split()
+    return edit_distance(reference_words, normalize_text(hypothesis).split()) / max(len(reference_words), 1)
+
+
+def char_error_rate(reference: str, hypothesis: str) -> float:
+    # Spaces are kept: merged or split words count as one edit
+    reference_chars = normalize_text(reference)
+    return edit_distance(reference_chars, normalize_text(hypothesis)) / max(len(reference_chars), 1)
+
+
+def score_take(
+    audio: Any,
+    reference_text: str,
+    language: Optional[str] = DEFAULT_LANGUAGE,
+    model_name: str = DEFAULT_MODEL
+) -> Dict[str, Any]:
+    """
+    Transcribes a take and scores it against the text it should say.
+
+    Args:
+        audio: Path, 16 kHz array or DecodedAudio, as accepted by WhisperTranscriber.
+        reference_text: Text given to the TTS.
+        language: Language of the text; detected by Whisper when None.
+        model_name: Whisper checkpoint.
+
+    Returns:
+        A dict with 'transcript', 'wer' and 'cer'.
+    """
+    transcript = get_transcriber(model_name).transcribe(audio, language=language)['text']
+    return {
+        'transcript': transcript,
+        'wer': round(word_error_rate(reference_text, transcript), 4),
+        'cer': round(char_error_rate(reference_text, transcript), 4)
+    }
+
+
+def rank_takes(scores: Dict[int, Dict[str, Any]], metric: str = "wer") -> List[int]:
+    """Take indices from best to worst by `metric`, the other rate breaking ties."""
+    other = "cer" if metric == "wer" else "wer"
+    return sorted(scores, key=lambda i: (scores[i][metric], scores[i][other], i))
@@ -0,0 +1,356 @@
+import sys
+import json
+import queue
+import logging
+import argparse
+import threading
+from time import time
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, unquote
+from urllib.request import Request, urlopen
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from processing import audio
+from processing.model_registry import default_device
+from processing.pipeline import TaskContext, build_stages, make_task, validate_task
+from processing.scheduler import COMPLETED, Job, Scheduler, get_scheduler
+from utils import startup
+
+# Headless entry point: the same tasks as the Gradio UI, over HTTP/JSON or from the shell.
+#
+# Tasks are the dicts the UI's add_task builds (see pipeline.make_task for the fields and
+# their defaults) and run on the shared scheduler, next to the UI's tasks when both are
+# served from one process (main.py --api-port).
+#
+#   POST   /tasks              task dict or list of task dicts -> {"tasks": [{"job_id": ...}]}
+#   GET    /tasks              all submitted tasks with their status
+#   GET    /tasks/<id>         status, messages, output files and profiling trace of a task
+#   GET    /tasks/<id>/events  the task's events as JSON lines, streamed until it finishes
+#   DELETE /tasks/<id>         cancels a task
+#   GET    /startup            cold-start milestones and warm-up states (utils.startup)
+#   GET    /health             liveness, with the scheduler's queue state
+#
+# Paths in the tasks are read by the server, so they must be visible to it. From the shell:
+#
+#   python -m processing.api serve --port 7861
+#   python -m processing.api submit task.json --server http://127.0.0.1:7861
+#   python -m processing.api submit task.json      # runs in this process, no server
+#
+# The server itself is standard library only; torch is imported when the first task
+# arrives unless a warm-up already did it. Job ids contain the task name, so URL-quote them.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7861
+
+
+class Submission:
+    """A task submitted through the API: its context, its job and the events seen so far."""
+
+    def __init__(self, ctx: TaskContext, job: Job):
+        self.ctx = ctx
+        self.job = job
+        self.events: List[Dict[str, Any]] = []
+        self._changed = threading.Condition()
+        threading.Thread(target=self._pump, name=f"api-events-{job.job_id}", daemon=True).start()
+
+    def _pump(self) -> None:
+        # The job has its own listener, drained here into a history that any number of
+        # clients can replay and follow
+        while True:
+            event = self.job.listener.get()
+            record = {'job_id': event.job_id, 'time': round(time(), 3), 'status': event.status, 'message': event.message}
+            if event.final:
+                self.ctx.release_proxy()  # Also covers jobs cancelled before their compare stage
+                record['final'] = True
+                if event.status == COMPLETED:
+                    record['output_files'] = self.ctx.output_files
+            with self._changed:
+                self.events.append(record)
+                self._changed.notify_all()
+            if event.final:
+                return
+
+    def follow(self, timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """Yields the past events, then new ones as they arrive, until the final event."""
+        position = 0
+        while True:
+            with self._changed:
+                if position == len(self.events):
+                    self._changed.wait(timeout)
+                events = self.events[position:]
+            position += len(events)
+            for event in events:
+                yield event
+                if event.get('final'):
+                    return
+
+    def to_dict(self, detail: bool = False) -> Dict[str, Any]:
+        summary = {
+            'job_id': self.job.job_id,
+            'task_name': self.ctx.task_name,
+            'status': self.job.status,
+            'submitted_at': round(self.job.submitted_at, 3),
+            'finished_at': self.job.finished_at and round(self.job.finished_at, 3),
+        }
+        if detail:
+            summary.update(
+                task=self.ctx.task,
+                messages=[event['message'] for event in self.events],
+                output_files=self.ctx.output_files,
+                comparison_video_file=self.ctx.comparison_video_file,
+                trace=self.ctx.trace.to_dict(),
+            )
+        return summary
+
+
+class TaskService:
+    """
+    Submits task dicts to the scheduler and keeps track of them for the API.
+
+    Args:
+        scheduler: Scheduler to run the tasks on; the process-wide one by default.
+        device: Torch device for TTS; CUDA when available by default.
+    """
+
+    def __init__(self, scheduler: Optional[Scheduler] = None, device: Optional[str] = None):
+        self.scheduler = scheduler or get_scheduler()
+        self.device = device
+        self.submissions: Dict[str, Submission] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fields: Dict[str, Any]) -> Submission:
+        """
+        Raises:
+            ValueError: When the task has unknown fields or misses inputs.
+        """
+        with self._lock:
+            task = make_task(fields, default_name=f"Task_{len(self.submissions) + 1}")
+        error = validate_task(task)
+        if error:
+            raise ValueError(error)
+        ctx = TaskContext(task, self.device or default_device())
+        job = self.scheduler.submit(task['task_name'], build_stages(ctx), priority=task['priority'], listener=queue.Queue())
+        submission = Submission(ctx, job)
+        with self._lock:
+            self.submissions[job.job_id] = submission
+        startup.mark("first_task_submitted")
+        return submission
+
+    def get(self, job_id: str) -> Optional[Submission]:
+        with self._lock:
+            return self.submissions.get(job_id)
+
+    def list(self) -> List[Submission]:
+        with self._lock:
+            return list(self.submissions.values())
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "DeepFakeEGC"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(f"API {self.address_string()}: {format % args}")
+
+    def _send(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self) -> List[str]:
+        startup.mark("first_request")
+        return [unquote(part) for part in self.path.split("?", 1)[0].strip("/").split("/") if part]
+
+    def _submission(self, job_id: str) -> Optional[Submission]:
+        submission = self.server.service.get(job_id)
+        if submission is None:
+            self._send(404, {'error': f"no task {job_id!r}"})
+        return submission
+
+    def do_GET(self) -> None:
+        service: TaskService = self.server.service
+        route = self._route()
+        if route == ["health"]:
+            self._send(200, {'status': "ok", 'scheduler': service.scheduler.stats()})
+        elif route == ["startup"]:
+            self._send(200, startup.report())
+        elif route == ["tasks"]:
+            self._send(200, {'tasks': [submission.to_dict() for submission in service.list()]})
+        elif len(route) == 2 and route[0] == "tasks":
+            submission = self._submission(route[1])
+            if submission:
+                self._send(200, submission.to_dict(detail=True))
+        elif len(route) == 3 and route[0] == "tasks" and route[2] == "events":
+            submission = self._submission(route[1])
+            if submission:
+                self._stream(submission)
+        else:
+            self._send(404, {'error': f"unknown path {self.path}"})
+
+    def _stream(self, submission: Submission) -> None:
+        # No Content-Length: the response is the event lines until the task finishes, then
+        # the connection is closed
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for event in submission.follow():
+                self.wfile.write((json.dumps(event) + "\n").encode("utf-8"))
+                self.wfile.flush()
+        except OSError:
+            pass  # Client went away; the task keeps running
+
+    def do_POST(self) -> None:
+        if self._route() != ["tasks"]:
+            self._send(404, {'error': f"unknown path {self.path}"})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"null")
+        except json.JSONDecodeError as e:
+            self._send(400, {'error': f"invalid JSON: {e}"})
+            return
+        tasks = payload if isinstance(payload, list) else [payload]
+        if not tasks or not all(isinstance(task, dict) for task in tasks):
+            self._send(400, {'error': "expected a task object or a list of task objects"})
+            return
+        submitted, errors = [], []
+        for index, task in enumerate(tasks):
+            try:
+                submitted.append(self.server.service.submit(task).to_dict())
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+        self._send(202 if submitted else 400, {'tasks': submitted, 'errors': errors})
+
+    def do_DELETE(self) -> None:
+        route = self._route()
+        if len(route) != 2 or route[0] != "tasks":
+            self._send(404, {'error': f"unknown path {self.path}"})
+            return
+        submission = self._submission(route[1])
+        if submission:
+            cancelled = self.server.service.scheduler.cancel(submission.job.job_id)
+            self._send(200, {'job_id': submission.job.job_id, 'cancelled': cancelled})
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(service: Optional[TaskService] = None, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> _Server:
+    """Binds the API server and returns it; call serve_forever() on it."""
+    server = _Server((host, port), _Handler)
+    server.service = service or TaskService()
+    startup.mark("api_bound")
+    logging.info(f"Task API listening on http://{host}:{server.server_address[1]}")
+    return server
+
+
+def start_warm_up(device: Optional[str] = None) -> threading.Thread:
+    """Loads the TTS model in the background so the first task hits the warm registry."""
+    return startup.warm_up("tts", lambda: audio.warm_up(device or default_device()))
+
+
+def load_tasks(path: str) -> List[Dict[str, Any]]:
+    """Reads a task dict or a list of task dicts from a JSON file ("-" for stdin)."""
+    if path == "-":
+        payload = json.load(sys.stdin)
+    else:
+        with open(path, encoding="utf-8") as f:
+            payload = json.load(f)
+    return payload if isinstance(payload, list) else [payload]
+
+
+def _print_event(event: Dict[str, Any]) -> None:
+    print(event['message'], flush=True)
+    for output_file in event.get('output_files') or []:
+        print(f"  {output_file}", flush=True)
+
+
+def submit_remote(server: str, tasks: List[Dict[str, Any]], follow: bool = True) -> bool:
+    """Posts tasks to a running API server and prints their events. Returns whether all completed."""
+    server = server.rstrip("/")
+    request = Request(f"{server}/tasks", data=json.dumps(tasks).encode("utf-8"), headers={'Content-Type': "application/json"})
+    try:
+        with urlopen(request) as response:
+            result = json.load(response)
+    except HTTPError as e:
+        result = json.load(e)
+    except URLError as e:
+        print(f"Cannot reach {server}: {e.reason}", file=sys.stderr)
+        return False
+    for error in result['errors']:
+        print(f"Task {error['index'] + 1} rejected: {error['error']}", file=sys.stderr)
+    if not follow:
+        for submitted in result['tasks']:
+            print(f"{submitted['job_id']}\t{submitted['task_name']}\t{submitted['status']}")
+        return not result['errors']
+
+    # Followed one after the other: each stream replays the events missed in the meantime
+    ok = not result['errors']
+    for submitted in result['tasks']:
+        status = None
+        with urlopen(f"{server}/tasks/{quote(submitted['job_id'], safe='')}/events") as events:
+            for line in events:
+                event = json.loads(line)
+                _print_event(event)
+                status = event['status']
+        ok = ok and status == COMPLETED
+    return ok
+
+
+def run_local(tasks: List[Dict[str, Any]], device: Optional[str] = None) -> bool:
+    """Runs tasks in this process and prints their events. Returns whether all completed."""
+    service = TaskService(device=device)
+    submissions, ok = [], True
+    for index, task in enumerate(tasks):
+        try:
+            submissions.append(service.submit(task))
+        except ValueError as e:
+            print(f"Task {index + 1} rejected: {e}", file=sys.stderr)
+            ok = False
+    for submission in submissions:
+        for event in submission.follow():
+            _print_event(event)
+        ok = ok and submission.job.status == COMPLETED
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Headless task API of the lip-sync pipeline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="Serve the HTTP/JSON API")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--no-warm-up", action="store_true", help="Load the TTS model on the first task instead")
+    submit_parser = commands.add_parser("submit", help="Run tasks from a JSON file, locally or on a server")
+    submit_parser.add_argument("tasks", help="JSON file with a task dict or a list of them, '-' for stdin")
+    submit_parser.add_argument("--server", help="API server URL; the tasks run in this process when omitted")
+    submit_parser.add_argument("--no-follow", action="store_true", help="Print the job ids instead of streaming events")
+    submit_parser.add_argument("--device", help="Torch device for local runs (cuda when available by default)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "serve":
+        server = serve(host=args.host, port=args.port)
+        if not args.no_warm_up:
+            start_warm_up()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return 0
+
+    tasks = load_tasks(args.tasks)
+    if args.server:
+        return 0 if submit_remote(args.server, tasks, follow=not args.no_follow) else 1
+    return 0 if run_local(tasks, args.device) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
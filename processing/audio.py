@@ -1,18 +1,132 @@
-from TTS.api import TTS
+import numpy as np
 from time import time
+from processing.model_registry import get_registry
+from processing.speaker_cache import get_speaker_cache
 
 # Explanation for the choice of xtts_v2
 # the TTS library by Coqui provides a command to list all compatible models.
 # Out of all of those, only two supported both French and voice cloning.
 # xTTSv2 was chosen as it has a pretty neutral accent compared to the other one that
 # is heavily inclined toward non-native French accents.
+TTS_MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
 
 
-def generate_tts_audio(text, extracted_audio_file, tts_output_file, device):
+def load_tts_model(device, model_name=TTS_MODEL_NAME):
+    # The model is loaded once per (model, device) and kept resident by the registry.
+    # Coqui TTS (and torch with it) is imported here rather than at module level, so that
+    # importing the pipeline does not cost several seconds before the server can bind.
+    key = (model_name, device)
+
+    def load():
+        from TTS.api import TTS
+        return TTS(model_name=model_name, progress_bar=True).to(device)
+
+    return get_registry().get(key, load)
+
+
+def warm_up(device, model_name=TTS_MODEL_NAME):
+    # Called at server start so the first task does not pay for the checkpoint load.
+    _, load_time = load_tts_model(device, model_name)
+    return load_time
+
+
+XTTS_REFERENCE_SAMPLE_RATE = 22050
+
+
+def _latents_from_samples(xtts, reference):
+    # Same steps as Xtts.get_conditioning_latents, but from an already decoded buffer
+    # instead of a file path: resample to 22.05 kHz, clip to max_ref_len seconds, then
+    # compute the speaker embedding and the GPT conditioning latents.
+    import torch
+    import torchaudio
+
+    sample_rate = XTTS_REFERENCE_SAMPLE_RATE
+    audio = torch.from_numpy(np.array(reference.samples, dtype=np.float32)).unsqueeze(0)
+    if reference.sample_rate != sample_rate:
+        audio = torchaudio.functional.resample(audio, reference.sample_rate, sample_rate)
+    audio = audio.clamp(-1, 1)[:, :sample_rate * xtts.config.max_ref_len].to(xtts.device)
+    if xtts.config.sound_norm_refs:
+        audio = (audio / torch.abs(audio).max()) * 0.75
+
+    with torch.inference_mode():
+        speaker_embedding = xtts.get_speaker_embedding(audio, sample_rate)
+        gpt_cond_latent = xtts.get_gpt_cond_latents(
+            audio, sample_rate, length=xtts.config.gpt_cond_len, chunk_length=xtts.config.gpt_cond_chunk_len
+        )
+    return gpt_cond_latent, speaker_embedding
+
+
+def get_speaker_latents(tts, speaker_wav, device, model_name=TTS_MODEL_NAME):
+    # Conditioning latents only depend on the reference audio, so they are looked up by
+    # content hash and the reference encoder only runs on a cache miss. `speaker_wav` is a
+    # file path or a DecodedAudio buffer (see processing.decoded_audio).
+    xtts = tts.synthesizer.tts_model
+    cache = get_speaker_cache()
+
+    def compute():
+        if not isinstance(speaker_wav, str):
+            return _latents_from_samples(xtts, speaker_wav)
+        return xtts.get_conditioning_latents(
+            audio_path=[speaker_wav],
+            gpt_cond_len=xtts.config.gpt_cond_len,
+            gpt_cond_chunk_len=xtts.config.gpt_cond_chunk_len,
+            max_ref_length=xtts.config.max_ref_len,
+            sound_norm_refs=xtts.config.sound_norm_refs
+        )
+
+    return cache.get_or_compute(cache.key_for(speaker_wav, model_name), compute, device)
+
+
+def _inference(tts, text, gpt_cond_latent, speaker_embedding, enable_text_splitting=True):
+    xtts = tts.synthesizer.tts_model
+    output = xtts.inference(
+        text,
+        'fr',
+        gpt_cond_latent,
+        speaker_embedding,
+        temperature=xtts.config.temperature,
+        length_penalty=xtts.config.length_penalty,
+        repetition_penalty=xtts.config.repetition_penalty,
+        top_k=xtts.config.top_k,
+        top_p=xtts.config.top_p,
+        enable_text_splitting=enable_text_splitting
+    )
+    return output['wav']
+
+
+def output_sample_rate(tts):
+    return tts.synthesizer.tts_model.config.audio.output_sample_rate
+
+
+def synthesize_waveform(text, speaker_wav, device):
+    # Returns the raw waveform of a single chunk of text, for callers that assemble the
+    # output themselves (see processing.tts_streaming).
+    tts, load_time = load_tts_model(device)
+    with get_registry().use_lock((TTS_MODEL_NAME, device)):
+        gpt_cond_latent, speaker_embedding = get_speaker_latents(tts, speaker_wav, device)
+        wav = _inference(tts, text, gpt_cond_latent, speaker_embedding, enable_text_splitting=False)
+    return np.asarray(wav, dtype=np.float32), output_sample_rate(tts), load_time
+
+
+def condition_speaker(reference_audio, device):
+    # Computes (or finds cached) the conditioning latents of a voice ahead of synthesis,
+    # so several takes in the same voice only pay for the reference encoder once.
+    tts, load_time = load_tts_model(device)
     start_time = time()
+    with get_registry().use_lock((TTS_MODEL_NAME, device)):
+        get_speaker_latents(tts, reference_audio, device)
+    return load_time, time() - start_time
 
-    tts = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2", progress_bar=True).to(device)
-    tts.tts_to_file(text=text, speaker_wav=extracted_audio_file, file_path=tts_output_file, language='fr')
 
+def generate_tts_audio(text, reference_audio, tts_output_file, device):
+    # `reference_audio` is the voice to clone: a file path or a DecodedAudio buffer
+    tts, load_time = load_tts_model(device)
+
+    start_time = time()
+    with get_registry().use_lock((TTS_MODEL_NAME, device)):
+        gpt_cond_latent, speaker_embedding = get_speaker_latents(tts, reference_audio, device)
+        wav = _inference(tts, text, gpt_cond_latent, speaker_embedding)
+        tts.synthesizer.save_wav(wav=wav, path=tts_output_file)
     end_time = time()
-    return end_time - start_time
\ No newline at end of file
+
+    return load_time, end_time - start_time
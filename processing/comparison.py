@@ -0,0 +1,160 @@
+import os
+import math
+import logging
+import tempfile
+from time import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from processing.ffmpeg import first_stream, has_filter, media_duration, probe, run_ffmpeg
+
+# Builds the side-by-side / back-to-back comparison video shown at the end of a task in a
+# single ffmpeg run. Every input is scaled and padded to the target resolution inside the
+# filter graph, so the lip-synced iterations never go through a per-frame Python resize
+# and no clip reader stays open on the Python side. When all inputs already share the
+# same encoding parameters, sequential layouts are concatenated without re-encoding.
+
+LAYOUTS = ("concat", "grid")
+AUDIO_SAMPLE_RATE = 44100
+
+
+def build_comparison_video(
+    video_files: Sequence[str],
+    output_file: str,
+    target_resolution: Optional[Tuple[int, int]] = None,
+    layout: str = "concat",
+    labels: Optional[Sequence[str]] = None,
+    columns: Optional[int] = None
+) -> Tuple[float, str]:
+    """
+    Combines several videos into one comparison video in a single ffmpeg pass.
+
+    Args:
+        video_files: Input videos, in display order.
+        output_file: Path of the comparison video.
+        target_resolution: (width, height) every input is fitted to. Defaults to the
+            resolution of the last input, which is the original video in the pipeline.
+        layout: "concat" plays the inputs one after the other, "grid" plays them
+            simultaneously in an N-up grid (a plain hstack for two inputs).
+        labels: Optional caption drawn on each input.
+        columns: Number of grid columns. Defaults to a near-square grid.
+
+    Returns:
+        The elapsed time and the path taken: "copy" (concat without re-encoding),
+        "concat" or "grid".
+    """
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown comparison layout '{layout}', expected one of {LAYOUTS}")
+    if not video_files:
+        raise ValueError("No videos to compare")
+
+    start_time = time()
+    infos = [probe(path) for path in video_files]
+    video_streams = [first_stream(info, 'video') for info in infos]
+    if target_resolution is None:
+        target_resolution = (int(video_streams[-1]['width']), int(video_streams[-1]['height']))
+    width, height = (_even(v) for v in target_resolution)
+    fps = video_streams[-1].get('r_frame_rate', '25/1')
+
+    if labels and not has_filter("drawtext"):
+        logging.warning("This ffmpeg build has no drawtext filter, comparison labels are skipped")
+        labels = None
+
+    if layout == "concat" and not labels and _can_concat_without_reencode(infos, (width, height)):
+        _concat_copy(video_files, output_file)
+        return time() - start_time, "copy"
+
+    filters = []
+    for index in range(len(video_files)):
+        video_filter = (
+            f"[{index}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p"
+        )
+        if labels:
+            video_filter += f",drawtext=text='{_escape_drawtext(labels[index])}':x=10:y=10:fontsize=h/20:" \
+                            f"fontcolor=white:box=1:boxcolor=black@0.5:boxborderw=6"
+        filters.append(f"{video_filter}[v{index}]")
+
+    if layout == "concat":
+        for index, (path, info) in enumerate(zip(video_files, infos)):
+            filters.append(_audio_filter(index, info, media_duration(path, info)))
+        pairs = "".join(f"[v{i}][a{i}]" for i in range(len(video_files)))
+        filters.append(f"{pairs}concat=n={len(video_files)}:v=1:a=1[v][a]")
+        audio_map = ["-map", "[a]"]
+    else:
+        filters.append(_grid_filter(len(video_files), width, height, columns))
+        # Playing every soundtrack at once is unintelligible, so the grid keeps the audio
+        # of the first input that has one.
+        audio_index = next((i for i, info in enumerate(infos) if first_stream(info, 'audio')), None)
+        audio_map = ["-map", f"{audio_index}:a:0"] if audio_index is not None else []
+
+    inputs = []
+    for path in video_files:
+        inputs += ["-i", path]
+    run_ffmpeg(
+        inputs + ["-filter_complex", ";".join(filters), "-map", "[v]"] + audio_map
+        + ["-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", "-movflags", "+faststart", output_file],
+        description="comparison video"
+    )
+    return time() - start_time, layout
+
+
+def _even(value: int) -> int:
+    # yuv420p needs even dimensions
+    return int(value) - int(value) % 2
+
+
+def _escape_drawtext(text: str) -> str:
+    for char in ("\\", ":", "'", "%", ",", ";", "[", "]"):
+        text = text.replace(char, f"\\{char}")
+    return text
+
+
+def _audio_filter(index: int, info: Dict[str, Any], duration: float) -> str:
+    normalise = f"aresample={AUDIO_SAMPLE_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo"
+    if first_stream(info, 'audio'):
+        return f"[{index}:a]{normalise},apad,atrim=0:{duration:.6f}[a{index}]"
+    # concat needs an audio segment per input, so silent inputs get generated silence
+    return f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl=stereo,atrim=0:{duration:.6f}[a{index}]"
+
+
+def _grid_filter(count: int, width: int, height: int, columns: Optional[int]) -> str:
+    if count == 1:
+        return "[v0]null[v]"
+    columns = columns or math.ceil(math.sqrt(count))
+    labels = "".join(f"[v{i}]" for i in range(count))
+    if count <= columns:
+        return f"{labels}hstack=inputs={count}[v]"
+    layout = "|".join(f"{(i % columns) * width}_{(i // columns) * height}" for i in range(count))
+    return f"{labels}xstack=inputs={count}:layout={layout}:fill=black[v]"
+
+
+def _stream_signature(info: Dict[str, Any]) -> Tuple:
+    video = first_stream(info, 'video') or {}
+    audio = first_stream(info, 'audio') or {}
+    return (
+        video.get('codec_name'), video.get('profile'), video.get('pix_fmt'), video.get('r_frame_rate'),
+        audio.get('codec_name'), audio.get('sample_rate'), audio.get('channels')
+    )
+
+
+def _can_concat_without_reencode(infos: List[Dict[str, Any]], resolution: Tuple[int, int]) -> bool:
+    for info in infos:
+        video = first_stream(info, 'video')
+        if video is None or (int(video['width']), int(video['height'])) != resolution:
+            return False
+        if first_stream(info, 'audio') is None:
+            return False
+    return len({_stream_signature(info) for info in infos}) == 1
+
+
+def _concat_copy(video_files: Sequence[str], output_file: str) -> None:
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as list_file:
+        for path in video_files:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    try:
+        run_ffmpeg(
+            ["-f", "concat", "-safe", "0", "-i", list_file.name, "-c", "copy", "-movflags", "+faststart", output_file],
+            description="comparison concat"
+        )
+    finally:
+        os.remove(list_file.name)
@@ -0,0 +1,155 @@
+import os
+import hashlib
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from math import gcd
+from time import perf_counter
+from typing import Dict, Optional, Tuple
+import numpy as np
+import soundfile as sf
+from processing.ffmpeg import FFMPEG, FFmpegError, first_stream, probe
+from utils.profiling import record_subprocess
+
+# Decode-once audio shared by the pipeline stages.
+#
+# The soundtrack of an input is decoded a single time, straight from an ffmpeg pipe into a
+# mono float32 NumPy buffer, and every consumer (XTTS speaker conditioning, VAD, Whisper,
+# cleaning) reads that buffer instead of a WAV written next to the upload. Long inputs are
+# spooled to an unlinked temporary file and memory-mapped so they do not sit in RAM. A WAV
+# is only written when an external tool needs a path.
+
+MMAP_THRESHOLD_SECONDS = float(os.environ.get("DEEPFAKE_AUDIO_MMAP_SECONDS", "600"))
+DEFAULT_MEMORY_ENTRIES = 8
+PIPE_CHUNK_BYTES = 1024 * 1024
+
+
+class DecodedAudio:
+    """
+    Mono float32 PCM of a media file's first audio stream.
+
+    Args:
+        samples: 1-D float32 array (possibly memory-mapped).
+        sample_rate: Sample rate of `samples`.
+        source: Path the audio was decoded from, if any.
+    """
+
+    def __init__(self, samples: np.ndarray, sample_rate: int, source: Optional[str] = None):
+        self.samples = samples
+        self.sample_rate = int(sample_rate)
+        self.source = source
+        self._content_hash: Optional[str] = None
+        self._resampled: Dict[int, "DecodedAudio"] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self) -> float:
+        return len(self.samples) / self.sample_rate
+
+    @property
+    def content_hash(self) -> str:
+        """sha256 of the PCM data and sample rate, hashed in chunks for memory-mapped buffers."""
+        if self._content_hash is None:
+            digest = hashlib.sha256(str(self.sample_rate).encode())
+            step = PIPE_CHUNK_BYTES // 4
+            for start in range(0, len(self.samples), step):
+                digest.update(np.ascontiguousarray(self.samples[start:start + step]).tobytes())
+            self._content_hash = digest.hexdigest()
+        return self._content_hash
+
+    def resampled(self, sample_rate: int) -> "DecodedAudio":
+        """Returns the audio at another sample rate, resampling in memory once per rate."""
+        sample_rate = int(sample_rate)
+        if sample_rate == self.sample_rate:
+            return self
+        with self._lock:
+            if sample_rate not in self._resampled:
+                from scipy.signal import resample_poly
+                factor = gcd(sample_rate, self.sample_rate)
+                samples = resample_poly(self.samples, sample_rate // factor, self.sample_rate // factor).astype(np.float32)
+                self._resampled[sample_rate] = DecodedAudio(samples, sample_rate, self.source)
+            return self._resampled[sample_rate]
+
+    def to_wav(self, path: str, subtype: str = "PCM_16") -> str:
+        """Writes the audio to a WAV file, block by block, and returns its path."""
+        step = self.sample_rate * 60
+        with sf.SoundFile(path, 'w', samplerate=self.sample_rate, channels=1, subtype=subtype) as output:
+            for start in range(0, len(self.samples), step):
+                output.write(self.samples[start:start + step])
+        return path
+
+
+def decode_audio(
+    path: str,
+    sample_rate: Optional[int] = None,
+    mmap_threshold_seconds: float = MMAP_THRESHOLD_SECONDS
+) -> DecodedAudio:
+    """
+    Decodes the first audio stream of a media file to mono float32 PCM.
+
+    Args:
+        path: Any file ffmpeg can read (audio or video).
+        sample_rate: Output sample rate; the stream's own rate when None.
+        mmap_threshold_seconds: Inputs longer than this are memory-mapped from an
+            unlinked temporary file instead of being held in RAM.
+
+    Returns:
+        The decoded audio.
+    """
+    info = probe(path)
+    stream = first_stream(info, 'audio')
+    if stream is None:
+        raise ValueError(f"No audio stream in {path}")
+    sample_rate = int(sample_rate or stream['sample_rate'])
+    duration = float(info.get('format', {}).get('duration') or 0)
+
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", path,
+               "-map", "0:a:0", "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "pipe:1"]
+    start_time = perf_counter()
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        if duration > mmap_threshold_seconds:
+            spool = tempfile.TemporaryFile()
+            for chunk in iter(lambda: process.stdout.read(PIPE_CHUNK_BYTES), b""):
+                spool.write(chunk)
+            data = None
+        else:
+            data = process.stdout.read()
+        stderr = process.stderr.read()
+    record_subprocess("audio decode", perf_counter() - start_time)
+    if process.returncode:
+        raise FFmpegError(f"audio decode of {path} failed: {stderr.decode(errors='replace').strip()}")
+
+    if data is not None:
+        samples = np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+    else:
+        size = spool.tell() - spool.tell() % 4
+        samples = np.memmap(spool, dtype=np.float32, mode='r', shape=(size // 4,)) if size else np.zeros(0, np.float32)
+        spool.close()  # The mapping keeps the data reachable
+    return DecodedAudio(samples, sample_rate, path)
+
+
+_decoded: "OrderedDict[Tuple, DecodedAudio]" = OrderedDict()
+_decoded_lock = threading.Lock()
+
+
+def get_decoded_audio(path: str, sample_rate: Optional[int] = None) -> DecodedAudio:
+    """
+    Returns the decoded audio of a file, decoding it only once per process.
+
+    Entries are keyed by (path, size, modification time, sample rate), so a file that is
+    rewritten is decoded again. The most recent few inputs are kept.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, sample_rate)
+    with _decoded_lock:
+        if key in _decoded:
+            _decoded.move_to_end(key)
+            return _decoded[key]
+
+    decoded = decode_audio(path, sample_rate)
+    with _decoded_lock:
+        _decoded[key] = decoded
+        while len(_decoded) > DEFAULT_MEMORY_ENTRIES:
+            _decoded.popitem(last=False)
+    return decoded
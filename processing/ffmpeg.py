@@ -0,0 +1,131 @@
+import os
+import json
+import logging
+import subprocess
+from functools import lru_cache
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+from utils.profiling import record_subprocess
+
+# Thin helpers around the ffmpeg/ffprobe command line tools. Native filter graphs and
+# stream copies are much faster than decoding frames into Python through moviepy, so the
+# media plumbing of the pipeline goes through these.
+
+FFMPEG = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+FFPROBE = os.environ.get("FFPROBE_BINARY", "ffprobe")
+
+# Video codecs each output container can hold without re-encoding. None means any codec.
+CONTAINER_VIDEO_CODECS = {
+    '.mp4': {'h264', 'hevc', 'mpeg4', 'av1'},
+    '.m4v': {'h264', 'hevc', 'mpeg4'},
+    '.mov': {'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'},
+    '.mkv': None,
+    '.webm': {'vp8', 'vp9', 'av1'},
+    '.avi': {'mpeg4', 'h264', 'mjpeg', 'msmpeg4v3'},
+    '.mpg': {'mpeg1video', 'mpeg2video'},
+}
+
+# Audio codecs each container can hold, and the encoder used when the input does not fit.
+CONTAINER_AUDIO_CODECS = {
+    '.mp4': ({'aac', 'mp3', 'alac'}, 'aac'),
+    '.m4v': ({'aac', 'mp3'}, 'aac'),
+    '.mov': ({'aac', 'mp3', 'alac', 'pcm_s16le'}, 'aac'),
+    '.mkv': (None, 'aac'),
+    '.webm': ({'opus', 'vorbis'}, 'libopus'),
+    '.avi': ({'mp3', 'pcm_s16le', 'ac3'}, 'libmp3lame'),
+    '.mpg': ({'mp2', 'mp3'}, 'mp2'),
+}
+
+
+class FFmpegError(RuntimeError):
+    pass
+
+
+def run_ffmpeg(args: List[str], description: str = "ffmpeg") -> None:
+    """
+    Runs ffmpeg with the given arguments, overwriting outputs and raising on failure.
+
+    Args:
+        args: Arguments after the binary name.
+        description: Short label used in log and error messages.
+    """
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-y"] + args
+    logging.debug(f"Running {description}: {' '.join(command)}")
+    start_time = perf_counter()
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    record_subprocess(description, perf_counter() - start_time)
+    if result.returncode != 0:
+        raise FFmpegError(f"{description} failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+@lru_cache(maxsize=None)
+def has_filter(name: str) -> bool:
+    """Returns whether the installed ffmpeg build provides the given filter."""
+    result = subprocess.run([FFMPEG, "-hide_banner", "-filters"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return any(line.split()[1:2] == [name] for line in result.stdout.decode(errors='replace').splitlines())
+
+
+def probe(path: str) -> Dict[str, Any]:
+    """Returns the ffprobe format and stream description of a media file."""
+    command = [FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise FFmpegError(f"ffprobe failed on {path}: {result.stderr.decode(errors='replace').strip()}")
+    return json.loads(result.stdout)
+
+
+def first_stream(info: Dict[str, Any], codec_type: str) -> Optional[Dict[str, Any]]:
+    return next((s for s in info.get('streams', []) if s.get('codec_type') == codec_type), None)
+
+
+def media_duration(path: str, info: Optional[Dict[str, Any]] = None) -> float:
+    info = info or probe(path)
+    return float(info['format']['duration'])
+
+
+def video_size(path: str, info: Optional[Dict[str, Any]] = None) -> tuple:
+    stream = first_stream(info or probe(path), 'video')
+    return int(stream['width']), int(stream['height'])
+
+
+def can_copy_video(info: Dict[str, Any], output_path: str) -> bool:
+    """Returns whether the first video stream of `info` can be stream-copied into `output_path`."""
+    stream = first_stream(info, 'video')
+    if stream is None:
+        return False
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext not in CONTAINER_VIDEO_CODECS:
+        return False
+    allowed = CONTAINER_VIDEO_CODECS[ext]
+    return allowed is None or stream.get('codec_name') in allowed
+
+
+def audio_codec_args(audio_info: Dict[str, Any], output_path: str) -> List[str]:
+    """Returns the audio codec arguments: a stream copy if the container accepts the codec."""
+    stream = first_stream(audio_info, 'audio')
+    ext = os.path.splitext(output_path)[1].lower()
+    allowed, encoder = CONTAINER_AUDIO_CODECS.get(ext, (set(), 'aac'))
+    if stream is not None and (allowed is None or stream.get('codec_name') in allowed):
+        return ["-c:a", "copy"]
+    return ["-c:a", encoder]
+
+
+def frame_rate(stream: Dict[str, Any]) -> float:
+    """Returns the frame rate of a video stream from its "num/den" r_frame_rate."""
+    numerator, _, denominator = stream.get('r_frame_rate', '0/1').partition('/')
+    return float(numerator) / float(denominator or 1) if float(denominator or 1) else 0.0
+
+
+def keyframe_times(path: str) -> List[float]:
+    """Returns the presentation times of the keyframes of the first video stream."""
+    command = [FFPROBE, "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise FFmpegError(f"ffprobe failed on {path}: {result.stderr.decode(errors='replace').strip()}")
+    times = []
+    for line in result.stdout.decode(errors='replace').splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            times.append(float(pts_time))
+    return sorted(times)
@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+from time import time
+from typing import Any, Callable, Dict, Optional, Tuple
+from utils.hashing import cached_hash_file, hash_file, hash_values
+
+# Persistent job journal backed by a content-addressed artifact store.
+#
+# Every stage output (extracted audio, TTS take, lip-synced video, comparison video...) is
+# stored under a key derived from the content of its inputs and its parameters, and
+# recorded in an append-only JSON-lines journal in the archive folder. When a task is
+# restarted or submitted again, each stage first looks its key up and skips the work if
+# the recorded artifact is still there and unchanged. A crash after an hour of lip sync
+# then only costs the stage that was running.
+
+ARTIFACTS_DIRNAME = "artifacts"
+JOURNAL_FILENAME = "journal.jsonl"
+
+
+class JobJournal:
+    """
+    Journal of stage artifacts for one archive folder.
+
+    Args:
+        archive_folder: Folder where the artifacts directory and journal are kept.
+    """
+
+    def __init__(self, archive_folder: str):
+        self.artifacts_dir = os.path.join(archive_folder, ARTIFACTS_DIRNAME)
+        self.journal_file = os.path.join(self.artifacts_dir, JOURNAL_FILENAME)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._by_path: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        os.makedirs(self.artifacts_dir, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a truncated last line; everything before it is valid
+                    continue
+                self._entries[entry['key']] = entry
+                self._by_path[os.path.abspath(entry['path'])] = entry
+
+    def stage_key(self, stage: str, inputs: Dict[str, Optional[str]], params: Dict[str, Any]) -> str:
+        """
+        Returns the key of a stage run from the content of its input files and its parameters.
+
+        Args:
+            stage: Stage name.
+            inputs: Named input file paths (None for absent inputs).
+            params: JSON-serialisable parameters that affect the output.
+        """
+        digests = {name: self.digest(path) if path else None for name, path in sorted(inputs.items())}
+        return hash_values(stage, digests, sorted(params.items()))
+
+    def digest(self, path: str) -> str:
+        """Returns the content hash of a file, reusing the digest recorded for our own artifacts."""
+        with self._lock:
+            entry = self._by_path.get(os.path.abspath(path))
+        if entry is not None and os.path.exists(path):
+            stat = os.stat(path)
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                return entry['sha256']
+        return cached_hash_file(path)
+
+    def artifact_path(self, key: str, name: str, extension: str) -> str:
+        return os.path.join(self.artifacts_dir, f"{name}_{key[:16]}{extension}")
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        Returns the artifact recorded for `key` if it still exists and is valid.
+
+        A file with the recorded size and modification time is trusted as is; if it was
+        touched since, its content hash is checked again.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or not os.path.exists(entry['path']):
+            return None
+        stat = os.stat(entry['path'])
+        if stat.st_size != entry['size']:
+            return None
+        if stat.st_mtime_ns != entry['mtime_ns'] and hash_file(entry['path']) != entry['sha256']:
+            return None
+        return entry['path']
+
+    def record(self, key: str, stage: str, path: str, params: Optional[Dict[str, Any]] = None) -> None:
+        stat = os.stat(path)
+        entry = {
+            'key': key,
+            'stage': stage,
+            'path': path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': hash_file(path),
+            'params': params or {},
+            'created': time()
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._by_path[os.path.abspath(path)] = entry
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def run_stage(
+        self,
+        stage: str,
+        name: str,
+        extension: str,
+        inputs: Dict[str, Optional[str]],
+        params: Dict[str, Any],
+        produce: Callable[[str], None]
+    ) -> Tuple[str, bool]:
+        """
+        Returns the artifact of a stage, running `produce` only if no valid one is recorded.
+
+        Args:
+            stage: Stage name.
+            name: Human readable prefix of the artifact file name.
+            extension: Artifact file extension, including the dot.
+            inputs: Named input file paths the output depends on.
+            params: Parameters the output depends on.
+            produce: Callable writing the artifact to the path it is given.
+
+        Returns:
+            The artifact path and whether it was reused from a previous run.
+        """
+        key = self.stage_key(stage, inputs, params)
+        # Concurrent tasks sharing inputs reach the same key: the first one produces the
+        # artifact, the others wait for it and reuse it
+        with self._lock_for(key):
+            existing = self.lookup(key)
+            if existing:
+                logging.info(f"Reusing {stage} artifact {existing}")
+                return existing, True
+
+            path = self.artifact_path(key, name, extension)
+            # Unique per process and thread: another process on the same archive folder never
+            # writes the same partial file
+            partial_path = self.artifact_path(key, name, f".{os.getpid()}-{threading.get_ident()}.partial{extension}")
+            try:
+                produce(partial_path)
+                os.replace(partial_path, path)
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            self.record(key, stage, path, params)
+            return path, False
+
+
+_journals: Dict[str, JobJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(archive_folder: str) -> JobJournal:
+    """Returns the shared journal of an archive folder."""
+    folder = os.path.abspath(archive_folder)
+    with _journals_lock:
+        if folder not in _journals:
+            _journals[folder] = JobJournal(folder)
+        return _journals[folder]
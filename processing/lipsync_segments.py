@@ -0,0 +1,292 @@
+import os
+import math
+import logging
+import tempfile
+from time import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from processing.decoded_audio import DecodedAudio, get_decoded_audio
+from processing.ffmpeg import (
+    audio_codec_args, first_stream, frame_rate, has_filter, keyframe_times, probe, run_ffmpeg
+)
+from utils.speech_detection import detect_speech_segments
+
+# Speech-segment-aware lip sync.
+#
+# Lip-sync inference costs the same on every frame, but frames where the new audio is
+# silent do not need it: the mouth should simply stay as it is in the source. The TTS take
+# is run through the VAD, speech spans (plus a small margin) are sent to the lip-sync
+# backend as separate short jobs, possibly in parallel, and everything in between is
+# stream-copied from the face video. Copied spans are snapped to source keyframes so they
+# can be cut without re-encoding; the render spans absorb the few frames in between. The
+# pieces are written as MP4 segments with exact frame counts and joined with the concat
+# demuxer, whose automatic h264_mp4toannexb conversion carries each segment's own
+# parameter sets, then the full TTS track is muxed on top.
+#
+# Output frame i shows source frame i % source_frames, like the lip-sync backend which
+# loops the face video when the audio is longer.
+
+LipSync = Callable[[str, str, str], Any]  # (face video, audio, output video)
+
+RENDER = "render"
+COPY = "copy"
+
+DEFAULT_MARGIN_SECONDS = 0.2
+DEFAULT_MERGE_GAP_SECONDS = 0.6  # Silences shorter than this stay inside the render span
+MIN_COPY_SECONDS = 0.5
+MAX_RENDER_FRACTION = 0.9  # Above this, segmenting costs more than it saves
+DEFAULT_SEGMENT_WORKERS = int(os.environ.get("DEEPFAKE_LIPSYNC_SEGMENT_WORKERS", "1"))
+SEGMENT_CODEC = ("libx264", "veryfast", 18)  # (encoder, preset, crf) of re-encoded segments
+
+
+class Span:
+    """A run of output frames that is either rendered by lip sync or copied from the source."""
+
+    def __init__(self, kind: str, start: int, end: int, source_start: int):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.source_start = source_start
+
+    @property
+    def frames(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self) -> str:
+        return f"Span({self.kind}, {self.start}-{self.end}, source {self.source_start})"
+
+
+def _merge(intervals: List[Tuple[int, int]], gap: int = 0) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _split_loops(start: int, end: int, source_frames: int) -> List[Tuple[int, int]]:
+    pieces = []
+    while start < end:
+        loop_end = (start // source_frames + 1) * source_frames
+        pieces.append((start, min(end, loop_end)))
+        start = loop_end
+    return pieces
+
+
+def plan_spans(
+    speech_segments: Sequence[Tuple[float, float]],
+    total_frames: int,
+    source_frames: int,
+    fps: float,
+    keyframes: Optional[Sequence[int]] = None,
+    margin: float = DEFAULT_MARGIN_SECONDS,
+    merge_gap: float = DEFAULT_MERGE_GAP_SECONDS,
+    min_copy_seconds: float = MIN_COPY_SECONDS
+) -> List[Span]:
+    """
+    Splits the output timeline into render and copy spans.
+
+    Args:
+        speech_segments: (start, end) speech times in the new audio, in seconds.
+        total_frames: Number of output frames (audio duration times fps).
+        source_frames: Number of frames in the face video.
+        fps: Frame rate of the face video.
+        keyframes: Source frame indices a copied span may start or end at. None allows
+            every frame (copied spans are then re-encoded).
+        margin: Seconds of context added around each speech segment.
+        merge_gap: Speech segments closer than this are rendered as one span.
+        min_copy_seconds: Shorter silences are rendered rather than copied.
+
+    Returns:
+        Spans covering [0, total_frames) in order; no span crosses a loop of the source.
+    """
+    render = []
+    for start, end in speech_segments:
+        first = max(0, int(math.floor((start - margin) * fps)))
+        last = min(total_frames, int(math.ceil((end + margin) * fps)))
+        if last > first:
+            render.append((first, last))
+    render = _merge(render, int(merge_gap * fps))
+
+    gaps, position = [], 0
+    for start, end in render + [(total_frames, total_frames)]:
+        if start > position:
+            gaps.append((position, start))
+        position = max(position, end)
+
+    min_copy = max(1, int(min_copy_seconds * fps))
+    copies = []
+    for gap_start, gap_end in gaps:
+        for start, end in _split_loops(gap_start, gap_end, source_frames):
+            base = start // source_frames * source_frames
+            source_start, source_end = start - base, end - base
+            if keyframes is not None:
+                index = bisect_left(keyframes, source_start)
+                source_start = keyframes[index] if index < len(keyframes) else source_end
+                if source_end < source_frames:
+                    index = bisect_right(keyframes, source_end) - 1
+                    source_end = keyframes[index] if index >= 0 else source_start
+            if source_end - source_start >= min_copy:
+                copies.append((base + source_start, base + source_end))
+                if source_start > start - base:
+                    render.append((start, base + source_start))
+                if source_end < end - base:
+                    render.append((base + source_end, end))
+            else:
+                render.append((start, end))
+
+    pieces = []
+    for start, end in _merge(render):
+        pieces.extend(_split_loops(start, end, source_frames))
+    spans = [Span(RENDER, start, end, start % source_frames) for start, end in pieces]
+    spans += [Span(COPY, start, end, start % source_frames) for start, end in copies]
+    return sorted(spans, key=lambda span: span.start)
+
+
+def _encode_frames(source: str, start_time: float, frames: int, fps_expr: str, size: Tuple[int, int], pix_fmt: str, output: str) -> None:
+    # Frame-accurate cut (input seeking with re-encode), forced to the source frame rate
+    # and size, padded by repeating the last frame if the input runs short
+    encoder, preset, crf = SEGMENT_CODEC
+    filters = [f"fps={fps_expr}", f"scale={size[0]}:{size[1]}"]
+    if has_filter("tpad"):
+        filters.append("tpad=stop=-1:stop_mode=clone")
+    run_ffmpeg(
+        ["-ss", f"{start_time:.6f}", "-i", source, "-map", "0:v:0", "-an",
+         "-vf", ",".join(filters), "-frames:v", str(frames),
+         "-c:v", encoder, "-preset", preset, "-crf", str(crf), "-pix_fmt", pix_fmt, "-r", fps_expr,
+         "-use_editlist", "0", output],
+        description="segment encode"
+    )
+
+
+def _copy_frames(source: str, start_time: float, frames: int, output: str) -> None:
+    # Without an edit list, the keyframe the seek lands on is not hidden as pre-roll
+    run_ffmpeg(
+        ["-ss", f"{start_time:.6f}", "-i", source, "-map", "0:v:0", "-an",
+         "-c:v", "copy", "-frames:v", str(frames), "-use_editlist", "0", output],
+        description="segment copy"
+    )
+
+
+def segmented_lip_sync(
+    face_video: str,
+    audio_file: str,
+    output_file: str,
+    lipsync: LipSync,
+    margin: float = DEFAULT_MARGIN_SECONDS,
+    workers: int = DEFAULT_SEGMENT_WORKERS,
+    work_dir: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Lip-syncs `face_video` to `audio_file`, running inference on speech spans only.
+
+    Falls back to a single `lipsync` call over the whole video for still images, when
+    the audio has no silences worth skipping, or when the face video cannot be cut.
+
+    Args:
+        face_video: Face video (or image) to animate.
+        audio_file: New speech track.
+        output_file: Path of the lip-synced video.
+        lipsync: Backend callable taking (face video, audio, output path).
+        margin: Seconds of context added around each speech segment.
+        workers: Number of render spans sent to the backend concurrently.
+        work_dir: Folder for intermediate segments (system temp folder when None).
+
+    Returns:
+        Stats: 'mode' ("copy", "reencode" or "whole"), 'frames', 'rendered_frames',
+        'skipped_fraction', 'render_spans', 'copy_spans' and 'elapsed'.
+    """
+    start_time = time()
+    info = probe(face_video)
+    stream = first_stream(info, 'video')
+    fps = frame_rate(stream) if stream else 0.0
+    duration = float(info.get('format', {}).get('duration') or 0)
+    source_frames = int(stream.get('nb_frames') or round(duration * fps)) if stream else 0
+    tts = get_decoded_audio(audio_file)
+    total_frames = int(round(tts.duration * fps))
+
+    def whole(reason: str) -> Dict[str, Any]:
+        logging.info(f"Lip syncing {face_video} in one pass: {reason}")
+        lipsync(face_video, audio_file, output_file)
+        return {
+            'mode': "whole", 'frames': total_frames, 'rendered_frames': total_frames, 'skipped_fraction': 0.0,
+            'render_spans': 1, 'copy_spans': 0, 'elapsed': time() - start_time
+        }
+
+    if stream is None or fps <= 0 or source_frames < 2 or total_frames < 2:
+        return whole("not a video")
+
+    stream_start = float(stream.get('start_time') or 0)
+    mode = "copy" if stream.get('codec_name') == 'h264' else "reencode"
+    keyframes = None
+    if mode == "copy":
+        keyframes = sorted({int(round((t - stream_start) * fps)) for t in keyframe_times(face_video)})
+
+    speech = detect_speech_segments(tts.samples, tts.sample_rate)
+    spans = plan_spans(speech, total_frames, source_frames, fps, keyframes, margin)
+    rendered_frames = sum(span.frames for span in spans if span.kind == RENDER)
+    if rendered_frames > MAX_RENDER_FRACTION * total_frames:
+        return whole(f"speech covers {rendered_frames / total_frames:.0%} of the frames")
+
+    fps_expr = stream['r_frame_rate']
+    size = (int(stream['width']), int(stream['height']))
+    pix_fmt = stream.get('pix_fmt') or "yuv420p"
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        segment_files = [os.path.join(tmp_dir, f"segment_{i:04d}.mp4") for i in range(len(spans))]
+
+        def render(index: int, span: Span) -> None:
+            face_clip = os.path.join(tmp_dir, f"face_{index:04d}.mp4")
+            audio_clip = os.path.join(tmp_dir, f"audio_{index:04d}.wav")
+            rendered = os.path.join(tmp_dir, f"rendered_{index:04d}.mp4")
+            _encode_frames(face_video, stream_start + span.source_start / fps, span.frames, fps_expr, size, pix_fmt, face_clip)
+            first_sample = int(span.start / fps * tts.sample_rate)
+            last_sample = int(span.end / fps * tts.sample_rate)
+            DecodedAudio(tts.samples[first_sample:last_sample], tts.sample_rate).to_wav(audio_clip)
+            lipsync(face_clip, audio_clip, rendered)
+            _encode_frames(rendered, 0.0, span.frames, fps_expr, size, pix_fmt, segment_files[index])
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [executor.submit(render, i, span) for i, span in enumerate(spans) if span.kind == RENDER]
+            for i, span in enumerate(spans):
+                if span.kind != COPY:
+                    continue
+                # Half a frame past the keyframe time so float rounding cannot seek to the previous one
+                seek = stream_start + (span.source_start + 0.5) / fps
+                if mode == "copy":
+                    _copy_frames(face_video, seek, span.frames, segment_files[i])
+                else:
+                    _encode_frames(face_video, stream_start + span.source_start / fps, span.frames, fps_expr, size, pix_fmt, segment_files[i])
+            for future in futures:
+                future.result()
+
+        list_file = os.path.join(tmp_dir, "segments.txt")
+        with open(list_file, "w") as f:
+            for path in segment_files:
+                f.write(f"file '{path}'\n")
+        container_args = ["-movflags", "+faststart"] if os.path.splitext(output_file)[1].lower() in (".mp4", ".mov", ".m4v") else []
+        run_ffmpeg(
+            ["-f", "concat", "-safe", "0", "-i", list_file, "-i", audio_file,
+             "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy"]
+            + audio_codec_args(probe(audio_file), output_file)
+            + ["-shortest"] + container_args + [output_file],
+            description="segment stitch"
+        )
+
+    stats = {
+        'mode': mode,
+        'frames': total_frames,
+        'rendered_frames': rendered_frames,
+        'skipped_fraction': 1 - rendered_frames / total_frames,
+        'render_spans': sum(span.kind == RENDER for span in spans),
+        'copy_spans': sum(span.kind == COPY for span in spans),
+        'elapsed': time() - start_time
+    }
+    logging.info(
+        f"Lip sync of {face_video}: {stats['render_spans']} speech span(s) rendered, "
+        f"{stats['skipped_fraction']:.0%} of {total_frames} frames skipped inference ({mode})"
+    )
+    return stats
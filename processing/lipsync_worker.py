@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import queue
+import socket
+import select
+import logging
+import argparse
+import itertools
+import threading
+import subprocess
+import socketserver
+from time import sleep, time
+from typing import Any, Callable, Dict, Optional
+
+# Long-lived lip-sync worker.
+#
+# Launching video-retalking's inference.py once per call pays for the interpreter start
+# and for loading a dozen checkpoints (RetinaFace, GFPGAN, GPEN, LNet, DNet, ENet...) every
+# time. This server loads a backend once and serves lip-sync jobs over a TCP socket with a
+# JSON-lines protocol. Each connection sends one request line and receives event lines:
+#
+#   -> {"op": "lipsync", "face": "/data/face.mp4", "audio": "/data/take.wav", "outfile": "/data/out.mp4"}
+#   <- {"event": "queued", "job": 3, "position": 1}
+#   <- {"event": "started", "job": 3}
+#   <- {"event": "progress", "job": 3, "message": "...", "fraction": 0.5}
+#   <- {"event": "done", "job": 3, "outfile": "/data/out.mp4", "elapsed": 12.3}
+#
+# or {"event": "busy"} when the bounded queue is full, and {"event": "error", "error": ...}
+# on failure. A client closing its connection drops its job if it has not started yet, so
+# clients keep the connection open (no half-close) until the job is done. {"op": "ping"} returns the backend name and queue state. Paths are read and
+# written by the worker, so they must be visible to it (shared volume in Docker).
+#
+# The module only depends on the standard library so it can be copied into the lip-sync
+# image on its own: python3 lipsync_worker.py --backend retalking --repo /video-retalking
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 8
+DISCONNECT_POLL_SECONDS = 0.5  # How often a handler checks that its waiting client is still there
+
+Progress = Callable[[str, Optional[float]], None]
+
+
+class LipSyncBackend:
+    """Interface of the models behind the worker. `load` runs once, `run` once per job."""
+
+    name = "base"
+
+    def load(self) -> None:
+        pass
+
+    def run(self, face: str, audio: str, outfile: str, progress: Progress) -> None:
+        raise NotImplementedError
+
+
+class StubBackend(LipSyncBackend):
+    """
+    CPU stand-in that muxes the audio onto the face video without any model.
+
+    The face video is looped or cut to the audio length like the real backend does, so
+    the client, the queueing and the pipeline integration can be exercised anywhere.
+
+    Args:
+        delay: Seconds to sleep per job, to simulate inference time.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay: float = 0.0, ffmpeg: str = os.environ.get("FFMPEG_BINARY", "ffmpeg")):
+        self.delay = delay
+        self.ffmpeg = ffmpeg
+
+    def run(self, face: str, audio: str, outfile: str, progress: Progress) -> None:
+        steps = 4
+        for step in range(steps):
+            progress("Stub inference", step / steps)
+            sleep(self.delay / steps)
+        command = [
+            self.ffmpeg, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+            "-stream_loop", "-1", "-i", face, "-i", audio,
+            "-map", "0:v:0", "-map", "1:a:0", "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac",
+            "-shortest", outfile
+        ]
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"stub mux failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+class RetalkingBackend(LipSyncBackend):
+    """
+    video-retalking, run in-process with its models kept loaded between jobs.
+
+    inference.py builds every network inside main(). The constructors it calls are
+    replaced by memoised versions keyed on their checkpoint arguments, so the first job
+    loads the checkpoints and later jobs reuse them. Jobs run in the repository folder,
+    as the script expects, and one at a time.
+
+    Args:
+        repo_dir: Checkout of video-retalking with its checkpoints folder.
+    """
+
+    name = "retalking"
+    MODEL_FACTORIES = ("load_model", "load_face3d_net", "FaceEnhancement", "GFPGANer", "KeypointExtractor", "Croper")
+
+    def __init__(self, repo_dir: str = "/video-retalking"):
+        self.repo_dir = os.path.abspath(repo_dir)
+        self.inference = None
+        self._lock = threading.Lock()  # inference.py keeps its arguments in a module global
+
+    def load(self) -> None:
+        os.chdir(self.repo_dir)
+        sys.path.insert(0, self.repo_dir)
+        argv = sys.argv
+        # inference.py parses the command line at import time
+        sys.argv = ["inference.py", "--face", "", "--audio", ""]
+        try:
+            import inference
+        finally:
+            sys.argv = argv
+        for name in self.MODEL_FACTORIES:
+            if hasattr(inference, name):
+                setattr(inference, name, _memoise(getattr(inference, name)))
+        self.inference = inference
+
+    def run(self, face: str, audio: str, outfile: str, progress: Progress) -> None:
+        with self._lock:
+            argv = sys.argv
+            sys.argv = ["inference.py", "--face", face, "--audio", audio, "--outfile", outfile]
+            try:
+                self.inference.args = self.inference.options()
+            finally:
+                sys.argv = argv
+            progress("Running video-retalking", None)
+            self.inference.main()
+        if not os.path.exists(outfile):
+            raise RuntimeError("video-retalking finished without writing its output")
+
+
+def _cache_key(value: Any) -> Any:
+    # argparse namespaces carry per-job paths; only the checkpoint paths identify a model
+    if isinstance(value, argparse.Namespace):
+        return tuple(sorted((k, v) for k, v in vars(value).items() if k.endswith("_path")))
+    return repr(value)
+
+
+def _memoise(factory: Callable) -> Callable:
+    cache: Dict[Any, Any] = {}
+    lock = threading.Lock()
+
+    def wrapper(*args, **kwargs):
+        key = (tuple(_cache_key(a) for a in args), tuple(sorted((k, _cache_key(v)) for k, v in kwargs.items())))
+        with lock:
+            if key not in cache:
+                logging.info(f"Loading {getattr(factory, '__name__', factory)}")
+                cache[key] = factory(*args, **kwargs)
+            return cache[key]
+
+    return wrapper
+
+
+BACKENDS = {
+    'stub': StubBackend,
+    'retalking': RetalkingBackend,
+}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id: int, face: str, audio: str, outfile: str):
+        self.job_id = job_id
+        self.face = face
+        self.audio = audio
+        self.outfile = outfile
+        self.events: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def emit(self, event: str, **fields) -> None:
+        self.events.put(dict(event=event, job=self.job_id, **fields))
+
+
+class LipSyncWorker:
+    """
+    Runs lip-sync jobs on a loaded backend from a bounded queue.
+
+    Args:
+        backend: Backend serving the jobs; loaded when the worker starts.
+        max_queue: Maximum number of jobs waiting; further submissions are refused.
+        concurrency: Number of jobs run at once (1 for GPU backends).
+    """
+
+    def __init__(self, backend: LipSyncBackend, max_queue: int = DEFAULT_MAX_QUEUE, concurrency: int = 1):
+        self.backend = backend
+        self.queue: "queue.Queue[Job]" = queue.Queue(maxsize=max_queue)
+        self.concurrency = concurrency
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self) -> None:
+        start_time = time()
+        self.backend.load()
+        logging.info(f"Backend '{self.backend.name}' loaded in {time() - start_time:.1f}s")
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._work, name=f"lipsync-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, face: str, audio: str, outfile: str) -> Job:
+        job = Job(next(self._ids), face, audio, outfile)
+        # Emitted first so it always precedes "started"; discarded with the job if refused
+        job.emit("queued", position=self.queue.qsize() + 1)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFull()
+        return job
+
+    def _work(self) -> None:
+        while True:
+            job = self.queue.get()
+            if job.cancelled.is_set():
+                continue
+            with self._lock:
+                self.active += 1
+            start_time = time()
+            job.emit("started")
+            try:
+                self.backend.run(
+                    job.face, job.audio, job.outfile,
+                    lambda message, fraction=None: job.emit("progress", message=message, fraction=fraction)
+                )
+                job.emit("done", outfile=job.outfile, elapsed=time() - start_time)
+                outcome = 'completed'
+            except Exception as e:
+                logging.exception(f"Lip-sync job {job.job_id} failed")
+                job.emit("error", error=str(e))
+                outcome = 'failed'
+            with self._lock:
+                self.active -= 1
+                setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'backend': self.backend.name,
+                'queued': self.queue.qsize(),
+                'max_queue': self.queue.maxsize,
+                'active': self.active,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def _send(self, message: Dict[str, Any]) -> bool:
+        try:
+            self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+    def handle(self) -> None:
+        worker: LipSyncWorker = self.server.worker
+        try:
+            request = json.loads(self.rfile.readline() or b"{}")
+        except json.JSONDecodeError as e:
+            self._send({'event': "error", 'error': f"invalid request: {e}"})
+            return
+
+        op = request.get('op')
+        if op == "ping":
+            self._send(dict(event="pong", **worker.stats()))
+            return
+        if op != "lipsync":
+            self._send({'event': "error", 'error': f"unknown op {op!r}"})
+            return
+
+        missing = [field for field in ("face", "audio", "outfile") if not request.get(field)]
+        if missing:
+            self._send({'event': "error", 'error': f"missing field(s): {', '.join(missing)}"})
+            return
+        try:
+            job = worker.submit(request['face'], request['audio'], request['outfile'])
+        except QueueFull:
+            self._send({'event': "busy", **worker.stats()})
+            return
+
+        while True:
+            try:
+                event = job.events.get(timeout=DISCONNECT_POLL_SECONDS)
+            except queue.Empty:
+                if self._client_gone():
+                    # Dropped if it has not started yet; a running job finishes regardless
+                    logging.info(f"Client of lip-sync job {job.job_id} disconnected")
+                    job.cancelled.set()
+                    return
+                continue
+            if not self._send(event):
+                job.cancelled.set()
+                return
+            if event['event'] in ("done", "error"):
+                return
+
+    def _client_gone(self) -> bool:
+        # The client sends nothing after its request, so a readable socket means EOF
+        # (or a reset), which a peek tells apart from unexpected extra data
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(worker: LipSyncWorker, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> _Server:
+    """Starts the worker and returns the server; call serve_forever() on it."""
+    worker.start()
+    server = _Server((host, port), _Handler)
+    server.worker = worker
+    logging.info(f"Lip-sync worker listening on {host}:{server.server_address[1]}")
+    return server
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Persistent lip-sync worker.")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="stub")
+    parser.add_argument("--repo", default="/video-retalking", help="video-retalking checkout (retalking backend)")
+    parser.add_argument("--stub-delay", type=float, default=0.0, help="Simulated seconds per job (stub backend)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="Jobs allowed to wait")
+    parser.add_argument("--concurrency", type=int, default=1, help="Jobs run at once")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    backend = RetalkingBackend(args.repo) if args.backend == "retalking" else StubBackend(args.stub_delay)
+    server = serve(LipSyncWorker(backend, args.max_queue, args.concurrency), args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
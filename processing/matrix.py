@@ -0,0 +1,377 @@
+import os
+import re
+import csv
+import json
+import queue
+import shutil
+import logging
+import argparse
+import threading
+from functools import partial
+from time import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from processing import audio
+from processing.model_registry import default_device
+from processing.pipeline import TaskContext, compare, lip_sync, prepare_audio, prepare_video, synthesize, traced
+from processing.scheduler import COMPLETED, Scheduler, Stage, get_scheduler
+from utils.profiling import annotate
+
+# Headless voice x video cross-test runner.
+#
+# A matrix spec lists target voices, face videos and the text to say:
+#
+#   {
+#     "name": "crosstest",
+#     "output_dir": "results/crosstest",
+#     "voices": {"alice": "voices/alice.wav", "bob": "clips/bob.mp4"},
+#     "videos": {"v1": "clips/v1.mp4", "v2": "clips/v2.mp4"},
+#     "text": "Bonjour...",
+#     "examples": 4,
+#     "downscale_percentage": 50,
+#     "comparison_layout": "grid"
+#   }
+#
+# Every voice x video pair is a cell with `examples` lip-synced takes. The whole matrix is
+# one scheduler job whose stages are shared wherever the work is the same:
+#
+#   voice_<v> (tts)       decode the voice and compute its conditioning latents, once
+#   video_<f> (encode)    downscaled proxy of the video, once
+#   tts_<v>_<i> (tts)     take i in voice v, reused by every video
+#   lipsync_<v>_<f>_<i>   lip sync of take i on video f
+#   compare_<v>_<f>       comparison video of the cell
+#
+# A failing stage only fails the cells that depend on it. All stages share the journal of
+# the output folder, so re-running a spec resumes where it stopped. Results go to
+#
+#   <output_dir>/cells/<voice>__<video>/example_<i>.mp4, comparison.mp4, trace.json
+#   <output_dir>/summary.json, summary.csv, summary.md
+
+DEFAULT_EXAMPLES = 4
+CELL_SEPARATOR = "__"
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", str(name)).strip("-") or "x"
+
+
+def _named(entries: Any) -> Dict[str, str]:
+    # Voices and videos can be given as {name: path} or as a list of paths
+    if isinstance(entries, dict):
+        return {_slug(name): path for name, path in entries.items()}
+    return {_slug(os.path.splitext(os.path.basename(path))[0]): path for path in entries}
+
+
+def load_spec(path: str) -> Dict[str, Any]:
+    """Reads a matrix spec (JSON, or YAML when PyYAML is installed) and validates it."""
+    with open(path, encoding='utf-8') as spec_file:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+            spec = yaml.safe_load(spec_file)
+        else:
+            spec = json.load(spec_file)
+    base = os.path.dirname(os.path.abspath(path))
+    spec['voices'] = {k: os.path.join(base, v) for k, v in _named(spec.get('voices') or {}).items()}
+    spec['videos'] = {k: os.path.join(base, v) for k, v in _named(spec.get('videos') or {}).items()}
+    spec.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    spec['output_dir'] = os.path.join(base, spec.get('output_dir') or os.path.join("results", spec['name']))
+
+    problems = []
+    if not spec['voices'] or not spec['videos']:
+        problems.append("the spec needs at least one voice and one video")
+    if not spec.get('text'):
+        problems.append("the spec has no text")
+    if int(spec.get('examples', DEFAULT_EXAMPLES)) < 1:
+        problems.append("examples must be at least 1")
+    problems += [f"missing file {p}" for p in list(spec['voices'].values()) + list(spec['videos'].values()) if not os.path.exists(p)]
+    if problems:
+        raise ValueError(f"Invalid matrix spec {path}: {'; '.join(problems)}")
+    return spec
+
+
+class Cell:
+    """One voice x video combination and what happened to it."""
+
+    def __init__(self, voice: str, video: str, ctx: TaskContext, directory: str):
+        self.voice = voice
+        self.video = video
+        self.ctx = ctx
+        self.directory = directory
+        self.finished_at: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.voice}{CELL_SEPARATOR}{self.video}"
+
+
+class Matrix:
+    """
+    Stages and state of a cross-test matrix.
+
+    Args:
+        spec: Spec as returned by load_spec.
+        device: Torch device used for TTS.
+    """
+
+    def __init__(self, spec: Dict[str, Any], device: str):
+        self.spec = spec
+        self.device = device
+        self.output_dir = spec['output_dir']
+        self.examples = int(spec.get('examples', DEFAULT_EXAMPLES))
+        self.started_at: Optional[float] = None
+        self.failed: Dict[str, str] = {}  # Stage name -> error, for the stages that failed
+        self._lock = threading.Lock()
+
+        # Shared stages run on contexts of their own; cells copy their outputs
+        self.voice_ctx = {name: self._context(f"voice {name}", path, path, "voices") for name, path in spec['voices'].items()}
+        self.video_ctx = {name: self._context(f"video {name}", path, None, "videos") for name, path in spec['videos'].items()}
+        self.cells: Dict[Tuple[str, str], Cell] = {}
+        for voice, voice_path in spec['voices'].items():
+            for video, video_path in spec['videos'].items():
+                name = f"{voice}{CELL_SEPARATOR}{video}"
+                directory = os.path.join(self.output_dir, "cells", name)
+                ctx = self._context(name, video_path, voice_path, None)
+                ctx.trace_file = os.path.join(directory, "trace.json")
+                self.cells[voice, video] = Cell(voice, video, ctx, directory)
+
+    def _context(self, name: str, video_file: str, audio_file: Optional[str], trace_folder: Optional[str]) -> TaskContext:
+        ctx = TaskContext({
+            'task_name': name,
+            'video_file': video_file,
+            'audio_file': audio_file,
+            'use_video_audio': False,
+            'tts_text': self.spec['text'],
+            'iterations': self.examples,
+            'archive_folder': self.output_dir,
+            'downscale_percentage': int(self.spec.get('downscale_percentage', 100)),
+            'comparison_layout': self.spec.get('comparison_layout', 'concat'),
+            'streaming_tts': bool(self.spec.get('streaming_tts', False)),
+            'segmented_lipsync': bool(self.spec.get('segmented_lipsync', True)),
+        }, self.device)
+        if trace_folder:
+            ctx.trace_file = os.path.join(self.output_dir, trace_folder, f"{_slug(name.split(' ', 1)[1])}_trace.json")
+        return ctx
+
+    def _cells_of(self, voice: Optional[str] = None, video: Optional[str] = None) -> List[Cell]:
+        return [c for (v, f), c in self.cells.items() if voice in (None, v) and video in (None, f)]
+
+    def _guarded(self, name: str, depends_on: List[str], fn: Callable[[Callable[[str], None]], None]) -> Callable:
+        # Failures are recorded instead of raised, so one bad cell does not stop the matrix;
+        # stages whose dependencies failed are skipped.
+        def run(report):
+            with self._lock:
+                blocked = next((d for d in depends_on if d in self.failed), None)
+                if blocked:
+                    self.failed[name] = f"skipped, {blocked} failed"
+                    return
+            try:
+                fn(report)
+            except Exception as e:
+                logging.exception(f"Matrix stage {name} failed")
+                with self._lock:
+                    self.failed[name] = str(e)
+        return run
+
+    def _stage(self, name: str, resource: str, ctx: TaskContext, fn: Callable, label: str, depends_on: List[str] = ()) -> Stage:
+        depends_on = list(depends_on)
+        return Stage(name, resource, self._guarded(name, depends_on, partial(traced, ctx, name, resource, fn)), label, depends_on)
+
+    def _prepare_voice(self, voice: str, report) -> None:
+        ctx = self.voice_ctx[voice]
+        os.makedirs(os.path.dirname(ctx.trace_file), exist_ok=True)
+        prepare_audio(ctx, report)
+        load_time, conditioning_time = audio.condition_speaker(ctx.reference_audio, ctx.device)
+        annotate(model_load_seconds=round(load_time, 3), conditioning_seconds=round(conditioning_time, 3))
+        for cell in self._cells_of(voice=voice):
+            cell.ctx.reference_file, cell.ctx.reference_audio = ctx.reference_file, ctx.reference_audio
+
+    def _prepare_video(self, video: str, report) -> None:
+        ctx = self.video_ctx[video]
+        os.makedirs(os.path.dirname(ctx.trace_file), exist_ok=True)
+        prepare_video(ctx, report)
+        for cell in self._cells_of(video=video):
+            cell.ctx.video_file, cell.ctx.original_resolution = ctx.video_file, ctx.original_resolution
+
+    def _synthesize(self, voice: str, iteration: int, report) -> None:
+        ctx = self.voice_ctx[voice]
+        synthesize(ctx, iteration, report)
+        for cell in self._cells_of(voice=voice):
+            cell.ctx.tts_files[iteration] = ctx.tts_files[iteration]
+
+    def _lip_sync(self, cell: Cell, iteration: int, report) -> None:
+        os.makedirs(cell.directory, exist_ok=True)
+        lip_sync(cell.ctx, iteration, report)
+        _export(cell.ctx.output_video_files[iteration], os.path.join(cell.directory, f"example_{iteration}.mp4"))
+
+    def _compare(self, cell: Cell, report) -> None:
+        compare(cell.ctx, report)
+        _export(cell.ctx.comparison_video_file, os.path.join(cell.directory, "comparison.mp4"))
+        cell.finished_at = time()
+
+    def build_stages(self) -> List[Stage]:
+        """The matrix DAG: shared voice, video and TTS stages fanning out to the cells."""
+        stages = []
+        for voice in self.voice_ctx:
+            stages.append(self._stage(f"voice_{voice}", "tts", self.voice_ctx[voice], partial(self._prepare_voice, voice), f"Voice {voice}"))
+            for i in range(self.examples):
+                stages.append(self._stage(
+                    f"tts_{voice}_{i}", "tts", self.voice_ctx[voice], partial(self._synthesize, voice, i),
+                    f"TTS {voice} {i + 1}/{self.examples}", [f"voice_{voice}"]
+                ))
+        for video in self.video_ctx:
+            stages.append(self._stage(f"video_{video}", "encode", self.video_ctx[video], partial(self._prepare_video, video), f"Video {video}"))
+        for (voice, video), cell in self.cells.items():
+            lipsyncs = []
+            for i in range(self.examples):
+                lipsyncs.append(f"lipsync_{cell.name}_{i}")
+                stages.append(self._stage(
+                    lipsyncs[-1], "lipsync", cell.ctx, partial(self._lip_sync, cell, i),
+                    f"Lip sync {cell.name} {i + 1}/{self.examples}", [f"tts_{voice}_{i}", f"video_{video}"]
+                ))
+            stages.append(self._stage(
+                f"compare_{cell.name}", "encode", cell.ctx, partial(self._compare, cell),
+                f"Comparison {cell.name}", lipsyncs
+            ))
+        return stages
+
+    def cell_error(self, cell: Cell) -> Optional[str]:
+        """The first failure among the stages the cell depends on, if any."""
+        names = [f"voice_{cell.voice}", f"video_{cell.video}"]
+        names += [f"tts_{cell.voice}_{i}" for i in range(self.examples)]
+        names += [f"lipsync_{cell.name}_{i}" for i in range(self.examples)]
+        names.append(f"compare_{cell.name}")
+        return next((f"{name}: {self.failed[name]}" for name in names if name in self.failed and not self.failed[name].startswith("skipped")), None)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """One row of timings per cell; shared stage times are reported with how many cells share them."""
+        def walls(ctx: TaskContext, prefix: str) -> float:
+            return sum(r['wall_seconds'] for r in ctx.trace.records if r['name'].startswith(prefix))
+
+        videos_per_voice = len(self.video_ctx)
+        voices_per_video = len(self.voice_ctx)
+        rows = []
+        for (voice, video), cell in self.cells.items():
+            error = self.cell_error(cell)
+            stats = cell.ctx.lipsync_stats.values()
+            rows.append({
+                'voice': voice,
+                'video': video,
+                'status': "failed" if error else "done",
+                'error': error or "",
+                'voice_seconds': round(walls(self.voice_ctx[voice], "voice_"), 2),
+                'video_seconds': round(walls(self.video_ctx[video], "video_"), 2),
+                'tts_seconds': round(walls(self.voice_ctx[voice], f"tts_{voice}_"), 2),
+                'lipsync_seconds': round(walls(cell.ctx, "lipsync_"), 2),
+                'compare_seconds': round(walls(cell.ctx, "compare_"), 2),
+                'skipped_fraction': round(sum(s['skipped_fraction'] for s in stats) / len(stats), 3) if stats else None,
+                'shared_voice_with': videos_per_voice,
+                'shared_video_with': voices_per_video,
+                'ready_after_seconds': round(cell.finished_at - self.started_at, 2) if cell.finished_at and self.started_at else None,
+                'directory': os.path.relpath(cell.directory, self.output_dir),
+            })
+        return rows
+
+    def write_summary(self) -> List[Dict[str, Any]]:
+        rows = self.summary()
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, "summary.json"), 'w', encoding='utf-8') as output:
+            json.dump({
+                'name': self.spec['name'],
+                'elapsed_seconds': round(time() - self.started_at, 2) if self.started_at else None,
+                'cells': rows
+            }, output, indent=2)
+        with open(os.path.join(self.output_dir, "summary.csv"), 'w', newline='', encoding='utf-8') as output:
+            writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        with open(os.path.join(self.output_dir, "summary.md"), 'w', encoding='utf-8') as output:
+            output.write(format_table(rows) + "\n")
+        return rows
+
+
+def _export(artifact: Optional[str], destination: str) -> None:
+    # Results are hard links to the journal artifacts when the filesystem allows it
+    if not artifact:
+        return
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(artifact, destination)
+    except OSError:
+        shutil.copy2(artifact, destination)
+
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    """Markdown table of the per-cell timings (shared stage times marked with /N)."""
+    header = "| voice | video | status | voice prep | video prep | TTS | lip sync | compare | skipped | ready after |"
+    lines = [header, "|" + "---|" * (header.count("|") - 1)]
+    for row in rows:
+        skipped = f"{row['skipped_fraction']:.0%}" if row['skipped_fraction'] is not None else "-"
+        ready = f"{row['ready_after_seconds']:.1f}s" if row['ready_after_seconds'] is not None else "-"
+        lines.append(
+            f"| {row['voice']} | {row['video']} | {row['status']} "
+            f"| {row['voice_seconds']:.1f}s /{row['shared_voice_with']} | {row['video_seconds']:.1f}s /{row['shared_video_with']} "
+            f"| {row['tts_seconds']:.1f}s /{row['shared_voice_with']} | {row['lipsync_seconds']:.1f}s | {row['compare_seconds']:.1f}s "
+            f"| {skipped} | {ready} |"
+        )
+    return "\n".join(lines)
+
+
+def run_matrix(
+    spec: Dict[str, Any],
+    device: str,
+    scheduler: Optional[Scheduler] = None,
+    progress: Callable[[str], None] = print
+) -> List[Dict[str, Any]]:
+    """
+    Runs a cross-test matrix to completion and writes its summary.
+
+    Args:
+        spec: Spec as returned by load_spec.
+        device: Torch device used for TTS.
+        scheduler: Scheduler to run on (the process-wide one by default).
+        progress: Called with every progress message.
+
+    Returns:
+        The summary rows, one per cell.
+    """
+    matrix = Matrix(spec, device)
+    os.makedirs(matrix.output_dir, exist_ok=True)
+    with open(os.path.join(matrix.output_dir, "spec.json"), 'w', encoding='utf-8') as output:
+        json.dump(spec, output, indent=2)
+
+    listener: "queue.Queue" = queue.Queue()
+    matrix.started_at = time()
+    job = (scheduler or get_scheduler()).submit(f"matrix {spec['name']}", matrix.build_stages(), spec.get('priority', 0), listener)
+    while True:
+        event = listener.get()
+        progress(event.message)
+        if event.final:
+            break
+    for ctx in matrix.video_ctx.values():
+        ctx.release_proxy()  # The cells lip-synced from these proxies
+    if job.status != COMPLETED:
+        logging.warning(f"Matrix {spec['name']} ended as {job.status}")
+    return matrix.write_summary()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a voice x video cross-test matrix without the UI.")
+    parser.add_argument("spec", help="Matrix spec (JSON or YAML)")
+    parser.add_argument("--output-dir", help="Overrides the spec's output_dir")
+    parser.add_argument("--device", help="Torch device (cuda when available by default)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    spec = load_spec(args.spec)
+    if args.output_dir:
+        spec['output_dir'] = os.path.abspath(args.output_dir)
+    device = args.device or default_device()
+
+    rows = run_matrix(spec, device)
+    print(format_table(rows))
+    print(f"Results in {spec['output_dir']}")
+    return 0 if all(row['status'] == "done" for row in rows) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,161 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from time import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Models are expensive to load (XTTS v2 alone is a multi-GB checkpoint), so they are kept
+# resident in the process and shared between tasks. The registry is keyed by
+# (model name, device) and evicts the least recently used entries once the estimated
+# memory footprint goes over the configured budget.
+#
+# torch is only imported when a model is actually loaded or released, so the entry points
+# can start serving before the deep learning stack is in memory.
+
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get("DEEPFAKE_MODEL_MEMORY_BUDGET_MB", "8192"))
+
+
+@lru_cache(maxsize=1)
+def default_device() -> str:
+    """CUDA when available, CPU otherwise. Imports torch on first call."""
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def estimate_model_size(model: Any) -> int:
+    """
+    Estimates the memory used by a model in bytes from its torch parameters and buffers.
+
+    Args:
+        model: Loaded model. Coqui TTS wrappers and plain torch modules are supported.
+
+    Returns:
+        Estimated size in bytes, or 0 when the model exposes no tensors.
+    """
+    modules = model.modules() if hasattr(model, "modules") else []
+    seen = set()
+    total = 0
+    for module in modules:
+        tensors = list(module.parameters(recurse=False)) + list(module.buffers(recurse=False))
+        for tensor in tensors:
+            if id(tensor) in seen:
+                continue
+            seen.add(id(tensor))
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class ModelRegistry:
+    """
+    Thread-safe, process-resident cache of loaded models with LRU eviction.
+
+    Each key is loaded at most once, even when several tasks request it concurrently:
+    the first caller loads it while the others wait on a per-key lock.
+    """
+
+    def __init__(self, memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._models: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._use_locks: Dict[Hashable, threading.Lock] = {}
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Tuple[Any, float]:
+        """
+        Returns the model for `key`, loading it with `loader` on a cache miss.
+
+        Args:
+            key: Cache key, usually (model name, device).
+            loader: Zero-argument callable returning the loaded model.
+
+        Returns:
+            The model and the time spent loading it (0.0 on a cache hit).
+        """
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0], 0.0
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key][0], 0.0
+
+            start_time = time()
+            model = loader()
+            load_time = time() - start_time
+            size = estimate_model_size(model)
+            logging.info(f"Loaded model {key} in {load_time:.1f}s ({size / 1024 ** 2:.0f} MB)")
+
+            with self._lock:
+                self._models[key] = (model, size)
+                self._evict(keep=key)
+            return model, load_time
+
+    def use_lock(self, key: Hashable) -> threading.Lock:
+        """
+        Returns the lock serialising inference on the model stored under `key`.
+
+        Loaded models are shared between tasks but are not safe to run concurrently,
+        so callers hold this lock for the duration of an inference call.
+        """
+        with self._lock:
+            return self._use_locks.setdefault(key, threading.Lock())
+
+    def _evict(self, keep: Hashable) -> None:
+        # Caller holds self._lock. The model that was just loaded is never evicted, even
+        # if it alone exceeds the budget.
+        while self.memory_usage() > self.memory_budget and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            model, size = self._models.pop(oldest)
+            self._key_locks.pop(oldest, None)
+            logging.info(f"Evicted model {oldest} ({size / 1024 ** 2:.0f} MB) from registry")
+            del model
+            _release_device_memory()
+
+    def memory_usage(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def evict(self, key: Hashable) -> None:
+        with self._lock:
+            if self._models.pop(key, None) is not None:
+                self._key_locks.pop(key, None)
+                _release_device_memory()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._key_locks.clear()
+        _release_device_memory()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._models
+
+
+def _release_device_memory() -> None:
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+_registry: Optional[ModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """Returns the process-wide model registry, creating it on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
@@ -0,0 +1,455 @@
+import os
+import re
+import logging
+import weakref
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+from processing import audio
+from processing.comparison import build_comparison_video
+from processing.decoded_audio import DecodedAudio, get_decoded_audio
+from processing.ffmpeg import video_size
+from processing.journal import get_journal
+from processing.lipsync_segments import DEFAULT_MARGIN_SECONDS, segmented_lip_sync
+from processing.proxy_cache import get_proxy, release_proxy
+from processing.run_docker import run_video_retalking
+from processing.scheduler import PENDING, Stage
+from processing.speaker_cache import get_speaker_cache
+from processing.tts_streaming import stream_tts
+from post_processing.take_scoring import METRICS, rank_takes, score_take
+from utils.profiling import Trace, annotate, profile
+
+# The steps of a lip-sync task, split into stages the scheduler can run on separate
+# resource pools. A TaskContext carries the inputs and the files each stage produces:
+#
+#   prepare (encode) -> tts_i (tts) -> lipsync_i (lipsync) -> compare (encode)
+#
+# Iteration i's TTS only depends on prepare, so the next take can be synthesised while
+# the previous one is lip-synced. Every stage output goes through the archive folder's
+# job journal, so a restarted or re-submitted task skips the stages already done.
+#
+# With best-of-N selection the takes are generated one after the other and each is scored
+# by Whisper (WER/CER against the text) before the next one starts:
+#
+#   prepare -> tts_0 -> score_0 -> tts_1 -> score_1 ... -> select -> lipsync_j -> compare
+#
+# Generation stops once `keep_top` takes clear `max_error`; only the `keep_top` best takes
+# are lip-synced, which is where the time goes.
+#
+# Each stage runs under utils.profiling; the records (wall/CPU time, peak RSS, bytes read
+# and written, ffmpeg time, plus the timings the stage reports itself) form the task's
+# trace, saved as <basename>_<task name>_trace.json in the archive folder after every stage.
+
+Report = Callable[[str], None]
+
+
+def file_path(file: Any) -> Optional[str]:
+    # Gradio passes uploads as tempfile wrappers or plain paths depending on the version
+    if file is None:
+        return None
+    return getattr(file, 'name', file)
+
+
+class TaskContext:
+    """
+    Inputs, intermediate files and outputs of one task as it moves through the stages.
+
+    Args:
+        task: Task dict as built by the UI's add_task.
+        device: Torch device used for TTS.
+    """
+
+    def __init__(self, task: Dict[str, Any], device: str):
+        self.task = task
+        self.task_name = task['task_name']
+        self.device = device
+        self.tts_text = task['tts_text']
+        self.iterations = int(task['iterations'])
+        self.use_video_audio = task['use_video_audio']
+        self.downscale_percentage = int(task.get('downscale_percentage', 100))
+        self.comparison_layout = task.get('comparison_layout', 'concat')
+        self.streaming_tts = bool(task.get('streaming_tts', False))
+        self.segmented_lipsync = bool(task.get('segmented_lipsync', True))
+        self.select_best = bool(task.get('select_best', False))
+        self.keep_top = max(1, min(int(task.get('keep_top', 1)), self.iterations))
+        self.max_error = float(task.get('max_error', 0.1))
+        self.selection_metric = task.get('selection_metric', 'wer')
+        self.archive_folder = task.get('archive_folder') or os.getcwd()
+
+        self.source_video_file = file_path(task['video_file'])
+        self.video_file = self.source_video_file  # Replaced by the proxy when downscaling
+        self.audio_file = file_path(task.get('audio_file'))
+        self.basename = os.path.splitext(os.path.basename(self.source_video_file))[0] if self.source_video_file else ""
+        self.journal = get_journal(self.archive_folder)
+
+        self.reference_file: Optional[str] = None  # File the voice to clone is decoded from
+        self.reference_audio: Optional[DecodedAudio] = None
+        self.original_resolution = None
+        self.tts_files: List[Optional[str]] = [None] * self.iterations
+        self.output_video_files: List[Optional[str]] = [None] * self.iterations
+        self.comparison_video_file: Optional[str] = None
+        self.tts_metrics: Dict[int, Dict[str, float]] = {}
+        self.preview_audio = None  # (sample_rate, samples) of the latest streamed TTS audio
+        self.lipsync_stats: Dict[int, Dict[str, Any]] = {}
+        self.take_scores: Dict[int, Dict[str, Any]] = {}
+        self.selected: List[int] = []  # Iterations kept for lip sync, best first
+        self.stop_generating = False
+        self.trace = Trace(self.task_name)
+        # Named after the task too: tasks on the same video share the archive folder
+        task_slug = re.sub(r"[^A-Za-z0-9_-]+", "-", str(self.task_name)).strip("-") or "task"
+        self.trace_file = os.path.join(self.archive_folder, f"{self.basename or 'video'}_{task_slug}_trace.json")
+        self._proxy_lease: Optional[weakref.finalize] = None  # Releases the proxy, at the latest when the task is dropped
+
+    def message(self, text: str) -> str:
+        return f"Task '{self.task_name}': {text}"
+
+    @property
+    def output_files(self) -> List[str]:
+        files = [f for f in self.output_video_files if f]
+        if self.comparison_video_file:
+            files.append(self.comparison_video_file)
+        return [os.path.abspath(f) for f in files]
+
+    def release_proxy(self) -> None:
+        """Ends the lease on the downscaled proxy so it can be evicted; safe to call more than once."""
+        if self._proxy_lease:
+            self._proxy_lease()
+
+
+TASK_DEFAULTS: Dict[str, Any] = {
+    'task_name': None,
+    'video_file': None,
+    'tts_text': "",
+    'use_video_audio': True,
+    'audio_file': None,
+    'iterations': 1,
+    'archive_folder': None,
+    'downscale_percentage': 100,
+    'comparison_layout': "concat",
+    'priority': 0,
+    'streaming_tts': False,
+    'segmented_lipsync': True,
+    'select_best': False,
+    'keep_top': 1,
+    'max_error': 0.1,
+    'selection_metric': "wer",
+}
+
+
+def make_task(fields: Dict[str, Any], default_name: str = "Task") -> Dict[str, Any]:
+    """
+    Builds a task dict, as consumed by TaskContext, from partial fields.
+
+    Missing fields get their defaults and values are coerced to the types the stages
+    expect, so the UI and the headless API submit identical tasks.
+
+    Raises:
+        ValueError: On unknown fields, values that cannot be coerced or an unknown selection metric.
+    """
+    unknown = set(fields) - set(TASK_DEFAULTS) - {'status'}
+    if unknown:
+        raise ValueError(f"Unknown task field(s): {', '.join(sorted(unknown))}")
+    task = dict(TASK_DEFAULTS)
+    task.update({key: value for key, value in fields.items() if value is not None})
+    try:
+        task.update(
+            task_name=task['task_name'] or default_name,
+            use_video_audio=bool(task['use_video_audio']),
+            iterations=int(task['iterations']),
+            archive_folder=task['archive_folder'] or os.getcwd(),
+            downscale_percentage=int(task['downscale_percentage']),
+            priority=int(task['priority'] or 0),
+            streaming_tts=bool(task['streaming_tts']),
+            segmented_lipsync=bool(task['segmented_lipsync']),
+            select_best=bool(task['select_best']),
+            keep_top=int(task['keep_top'] or 1),
+            max_error=float(task['max_error']),
+        )
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid task field: {e}") from e
+    if task['selection_metric'] not in METRICS:
+        raise ValueError(f"Unknown selection metric '{task['selection_metric']}', expected one of {METRICS}")
+    task['status'] = PENDING
+    return task
+
+
+def validate_task(task: Dict[str, Any]) -> Optional[str]:
+    """Returns an error message if the task is missing inputs, None otherwise."""
+    if not task.get('video_file') or not task.get('tts_text') or not task.get('iterations'):
+        return "Please provide all inputs."
+    if not task.get('use_video_audio') and not task.get('audio_file'):
+        return "Please provide an audio file or select 'Use Audio from Video'."
+    return None
+
+
+def prepare_audio(ctx: TaskContext, report: Report) -> None:
+    """Decodes the voice to clone; TTS conditioning reads the buffer directly."""
+    ctx.reference_file = ctx.source_video_file if ctx.use_video_audio else ctx.audio_file
+    report(ctx.message("Decoding audio..."))
+    try:
+        ctx.reference_audio = get_decoded_audio(ctx.reference_file)
+    except Exception as e:
+        raise RuntimeError(f"Failed to obtain audio: {e}") from e
+    logging.info(ctx.message(f"Decoded {ctx.reference_audio.duration:.1f}s of reference audio"))
+    annotate(audio_seconds=round(ctx.reference_audio.duration, 3))
+
+
+def prepare_video(ctx: TaskContext, report: Report) -> None:
+    """Obtains the downscaled proxy of the face video when downscaling."""
+    if ctx.downscale_percentage < 100:
+        report(ctx.message(f"Downscaling video to {ctx.downscale_percentage}%..."))
+        proxy_file, proxy_hit, proxy_time = get_proxy(ctx.source_video_file, ctx.downscale_percentage, ctx.archive_folder)
+        logging.info(ctx.message(f"Proxy {'reused' if proxy_hit else 'created'} in {proxy_time:.1f}s: {proxy_file}"))
+        annotate(proxy_seconds=round(proxy_time, 3), proxy_reused=proxy_hit)
+        ctx.original_resolution = video_size(ctx.source_video_file)
+        ctx.video_file = proxy_file
+        ctx.release_proxy()
+        ctx._proxy_lease = weakref.finalize(ctx, release_proxy, proxy_file)
+
+
+def prepare(ctx: TaskContext, report: Report) -> None:
+    """Creates the archive folder, decodes the reference audio and obtains the downscaled proxy."""
+    os.makedirs(ctx.archive_folder, exist_ok=True)
+    logging.info(ctx.message(f"Using device: {ctx.device}"))
+    prepare_audio(ctx, report)
+    prepare_video(ctx, report)
+
+
+def synthesize(ctx: TaskContext, iteration: int, report: Report) -> None:
+    """Generates the TTS take for one iteration."""
+    progress = f"Iteration {iteration + 1}/{ctx.iterations}"
+    if ctx.stop_generating:
+        annotate(skipped=True)
+        return
+    report(ctx.message(f"Synthesizing speech ({progress})..."))
+
+    def produce(tts_output_file):
+        load_time, synthesis_time = audio.generate_tts_audio(ctx.tts_text, ctx.reference_audio, tts_output_file, ctx.device)
+        logging.info(ctx.message(f"TTS model load {load_time:.2f}s, synthesis {synthesis_time:.2f}s ({progress})"))
+        annotate(model_load_seconds=round(load_time, 3), synthesis_seconds=round(synthesis_time, 3))
+        report(ctx.message(f"Speech synthesized in {synthesis_time:.1f}s ({get_speaker_cache().describe()}, {progress})"))
+
+    def produce_streaming(tts_output_file):
+        for chunk_progress in stream_tts(ctx.tts_text, ctx.reference_audio, tts_output_file, ctx.device):
+            ctx.preview_audio = (chunk_progress['sample_rate'], chunk_progress['audio'])
+            metrics = (
+                f"first chunk after {chunk_progress['time_to_first_chunk']:.1f}s, "
+                f"real-time factor {chunk_progress['real_time_factor']:.2f}"
+            )
+            if chunk_progress.get('done'):
+                ctx.tts_metrics[iteration] = {
+                    'time_to_first_chunk': chunk_progress['time_to_first_chunk'],
+                    'real_time_factor': chunk_progress['real_time_factor'],
+                    'synthesis_time': chunk_progress['synthesis_time']
+                }
+                annotate(**ctx.tts_metrics[iteration])
+                report(ctx.message(f"Speech synthesized: {metrics} ({get_speaker_cache().describe()}, {progress})"))
+            else:
+                report(ctx.message(
+                    f"Synthesized chunk {chunk_progress['chunk']}/{chunk_progress['chunks']}: {metrics} ({progress})"
+                ))
+
+    # The iteration index is part of the key: each iteration is a distinct take
+    ctx.tts_files[iteration], reused = ctx.journal.run_stage(
+        "tts", f"{ctx.basename}_generated_audio_{iteration}", ".wav",
+        {'speaker': ctx.reference_file},
+        {
+            'text': ctx.tts_text, 'iteration': iteration, 'model': audio.TTS_MODEL_NAME, 'language': 'fr',
+            'streaming': ctx.streaming_tts
+        },
+        produce_streaming if ctx.streaming_tts else produce
+    )
+    annotate(reused=reused)
+    if reused:
+        report(ctx.message(f"Reusing synthesized speech from a previous run ({progress})"))
+
+
+def score(ctx: TaskContext, iteration: int, report: Report) -> None:
+    """Transcribes one take with Whisper, scores it against the text and decides whether to keep generating."""
+    if ctx.tts_files[iteration] is None:
+        annotate(skipped=True)
+        return
+    progress = f"Iteration {iteration + 1}/{ctx.iterations}"
+    report(ctx.message(f"Scoring synthesized speech ({progress})..."))
+    scores = score_take(ctx.tts_files[iteration], ctx.tts_text)
+    ctx.take_scores[iteration] = scores
+    annotate(wer=scores['wer'], cer=scores['cer'])
+    logging.info(ctx.message(f"Take {iteration + 1} transcript: {scores['transcript']!r}"))
+    report(ctx.message(f"Take {iteration + 1}: WER {scores['wer']:.0%}, CER {scores['cer']:.0%} ({progress})"))
+
+    passing = sum(s[ctx.selection_metric] <= ctx.max_error for s in ctx.take_scores.values())
+    if passing >= ctx.keep_top and iteration < ctx.iterations - 1:
+        ctx.stop_generating = True
+        report(ctx.message(
+            f"{passing} take(s) at or below {ctx.max_error:.0%} {ctx.selection_metric.upper()}, "
+            f"skipping the remaining {ctx.iterations - iteration - 1} take(s)"
+        ))
+
+
+def select(ctx: TaskContext, report: Report) -> None:
+    """Keeps the best scored takes for lip sync."""
+    ctx.selected = rank_takes(ctx.take_scores, ctx.selection_metric)[:ctx.keep_top]
+    annotate(generated=len(ctx.take_scores), selected=[i + 1 for i in ctx.selected])
+    kept = ", ".join(
+        f"take {i + 1} (WER {ctx.take_scores[i]['wer']:.0%}, CER {ctx.take_scores[i]['cer']:.0%})" for i in ctx.selected
+    )
+    report(ctx.message(f"Keeping {kept} out of {len(ctx.take_scores)} generated"))
+
+
+def lip_sync_selected(ctx: TaskContext, rank: int, report: Report) -> None:
+    """Lip-syncs the take ranked `rank` by select, if there is one."""
+    if rank >= len(ctx.selected):
+        annotate(skipped=True)
+        return
+    lip_sync(ctx, ctx.selected[rank], report)
+
+
+def selection_summary(ctx: TaskContext) -> Dict[str, Any]:
+    """
+    Scores of the takes and the time best-of-N selection saved.
+
+    Savings are estimated from the stages that did run: the mean lip-sync time of the kept
+    takes times the number of takes not lip-synced, and likewise for TTS generation.
+    """
+    def mean_wall(prefix: str) -> Optional[float]:
+        walls = [
+            r['wall_seconds'] for r in ctx.trace.records
+            if r['name'].startswith(prefix) and not r.get('skipped') and not r.get('reused') and not r.get('error')
+        ]
+        return sum(walls) / len(walls) if walls else None
+
+    generated = len(ctx.take_scores)
+    skipped_lipsyncs = generated - len(ctx.selected)
+    skipped_takes = ctx.iterations - generated
+    lipsync_time, tts_time = mean_wall("lipsync_"), mean_wall("tts_")
+    return {
+        'scores': {i + 1: {k: v for k, v in s.items()} for i, s in sorted(ctx.take_scores.items())},
+        'selected': [i + 1 for i in ctx.selected],
+        'generated': generated,
+        'skipped_lipsyncs': skipped_lipsyncs,
+        'skipped_takes': skipped_takes,
+        'lipsync_seconds_saved': round(lipsync_time * skipped_lipsyncs, 1) if lipsync_time is not None else None,
+        'tts_seconds_saved': round(tts_time * skipped_takes, 1) if tts_time is not None else None,
+    }
+
+
+def lip_sync(ctx: TaskContext, iteration: int, report: Report) -> None:
+    """Lip-syncs the (possibly downscaled) face video to one TTS take."""
+    progress = f"Iteration {iteration + 1}/{ctx.iterations}"
+    report(ctx.message(f"Lip syncing in progress ({progress})..."))
+
+    def produce(output_video_file):
+        if not ctx.segmented_lipsync:
+            annotate(lipsync_seconds=round(run_video_retalking(ctx.video_file, ctx.tts_files[iteration], output_video_file), 3))
+            return
+        # Only the speech spans of the take go through lip-sync inference
+        stats = segmented_lip_sync(
+            ctx.video_file, ctx.tts_files[iteration], output_video_file, run_video_retalking,
+            work_dir=ctx.journal.artifacts_dir
+        )
+        ctx.lipsync_stats[iteration] = stats
+        annotate(**{key: value for key, value in stats.items() if key != 'elapsed'})
+        report(ctx.message(
+            f"Lip sync skipped inference on {stats['skipped_fraction']:.0%} of {stats['frames']} frames "
+            f"({stats['render_spans']} speech span(s), {progress})"
+        ))
+
+    params = {'segmented': True, 'margin': DEFAULT_MARGIN_SECONDS} if ctx.segmented_lipsync else {}
+    output_video_file, reused = ctx.journal.run_stage(
+        "lipsync", f"{ctx.basename}_output_video_{iteration}", ".mp4",
+        {'video': ctx.video_file, 'audio': ctx.tts_files[iteration]}, params,
+        produce
+    )
+    annotate(reused=reused)
+    if reused:
+        report(ctx.message(f"Reusing lip-synced video from a previous run ({progress})"))
+    logging.info(ctx.message(f"Lip-synced video {iteration + 1}/{ctx.iterations} saved to {output_video_file}"))
+    ctx.output_video_files[iteration] = output_video_file
+
+
+def compare(ctx: TaskContext, report: Report) -> None:
+    """Builds the comparison video from every iteration and the original."""
+    ctx.release_proxy()  # Every lip sync is done; the comparison only reads the source video
+    if ctx.select_best:
+        summary = selection_summary(ctx)
+        annotate(selection=summary)
+        saved = [
+            f"~{summary[key]:.1f}s of {what} saved" for key, what in
+            (("lipsync_seconds_saved", "lip sync"), ("tts_seconds_saved", "TTS"))
+            if summary[key]
+        ]
+        report(ctx.message(
+            f"Best-of-{ctx.iterations}: lip-synced take(s) {', '.join(map(str, summary['selected']))}, "
+            f"skipped {summary['skipped_lipsyncs']} lip sync(s) and {summary['skipped_takes']} take(s)"
+            + (f" ({', '.join(saved)})" if saved else "")
+        ))
+
+    report(ctx.message("Concatenating videos for comparison..."))
+    # Takes that were not lip-synced (best-of-N selection) are left out
+    iterations = [i for i, f in enumerate(ctx.output_video_files) if f]
+    video_files = [ctx.output_video_files[i] for i in iterations] + [ctx.source_video_file]
+
+    def produce(comparison_video_file):
+        # Iterations are scaled back to the original resolution inside the same ffmpeg pass
+        comparison_time, comparison_mode = build_comparison_video(
+            video_files,
+            comparison_video_file,
+            target_resolution=ctx.original_resolution,
+            layout=ctx.comparison_layout,
+            labels=[f"Iteration {i + 1}" for i in iterations] + ["Original"] if ctx.comparison_layout == "grid" else None
+        )
+        logging.info(ctx.message(f"Comparison video built in {comparison_time:.1f}s ({comparison_mode})"))
+        annotate(comparison_seconds=round(comparison_time, 3), comparison_mode=comparison_mode)
+
+    ctx.comparison_video_file, reused = ctx.journal.run_stage(
+        "compare", f"{ctx.basename}_comparison_video", ".mp4",
+        {f"video_{i}": path for i, path in enumerate(video_files)},
+        {'layout': ctx.comparison_layout, 'resolution': ctx.original_resolution},
+        produce
+    )
+    annotate(reused=reused, output_bytes=os.path.getsize(ctx.comparison_video_file))
+
+
+def traced(ctx: TaskContext, name: str, resource: str, fn: Callable[[Report], None], report: Report) -> None:
+    """Runs a stage function under the profiler and saves the task's trace, even on failure."""
+    try:
+        with profile(name, ctx.trace, resource=resource):
+            fn(report)
+    except BaseException:
+        ctx.release_proxy()  # The job fails, no later stage will read the proxy
+        raise
+    finally:
+        try:
+            ctx.trace.save(ctx.trace_file)
+        except OSError as e:
+            logging.warning(ctx.message(f"Could not save the profiling trace: {e}"))
+
+
+def build_stages(ctx: TaskContext) -> List[Stage]:
+    """Returns the stages of a task, in an order that respects their dependencies."""
+    def stage(name, resource, fn, label, depends_on=()):
+        return Stage(name, resource, partial(traced, ctx, name, resource, fn), label, depends_on)
+
+    stages = [stage("prepare", "encode", partial(prepare, ctx), "Preparing")]
+    if ctx.select_best:
+        for i in range(ctx.iterations):
+            progress = f"{i + 1}/{ctx.iterations}"
+            stages.append(stage(f"tts_{i}", "tts", partial(synthesize, ctx, i), f"TTS {progress}", [f"score_{i - 1}" if i else "prepare"]))
+            stages.append(stage(f"score_{i}", "asr", partial(score, ctx, i), f"Scoring {progress}", [f"tts_{i}"]))
+        stages.append(stage("select", "asr", partial(select, ctx), "Selecting takes", [f"score_{i}" for i in range(ctx.iterations)]))
+        for rank in range(ctx.keep_top):
+            stages.append(stage(
+                f"lipsync_{rank}", "lipsync", partial(lip_sync_selected, ctx, rank),
+                f"Lip sync best {rank + 1}/{ctx.keep_top}", ["select"]
+            ))
+        stages.append(stage("compare", "encode", partial(compare, ctx), "Encoding comparison", [f"lipsync_{r}" for r in range(ctx.keep_top)]))
+        return stages
+
+    for i in range(ctx.iterations):
+        progress = f"{i + 1}/{ctx.iterations}"
+        stages.append(stage(f"tts_{i}", "tts", partial(synthesize, ctx, i), f"TTS {progress}", ["prepare"]))
+        stages.append(stage(f"lipsync_{i}", "lipsync", partial(lip_sync, ctx, i), f"Lip sync {progress}", [f"tts_{i}"]))
+    stages.append(stage(
+        "compare", "encode", partial(compare, ctx), "Encoding comparison",
+        [f"lipsync_{i}" for i in range(ctx.iterations)]
+    ))
+    return stages
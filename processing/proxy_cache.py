@@ -0,0 +1,129 @@
+import os
+import logging
+import threading
+from time import time
+from typing import Dict, Tuple
+from processing.ffmpeg import audio_codec_args, probe, run_ffmpeg
+from utils.hashing import cached_hash_file, hash_values
+
+# Downscaled "proxy" copies of face videos, used to speed up lip sync. A proxy only depends
+# on the input content, the scale and the encoder settings, so it is stored under a key
+# derived from those and reused by every task that downscales the same video the same way.
+# The cache lives in the archive folder and is trimmed to a size budget, least recently
+# used proxies first. Every proxy returned by get_proxy is leased to its caller until
+# release_proxy: tasks lip-sync from the proxy long after obtaining it, so leased proxies
+# are never evicted, whichever task triggered the eviction.
+
+PROXY_CACHE_DIRNAME = "proxy_cache"
+DEFAULT_PROXY_CACHE_MB = int(os.environ.get("DEEPFAKE_PROXY_CACHE_MB", "4096"))
+DEFAULT_PROXY_CODEC = ("libx264", "veryfast", 18)  # (encoder, preset, crf)
+
+_key_locks: Dict[str, threading.Lock] = {}
+_key_locks_lock = threading.Lock()
+_leases: Dict[str, int] = {}  # Proxy path -> number of callers using it
+_leases_lock = threading.Lock()
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _key_locks_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def proxy_key(video_file: str, scale_percentage: int, codec_settings: Tuple = DEFAULT_PROXY_CODEC) -> str:
+    return hash_values(cached_hash_file(video_file), int(scale_percentage), tuple(codec_settings))
+
+
+def get_proxy(
+    video_file: str,
+    scale_percentage: int,
+    archive_folder: str,
+    codec_settings: Tuple = DEFAULT_PROXY_CODEC,
+    budget_mb: int = DEFAULT_PROXY_CACHE_MB
+) -> Tuple[str, bool, float]:
+    """
+    Returns a downscaled proxy of `video_file`, creating it on a cache miss.
+
+    Args:
+        video_file: Path to the full-resolution video.
+        scale_percentage: Target size as a percentage of the original dimensions.
+        archive_folder: Folder holding the proxy cache directory.
+        codec_settings: (encoder, preset, crf) used to encode the proxy.
+        budget_mb: Maximum total size of the cache directory.
+
+    Returns:
+        The proxy path, whether it came from the cache, and the elapsed time. The proxy is
+        leased to the caller, who must call release_proxy once done with it.
+    """
+    start_time = time()
+    cache_dir = os.path.join(archive_folder, PROXY_CACHE_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    key = proxy_key(video_file, scale_percentage, codec_settings)
+    proxy_file = os.path.join(cache_dir, f"{key}.mp4")
+
+    with _lock_for(key):
+        if os.path.exists(proxy_file):
+            os.utime(proxy_file)  # Refresh the mtime used for LRU eviction
+            _lease(proxy_file)
+            return proxy_file, True, time() - start_time
+
+        encoder, preset, crf = codec_settings
+        factor = scale_percentage / 100.0
+        tmp_file = os.path.join(cache_dir, f"{key}.partial.mp4")
+        try:
+            # One native scaling pass; dimensions are kept even for yuv420p
+            run_ffmpeg(
+                ["-i", video_file,
+                 "-vf", f"scale=trunc(iw*{factor}/2)*2:trunc(ih*{factor}/2)*2",
+                 "-c:v", encoder, "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p"]
+                + audio_codec_args(probe(video_file), proxy_file)
+                + ["-movflags", "+faststart", tmp_file],
+                description="proxy downscale"
+            )
+            os.replace(tmp_file, proxy_file)
+        finally:
+            # Left behind only when the encode failed
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        _lease(proxy_file)
+
+    evict(cache_dir, budget_mb)
+    return proxy_file, False, time() - start_time
+
+
+def _lease(proxy_file: str) -> None:
+    with _leases_lock:
+        _leases[proxy_file] = _leases.get(proxy_file, 0) + 1
+
+
+def release_proxy(proxy_file: str) -> None:
+    """Ends a lease taken by get_proxy; the proxy can be evicted once no lease is left."""
+    with _leases_lock:
+        remaining = _leases.get(proxy_file, 0) - 1
+        if remaining > 0:
+            _leases[proxy_file] = remaining
+        else:
+            _leases.pop(proxy_file, None)
+
+
+def evict(cache_dir: str, budget_mb: int = DEFAULT_PROXY_CACHE_MB) -> None:
+    """Removes the least recently used proxies not leased by any task until the cache fits in `budget_mb`."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(".mp4") and not name.endswith(".partial.mp4"):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= budget_mb * 1024 * 1024:
+            break
+        with _leases_lock:
+            if path in _leases:
+                continue
+        try:
+            os.remove(path)
+            total -= size
+            logging.info(f"Evicted proxy {path} from cache")
+        except FileNotFoundError:
+            pass
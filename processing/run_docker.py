@@ -0,0 +1,108 @@
+import os
+import json
+import socket
+import logging
+from time import sleep, time
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+# Client of the persistent lip-sync worker (processing/lipsync_worker.py), which runs in the
+# video-retalking Docker image with its models loaded once. Start it with
+#
+#   docker run --gpus all -p 8765:8765 -v /data:/data <image>
+#
+# or, without the models, `python -m processing.lipsync_worker --backend stub`.
+# DEEPFAKE_LIPSYNC_PATH_MAP rewrites local path prefixes into the paths the worker sees,
+# e.g. "/home/me/archive=/data" when that folder is mounted as /data in the container.
+
+DEFAULT_WORKER_ADDRESS = os.environ.get("DEEPFAKE_LIPSYNC_WORKER", "127.0.0.1:8765")
+PATH_MAP = os.environ.get("DEEPFAKE_LIPSYNC_PATH_MAP", "")
+CONNECT_TIMEOUT = 10.0
+BUSY_RETRY_SECONDS = 5.0
+BUSY_TIMEOUT = float(os.environ.get("DEEPFAKE_LIPSYNC_BUSY_TIMEOUT", "3600"))
+
+
+class LipSyncError(RuntimeError):
+    pass
+
+
+def _address(address: Optional[str]) -> Tuple[str, int]:
+    host, _, port = (address or DEFAULT_WORKER_ADDRESS).rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _worker_path(path: str) -> str:
+    path = os.path.abspath(path)
+    for mapping in filter(None, PATH_MAP.split(",")):
+        local, _, remote = mapping.partition("=")
+        if path.startswith(local.rstrip("/") + "/"):
+            return remote.rstrip("/") + path[len(local.rstrip("/")):]
+    return path
+
+
+def request(message: Dict[str, Any], address: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Sends one request to the worker and yields the events it answers with."""
+    try:
+        connection = socket.create_connection(_address(address), timeout=CONNECT_TIMEOUT)
+    except OSError as e:
+        raise LipSyncError(
+            f"Lip-sync worker unreachable at {address or DEFAULT_WORKER_ADDRESS} ({e}). "
+            "Start the lip-sync container or `python -m processing.lipsync_worker`."
+        ) from e
+    with connection:
+        connection.settimeout(None)  # Jobs can run for a long time
+        connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+        with connection.makefile("rb") as reader:
+            for line in reader:
+                yield json.loads(line)
+
+
+def ping(address: Optional[str] = None) -> Dict[str, Any]:
+    """Returns the worker's backend name and queue state."""
+    return next(request({'op': "ping"}, address))
+
+
+def run_video_retalking(
+    face_video: str,
+    audio_file: str,
+    output_file: str,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+    address: Optional[str] = None
+) -> float:
+    """
+    Lip-syncs a face video to an audio file on the lip-sync worker.
+
+    Args:
+        face_video: Face video or image.
+        audio_file: Speech to lip-sync to.
+        output_file: Path of the lip-synced video.
+        progress: Called with every event the worker sends (queued, started, progress).
+        address: "host:port" of the worker (DEEPFAKE_LIPSYNC_WORKER by default).
+
+    Returns:
+        The elapsed time, including waiting in the worker's queue.
+    """
+    start_time = time()
+    message = {
+        'op': "lipsync",
+        'face': _worker_path(face_video),
+        'audio': _worker_path(audio_file),
+        'outfile': _worker_path(output_file)
+    }
+    while True:
+        for event in request(message, address):
+            if event['event'] == "busy":
+                # The worker's queue is full: wait for a slot instead of failing the task
+                if time() - start_time > BUSY_TIMEOUT:
+                    raise LipSyncError("Lip-sync worker stayed busy, giving up")
+                logging.info(f"Lip-sync worker busy ({event.get('queued')} queued), retrying")
+                sleep(BUSY_RETRY_SECONDS)
+                break
+            if event['event'] == "error":
+                raise LipSyncError(f"Lip sync failed: {event.get('error')}")
+            if event['event'] == "done":
+                logging.info(f"Lip sync done in {event.get('elapsed', 0):.1f}s on the worker")
+                return time() - start_time
+            if progress:
+                progress(event)
+        else:
+            raise LipSyncError("Lip-sync worker closed the connection before finishing the job")
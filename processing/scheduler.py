@@ -0,0 +1,309 @@
+import os
+import queue
+import logging
+import itertools
+import threading
+from time import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# Stage-pipelined task scheduler.
+#
+# A task is split into stages (audio extraction, TTS per iteration, lip sync per iteration,
+# comparison encode...) and each stage declares the resource it needs. Every resource has
+# its own worker pool, so while task A is lip syncing, task B can already synthesise its
+# speech and task C can be encoding. Within a pool, stages are served by task priority
+# (higher first) and then submission order. Stages only start once the stages they depend
+# on have completed.
+
+PENDING = "Pending"
+QUEUED = "Queued"
+PROCESSING = "Processing"
+COMPLETED = "Completed"
+ERROR = "Error"
+CANCELLED = "Cancelled"
+FINAL_STATES = (COMPLETED, ERROR, CANCELLED)
+
+DEFAULT_CONCURRENCY = {
+    'tts': int(os.environ.get("DEEPFAKE_TTS_WORKERS", "1")),
+    'lipsync': int(os.environ.get("DEEPFAKE_LIPSYNC_WORKERS", "1")),
+    'encode': int(os.environ.get("DEEPFAKE_ENCODE_WORKERS", "2")),
+    'asr': int(os.environ.get("DEEPFAKE_ASR_WORKERS", "1")),
+}
+
+
+def waiting_state(label: str) -> str:
+    return f"Waiting: {label}"
+
+
+def running_state(label: str) -> str:
+    return f"{PROCESSING}: {label}"
+
+
+class Stage:
+    """
+    One unit of work of a task.
+
+    Args:
+        name: Identifier, unique within the task.
+        resource: Name of the worker pool that runs the stage.
+        fn: Callable run with a single `report(message)` argument it can use to post
+            progress messages for the task.
+        label: Human readable name shown in the task status.
+        depends_on: Names of the stages that must complete first.
+    """
+
+    def __init__(self, name: str, resource: str, fn: Callable[[Callable[[str], None]], Any], label: str, depends_on: Sequence[str] = ()):
+        self.name = name
+        self.resource = resource
+        self.fn = fn
+        self.label = label
+        self.depends_on = list(depends_on)
+
+
+class Job:
+    """A submitted task: its stages, their progress and where its events go."""
+
+    def __init__(self, job_id: str, name: str, stages: List[Stage], priority: int, listener: "queue.Queue"):
+        self.job_id = job_id
+        self.name = name
+        self.stages = {stage.name: stage for stage in stages}
+        self.priority = priority
+        self.listener = listener
+        self.status = QUEUED
+        self.cancelled = threading.Event()
+        self.submitted_at = time()
+        self.finished_at: Optional[float] = None
+        self._remaining = {stage.name: set(stage.depends_on) for stage in stages}
+        self._dependents: Dict[str, List[str]] = {stage.name: [] for stage in stages}
+        for stage in stages:
+            for dependency in stage.depends_on:
+                self._dependents[dependency].append(stage.name)
+        self._running = 0
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINAL_STATES
+
+
+class Event:
+    """Status update emitted by the scheduler for one job."""
+
+    def __init__(self, job_id: str, status: str, message: str, final: bool = False, error: Optional[BaseException] = None):
+        self.job_id = job_id
+        self.status = status
+        self.message = message
+        self.final = final
+        self.error = error
+
+
+class ResourcePool:
+    """Fixed-size pool of worker threads serving one resource from a priority queue."""
+
+    def __init__(self, name: str, concurrency: int, run: Callable[[Job, Stage], None]):
+        self.name = name
+        self.concurrency = max(1, int(concurrency))
+        self.queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self.active = 0
+        self.completed = 0
+        self._run = run
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"{name}-worker-{i}", daemon=True)
+            for i in range(self.concurrency)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def put(self, job: Job, stage: Stage) -> None:
+        self.queue.put((-job.priority, next(self._counter), job, stage))
+
+    def _work(self) -> None:
+        while True:
+            _, _, job, stage = self.queue.get()
+            if job is None:
+                return
+            with self._lock:
+                self.active += 1
+            try:
+                self._run(job, stage)
+            finally:
+                with self._lock:
+                    self.active -= 1
+                    self.completed += 1
+
+    def stop(self) -> None:
+        for _ in self._workers:
+            self.queue.put((float("inf"), next(self._counter), None, None))
+
+
+class Scheduler:
+    """
+    Runs jobs made of dependent stages on per-resource worker pools.
+
+    Args:
+        concurrency: Number of workers per resource. Resources not listed get one worker.
+    """
+
+    def __init__(self, concurrency: Optional[Dict[str, int]] = None):
+        self.concurrency = dict(DEFAULT_CONCURRENCY)
+        self.concurrency.update(concurrency or {})
+        self.pools: Dict[str, ResourcePool] = {}
+        self.jobs: Dict[str, Job] = {}
+        self.started_at = time()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _pool(self, resource: str) -> ResourcePool:
+        with self._lock:
+            if resource not in self.pools:
+                self.pools[resource] = ResourcePool(resource, self.concurrency.get(resource, 1), self._run_stage)
+            return self.pools[resource]
+
+    def submit(self, name: str, stages: List[Stage], priority: int = 0, listener: Optional["queue.Queue"] = None) -> Job:
+        """
+        Queues a job. Its events are put on `listener` (a fresh queue when omitted).
+
+        Returns:
+            The submitted Job; `job.listener` yields Event objects until a final one.
+        """
+        job = Job(f"{next(self._ids)}:{name}", name, stages, priority, listener or queue.Queue())
+        with self._lock:
+            self.jobs[job.job_id] = job
+        self._emit(job, QUEUED, f"Task '{name}': Queued.")
+        if not stages:
+            self._finish(job, COMPLETED, f"Task '{name}': Nothing to do.")
+            return job
+        for stage in stages:
+            if not stage.depends_on:
+                self._enqueue(job, stage)
+        return job
+
+    def _enqueue(self, job: Job, stage: Stage) -> None:
+        if job.finished:
+            return
+        self._emit(job, waiting_state(stage.label), f"Task '{job.name}': Waiting for {stage.resource} ({stage.label})...")
+        self._pool(stage.resource).put(job, stage)
+
+    def _run_stage(self, job: Job, stage: Stage) -> None:
+        if job.finished:
+            return
+        if job.cancelled.is_set():
+            self._finish(job, CANCELLED, f"Task '{job.name}': Cancelled.")
+            return
+
+        with job._lock:
+            job._running += 1
+        self._emit(job, running_state(stage.label), f"Task '{job.name}': {stage.label}...")
+        try:
+            stage.fn(lambda message: self._emit(job, job.status, message))
+        except Exception as e:
+            logging.exception(f"Task '{job.name}': stage '{stage.name}' failed")
+            with job._lock:
+                job._running -= 1
+            self._finish(job, ERROR, f"Task '{job.name}': Error during processing: {e}", error=e)
+            return
+
+        ready = []
+        with job._lock:
+            job._running -= 1
+            job._remaining.pop(stage.name, None)
+            for dependent in job._dependents[stage.name]:
+                job._remaining[dependent].discard(stage.name)
+                if not job._remaining[dependent]:
+                    ready.append(job.stages[dependent])
+            done = not job._remaining and job._running == 0
+
+        if job.cancelled.is_set():
+            self._finish(job, CANCELLED, f"Task '{job.name}': Cancelled.")
+            return
+        if done:
+            self._finish(job, COMPLETED, f"Task '{job.name}': Processing complete!")
+        for next_stage in ready:
+            self._enqueue(job, next_stage)
+
+    def _emit(self, job: Job, status: str, message: str, final: bool = False, error: Optional[BaseException] = None) -> None:
+        if not job.finished or final:
+            job.status = status
+        job.listener.put(Event(job.job_id, status, message, final, error))
+
+    def _finish(self, job: Job, status: str, message: str, error: Optional[BaseException] = None) -> None:
+        with job._lock:
+            if job.finished:
+                return
+            job.status = status
+            job.finished_at = time()
+        job.listener.put(Event(job.job_id, status, message, final=True, error=error))
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a job. Queued stages are dropped; a stage already running finishes first.
+
+        Returns:
+            Whether the job existed and was not finished yet.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancelled.set()
+        with job._lock:
+            idle = job._running == 0
+        if idle:
+            # Nothing is running to notice the flag, so finish the job right away; its
+            # queued stages are skipped when a worker picks them up.
+            self._finish(job, CANCELLED, f"Task '{job.name}': Cancelled.")
+        return True
+
+    def cancel_by_name(self, name: str) -> int:
+        return sum(self.cancel(job.job_id) for job in list(self.jobs.values()) if job.name == name)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and activity per pool, plus overall task throughput."""
+        elapsed_hours = max(time() - self.started_at, 1e-9) / 3600
+        jobs = list(self.jobs.values())
+        completed = sum(job.status == COMPLETED for job in jobs)
+        return {
+            'pools': {
+                name: {
+                    'workers': pool.concurrency,
+                    'active': pool.active,
+                    'queued': pool.queue.qsize(),
+                    'stages_done': pool.completed
+                }
+                for name, pool in self.pools.items()
+            },
+            'active_tasks': sum(not job.finished for job in jobs),
+            'completed_tasks': completed,
+            'tasks_per_hour': completed / elapsed_hours
+        }
+
+    def describe(self) -> str:
+        stats = self.stats()
+        lines = [
+            f"**Tasks:** {stats['active_tasks']} active, {stats['completed_tasks']} completed "
+            f"({stats['tasks_per_hour']:.1f}/h)"
+        ]
+        for name, pool in stats['pools'].items():
+            lines.append(
+                f"- **{name}**: {pool['active']}/{pool['workers']} busy, {pool['queued']} queued, "
+                f"{pool['stages_done']} stages done"
+            )
+        return "\n".join(lines)
+
+    def shutdown(self) -> None:
+        for pool in self.pools.values():
+            pool.stop()
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """Returns the process-wide scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
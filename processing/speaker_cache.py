@@ -0,0 +1,151 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from utils.hashing import cached_hash_file, hash_values
+
+# XTTS conditions every synthesis on GPT latents and a speaker embedding computed from the
+# reference audio. Those only depend on the reference WAV content and the model, so they
+# are cached by content hash: in memory for the current process, and on disk so other
+# tasks and later runs using the same voice skip the reference-audio encoder. torch is
+# imported on first disk access so that importing the pipeline stays cheap.
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "DEEPFAKE_SPEAKER_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "deepfake_egc", "speaker_latents")
+)
+DEFAULT_DISK_BUDGET_MB = int(os.environ.get("DEEPFAKE_SPEAKER_CACHE_MB", "512"))
+DEFAULT_MEMORY_ENTRIES = 32
+# Part of every key; bumped when the way latents are computed changes, so stale entries
+# on disk are never served (2: file references use the model's gpt_cond_chunk_len)
+LATENTS_VERSION = 2
+
+Latents = Tuple[Any, Any]  # (gpt_cond_latent, speaker_embedding) torch tensors
+
+
+class SpeakerLatentCache:
+    """
+    Two-level (memory, then disk) cache of XTTS speaker conditioning latents.
+
+    Keys are derived from the reference audio content hash and the model name, so renamed
+    or re-uploaded copies of the same file still hit the cache.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        disk_budget_mb: int = DEFAULT_DISK_BUDGET_MB,
+        memory_entries: int = DEFAULT_MEMORY_ENTRIES
+    ):
+        self.cache_dir = cache_dir
+        self.disk_budget = disk_budget_mb * 1024 * 1024
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Latents]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def key_for(self, speaker_wav: Any, model_name: str) -> str:
+        # Decoded buffers (processing.decoded_audio) are keyed by their PCM content
+        if isinstance(speaker_wav, str):
+            return hash_values(cached_hash_file(speaker_wav), model_name, LATENTS_VERSION)
+        return hash_values("pcm", speaker_wav.content_hash, model_name, LATENTS_VERSION)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Latents], device: str) -> Latents:
+        """
+        Returns the latents for `key`, calling `compute` only on a full cache miss.
+
+        Args:
+            key: Cache key from `key_for`.
+            compute: Zero-argument callable returning (gpt_cond_latent, speaker_embedding).
+            device: Device the returned tensors are moved to.
+
+        Returns:
+            A (gpt_cond_latent, speaker_embedding) tuple on `device`.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return tuple(t.to(device) for t in self._memory[key])
+
+        latents = self._load_from_disk(key)
+        if latents is not None:
+            counter = 'disk_hits'
+        else:
+            counter = 'misses'
+            latents = tuple(t.detach().cpu() for t in compute())
+            self._save_to_disk(key, latents)
+
+        with self._lock:
+            self._counters[counter] += 1
+            self._memory[key] = latents
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return tuple(t.to(device) for t in latents)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _load_from_disk(self, key: str) -> Optional[Latents]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        import torch
+        try:
+            data = torch.load(path, map_location="cpu")
+            os.utime(path)  # Refresh the mtime used for LRU eviction
+            return data['gpt_cond_latent'], data['speaker_embedding']
+        except Exception as e:
+            logging.warning(f"Discarding unreadable speaker cache entry {path}: {e}")
+            os.remove(path)
+            return None
+
+    def _save_to_disk(self, key: str, latents: Latents) -> None:
+        import torch
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        torch.save({'gpt_cond_latent': latents[0], 'speaker_embedding': latents[1]}, tmp_path)
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pt"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.disk_budget:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._counters)
+        stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+        return stats
+
+    def describe(self) -> str:
+        stats = self.stats()
+        return f"speaker cache: {stats['hits']} hit(s), {stats['misses']} miss(es)"
+
+
+_cache: Optional[SpeakerLatentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_speaker_cache() -> SpeakerLatentCache:
+    """Returns the process-wide speaker latent cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SpeakerLatentCache()
+        return _cache
@@ -0,0 +1,223 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Any, Dict, Generator, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+import soundfile as sf
+from processing import audio
+from processing.decoded_audio import DecodedAudio
+
+# Sentence-chunked streaming synthesis for long scripts.
+#
+# XTTS drifts in quality on long inputs and only returns once the whole text is spoken.
+# Here the text is split into sentences (and long sentences into clauses) following French
+# typography, each chunk is synthesised separately, optionally spread over several devices,
+# and the chunks are joined with short crossfades. Partial audio is yielded as soon as each
+# chunk is ready so the UI can preview it, together with the time to first chunk and the
+# real-time factor (synthesis time / audio duration).
+
+# XTTS warns above ~273 characters for French; chunks stay below that.
+MAX_CHUNK_CHARS = 250
+FIRST_CHUNK_CHARS = 120  # Keep the first chunk short for a low time to first audio
+CROSSFADE_MS = 25
+
+# Lower-cased abbreviations after which a period does not end a sentence
+FRENCH_ABBREVIATIONS = {
+    "m", "mm", "mme", "mmes", "mlle", "mlles", "dr", "pr", "me", "st", "ste", "cf", "ex", "p",
+    "pp", "av", "bd", "n", "no", "vol", "chap", "fig", "env", "min", "max", "etc", "éd", "coll"
+}
+
+_SENTENCE_END = re.compile(r"(\.{3}|…|[.!?])+[\"»”’)\]]*")
+_CLAUSE_END = re.compile(r"[;:,]\s+|\s+[—–]\s+")
+
+
+def normalise_spaces(text: str) -> str:
+    # French typography puts (narrow) non-breaking spaces before ; : ! ? and inside « »
+    return re.sub(r"\s+", " ", text).strip()  # \s covers U+00A0 and U+202F
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Splits French text into sentences.
+
+    A sentence ends at . ! ? … (with any closing quote) followed by a space and an
+    uppercase letter, an opening quote, a digit or the end of the text. Periods after
+    known abbreviations ("M.", "Mme.", "etc.") and single-letter initials do not end a
+    sentence, and decimals such as "3.5" are never split.
+    """
+    text = normalise_spaces(text)
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+        following = text[end:end + 2]
+        if end < len(text) and not re.match(r" [A-ZÀ-ÖØ-Þ«\"“0-9]", following):
+            continue
+        if match.group(0).startswith(".") and not match.group(0).startswith("..."):
+            previous_word = re.search(r"([\wÀ-ÿ]+)$", text[start:match.start()])
+            if previous_word and (
+                previous_word.group(1).lower() in FRENCH_ABBREVIATIONS
+                or (len(previous_word.group(1)) == 1 and previous_word.group(1).isupper())
+            ):
+                continue
+        sentences.append(text[start:end].strip())
+        start = end
+    if text[start:].strip():
+        sentences.append(text[start:].strip())
+    return sentences
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    if len(sentence) <= max_chars:
+        return [sentence]
+    # Cut on clause punctuation first, then between words
+    clauses, start = [], 0
+    for match in _CLAUSE_END.finditer(sentence):
+        clauses.append(sentence[start:match.end()].strip())
+        start = match.end()
+    clauses.append(sentence[start:].strip())
+
+    pieces = []
+    for clause in clauses:
+        if len(clause) <= max_chars:
+            pieces.append(clause)
+            continue
+        words, current = clause.split(" "), ""
+        for word in words:
+            if current and len(current) + 1 + len(word) > max_chars:
+                pieces.append(current)
+                current = word
+            else:
+                current = f"{current} {word}".strip()
+        if current:
+            pieces.append(current)
+    return _merge(pieces, max_chars)
+
+
+def _merge(pieces: Sequence[str], max_chars: int, first_max_chars: Optional[int] = None) -> List[str]:
+    chunks: List[str] = []
+    for piece in pieces:
+        limit = first_max_chars if first_max_chars and len(chunks) == 1 else max_chars
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= limit:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def split_text(text: str, max_chars: int = MAX_CHUNK_CHARS, first_max_chars: int = FIRST_CHUNK_CHARS) -> List[str]:
+    """
+    Splits a script into synthesis chunks of whole sentences (or clauses for long ones).
+
+    Short sentences are grouped up to `max_chars`; the first chunk is capped at
+    `first_max_chars` so the first audio arrives quickly.
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        pieces.extend(_split_long(sentence, max_chars))
+    return _merge(pieces, max_chars, first_max_chars)
+
+
+class CrossfadeJoiner:
+    """Appends audio chunks with a short linear crossfade at each boundary."""
+
+    def __init__(self, sample_rate: int, crossfade_ms: float = CROSSFADE_MS):
+        self.sample_rate = sample_rate
+        self.crossfade = int(sample_rate * crossfade_ms / 1000)
+        self._parts: List[np.ndarray] = []
+        self._tail = np.zeros(0, dtype=np.float32)  # Held back to be crossfaded with the next chunk
+
+    def append(self, chunk: np.ndarray) -> None:
+        chunk = np.asarray(chunk, dtype=np.float32)
+        overlap = min(self.crossfade, len(self._tail), len(chunk))
+        if overlap:
+            fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+            mixed = self._tail[-overlap:] * (1.0 - fade_in) + chunk[:overlap] * fade_in
+            self._parts.append(self._tail[:-overlap])
+            self._parts.append(mixed)
+            chunk = chunk[overlap:]
+        else:
+            self._parts.append(self._tail)
+        hold = min(self.crossfade, len(chunk))
+        self._parts.append(chunk[:len(chunk) - hold])
+        self._tail = chunk[len(chunk) - hold:]
+
+    @property
+    def audio(self) -> np.ndarray:
+        return np.concatenate(self._parts + [self._tail]) if self._parts else self._tail
+
+    @property
+    def duration(self) -> float:
+        return len(self.audio) / self.sample_rate
+
+
+def _synthesize_in_order(
+    chunks: Sequence[str],
+    speaker_wav: Union[str, DecodedAudio],
+    devices: Sequence[str]
+) -> Iterator[Tuple[np.ndarray, int]]:
+    if len(devices) == 1:
+        for chunk in chunks:
+            wav, sample_rate, _ = audio.synthesize_waveform(chunk, speaker_wav, devices[0])
+            yield wav, sample_rate
+        return
+
+    # One worker per device; each device has its own resident model and inference lock.
+    # Results are still yielded in text order.
+    with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+        futures = [
+            executor.submit(audio.synthesize_waveform, chunk, speaker_wav, devices[index % len(devices)])
+            for index, chunk in enumerate(chunks)
+        ]
+        for future in futures:
+            wav, sample_rate, _ = future.result()
+            yield wav, sample_rate
+
+
+def stream_tts(
+    text: str,
+    speaker_wav: Union[str, DecodedAudio],
+    tts_output_file: str,
+    device: str,
+    devices: Optional[Sequence[str]] = None,
+    crossfade_ms: float = CROSSFADE_MS
+) -> Generator[Dict[str, Any], None, None]:
+    """
+    Synthesises a script chunk by chunk, yielding the audio assembled so far.
+
+    Args:
+        text: Script to speak.
+        speaker_wav: Reference audio of the voice to clone (file path or decoded buffer).
+        tts_output_file: Path of the final WAV, written once every chunk is done.
+        device: Torch device used when `devices` is not given.
+        devices: Devices to spread the chunks over, one worker each.
+        crossfade_ms: Crossfade length at chunk boundaries.
+
+    Yields:
+        Progress dicts with 'chunk', 'chunks', 'sample_rate', 'audio' (everything joined
+        so far), 'time_to_first_chunk' and 'real_time_factor'. The last one has 'done'
+        set once `tts_output_file` is written.
+    """
+    start_time = time()
+    chunks = split_text(text)
+    joiner: Optional[CrossfadeJoiner] = None
+    progress: Dict[str, Any] = {'chunk': 0, 'chunks': len(chunks), 'time_to_first_chunk': None}
+
+    for index, (wav, sample_rate) in enumerate(_synthesize_in_order(chunks, speaker_wav, devices or [device])):
+        if joiner is None:
+            joiner = CrossfadeJoiner(sample_rate, crossfade_ms)
+            progress['time_to_first_chunk'] = time() - start_time
+        joiner.append(wav)
+        progress.update({
+            'chunk': index + 1,
+            'sample_rate': sample_rate,
+            'audio': joiner.audio,
+            'real_time_factor': (time() - start_time) / max(joiner.duration, 1e-9)
+        })
+        yield dict(progress)
+
+    if joiner is None:
+        raise ValueError("No text to synthesize")
+    sf.write(tts_output_file, joiner.audio, joiner.sample_rate, subtype='PCM_16')
+    progress.update({'done': True, 'synthesis_time': time() - start_time})
+    yield progress
@@ -1,25 +1,80 @@
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_audioclips
+import os
+import logging
 from time import time
+from processing.decoded_audio import get_decoded_audio
+from processing.ffmpeg import (
+    FFmpegError, audio_codec_args, can_copy_video, media_duration, probe, run_ffmpeg
+)
+
+MUX_MODES = ("auto", "copy", "reencode")
+
 
 def extract_audio(video_file, extracted_audio_file):
+    # Writes the shared decoded buffer out for callers that need a WAV path, and returns
+    # the video path (accepted by replace_audio_in_video) instead of an open moviepy clip.
     start_time = time()
-    video = VideoFileClip(video_file)
-    audio = video.audio
-    audio.write_audiofile(extracted_audio_file)
+    get_decoded_audio(video_file).to_wav(extracted_audio_file)
     end_time = time()
-    return end_time - start_time, video
+    return end_time - start_time, video_file
+
+
+def replace_audio_in_video(video, tts_output_file, output_video_file, mode="auto"):
+    """
+    Replaces the soundtrack of a video, looping or trimming the new audio to the video duration.
+
+    In "copy" mode the video bitstream is copied untouched and only the audio is encoded
+    (or copied when the container accepts its codec). "reencode" goes through libx264.
+    "auto" copies whenever the output container supports the input video codec, and
+    falls back to re-encoding if the copy is rejected. An explicit "copy" never re-encodes.
+
+    Args:
+        video: Path to the video, or a moviepy clip opened from a file.
+        tts_output_file: Path to the new audio track.
+        output_video_file: Path of the muxed output.
+        mode: One of MUX_MODES.
+
+    Returns:
+        The elapsed time and the mux mode that was actually used ("copy" or "reencode").
+
+    Raises:
+        FFmpegError: When ffmpeg fails, including a rejected stream copy in "copy" mode.
+    """
+    if mode not in MUX_MODES:
+        raise ValueError(f"Unknown mux mode '{mode}', expected one of {MUX_MODES}")
 
-def replace_audio_in_video(video, tts_output_file, output_video_file):
     start_time = time()
-    new_audio = AudioFileClip(tts_output_file)
+    video_file = video if isinstance(video, str) else video.filename
+    video_info = probe(video_file)
+    duration = media_duration(video_file, video_info)
+
+    fallback = mode == "auto"
+    if mode == "auto":
+        mode = "copy" if can_copy_video(video_info, output_video_file) else "reencode"
 
-    if new_audio.duration < video.duration:
-        loops = int(video.duration // new_audio.duration) + 1
-        new_audio = concatenate_audioclips([new_audio] * loops).subclip(0, video.duration)
-    else:
-        new_audio = new_audio.subclip(0, video.duration)
+    if mode == "copy":
+        try:
+            _mux(video_file, tts_output_file, output_video_file, duration, copy_video=True)
+        except FFmpegError as e:
+            if not fallback:
+                raise
+            logging.warning(f"Stream copy of {video_file} rejected, re-encoding instead: {e}")
+            mode = "reencode"
+    if mode == "reencode":
+        _mux(video_file, tts_output_file, output_video_file, duration, copy_video=False)
 
-    video_with_new_audio = video.set_audio(new_audio)
-    video_with_new_audio.write_videofile(output_video_file, codec="libx264", audio_codec="aac")
     end_time = time()
-    return end_time - start_time, video_with_new_audio
+    return end_time - start_time, mode
+
+
+def _mux(video_file, audio_file, output_video_file, duration, copy_video):
+    # The audio input is looped indefinitely and cut at the video duration, which covers
+    # both the shorter (loop) and longer (trim) cases without building clip lists.
+    audio_args = audio_codec_args(probe(audio_file), output_video_file)
+    video_args = ["-c:v", "copy"] if copy_video else ["-c:v", "libx264", "-pix_fmt", "yuv420p"]
+    container_args = ["-movflags", "+faststart"] if os.path.splitext(output_video_file)[1].lower() in (".mp4", ".mov", ".m4v") else []
+    run_ffmpeg(
+        ["-i", video_file, "-stream_loop", "-1", "-i", audio_file,
+         "-map", "0:v:0", "-map", "1:a:0", "-t", f"{duration:.6f}"]
+        + video_args + audio_args + container_args + [output_video_file],
+        description="audio replacement"
+    )
@@ -1,161 +1,20 @@
 import os
 import copy
+import queue
 import logging
-from datetime import datetime
 from typing import Any, Dict, Generator, List, Optional, Tuple
-import torch
 import gradio as gr
-from moviepy.editor import VideoFileClip, concatenate_videoclips
-from moviepy.video.fx.resize import resize
-from processing import audio
-from processing.run_docker import run_video_retalking
+from processing.model_registry import default_device
+from processing.pipeline import TaskContext, build_stages, make_task, validate_task
+from processing.scheduler import CANCELLED, COMPLETED, ERROR, PENDING, get_scheduler
+from utils import startup
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-def process_video(
-    video_file: gr.File,
-    tts_text: str,
-    use_video_audio: bool,
-    audio_file: Optional[gr.File],
-    iterations: int,
-    archive_folder: str,
-    downscale_percentage: int,
-    task_name: str,
-    task_list: List[Dict[str, Any]],
-    task_index: int
-) -> Generator[Tuple[List[Dict[str, Any]], str, Optional[str], gr.update, Optional[List[str]]], None, None]:
-    """
-    Processes a video by lip-syncing it with generated TTS audio.
-
-    Yields:
-        A tuple containing updated task list, status message, output video file path,
-        updated task list display data, and a list of output files.
-    """
-    updated_task_list = copy.deepcopy(task_list)
-    all_output_files = []
-
-    if not video_file or not tts_text or not iterations:
-        task_list_display = [[t['task_name'], t['status']] for t in updated_task_list]
-        yield updated_task_list, f"Task '{task_name}': Please provide all inputs.", None, gr.update(value=task_list_display), None
-        return
-
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    logging.info(f"Task '{task_name}': Using device: {device}")
-
-    video_file_path = video_file.name
-
-    if not use_video_audio and not audio_file:
-        task_list_display = [[t['task_name'], t['status']] for t in updated_task_list]
-        yield updated_task_list, f"Task '{task_name}': Please provide an audio file or select 'Use Audio from Video'.", None, gr.update(value=task_list_display), None
-        return
-
-    def extract_audio(video_path: str) -> Optional[str]:
-        """
-        Extracts audio from the given video file.
-
-        Args:
-            video_path: Path to the video file.
-
-        Returns:
-            Path to the extracted audio file or None if extraction fails.
-        """
-        try:
-            clip = VideoFileClip(video_path)
-            audio_path = video_path.replace(".mp4", "_extracted.wav")
-            clip.audio.write_audiofile(audio_path)
-            return audio_path
-        except Exception as e:
-            logging.error(f"Task '{task_name}': Error extracting audio: {e}")
-            return None
-
-    try:
-        # Update task status to "Processing"
-        updated_task_list[task_index]['status'] = "Processing"
-        task_list_display = [[t['task_name'], t['status']] for t in updated_task_list]
-        yield updated_task_list, f"Task '{task_name}': Starting processing...", None, gr.update(value=task_list_display), None
-
-        # Ensure archive folder exists or set to current working directory
-        if archive_folder:
-            os.makedirs(archive_folder, exist_ok=True)
-        else:
-            archive_folder = os.getcwd()
-
-        extracted_audio_file = extract_audio(video_file_path) if use_video_audio else audio_file.name
-
-        if not extracted_audio_file:
-            logging.error(f"Task '{task_name}': Failed to obtain audio.")
-            updated_task_list[task_index]['status'] = "Error"
-            task_list_display = [[t['task_name'], t['status']] for t in updated_task_list]
-            yield updated_task_list, f"Task '{task_name}': Failed to obtain audio.", None, gr.update(value=task_list_display), None
-            return
-
-        input_video_basename = os.path.splitext(os.path.basename(video_file_path))[0]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-
-        if downscale_percentage < 100:
-            task_msg = f"Task '{task_name}': Downscaling video to {downscale_percentage}%..."
-            yield updated_task_list, task_msg, None, gr.update(value=task_list_display), None
-            original_clip = VideoFileClip(video_file_path)
-            downscale_factor = downscale_percentage / 100.0
-            downscaled_clip = original_clip.fx(resize, downscale_factor)
-            downscaled_video_file = os.path.join(archive_folder, f"{input_video_basename}_downscaled_{timestamp}.mp4")
-            downscaled_clip.write_videofile(downscaled_video_file, codec='libx264')
-            video_file_path = downscaled_video_file
-            original_resolution = (original_clip.w, original_clip.h)
-        else:
-            original_resolution = None
-
-        output_video_files = []
-
-        for iteration in range(iterations):
-            tts_output_file = os.path.join(archive_folder, f"{input_video_basename}_generated_audio_{timestamp}_{iteration}.wav")
-            output_video_file = os.path.join(archive_folder, f"{input_video_basename}_output_video_{timestamp}_{iteration}.mp4")
-
-            status_msg = f"Task '{task_name}': Synthesizing speech (Iteration {iteration + 1}/{iterations})..."
-            yield updated_task_list, status_msg, None, gr.update(value=task_list_display), None
-            audio.generate_tts_audio(tts_text, extracted_audio_file, tts_output_file, device)
-
-            status_msg = f"Task '{task_name}': Lip syncing in progress (Iteration {iteration + 1}/{iterations})..."
-            yield updated_task_list, status_msg, None, gr.update(value=task_list_display), None
-            run_video_retalking(video_file_path, tts_output_file, output_video_file)
-            logging.info(f"Task '{task_name}': Lip-synced video {iteration + 1}/{iterations} saved to {output_video_file}")
-
-            output_video_files.append(output_video_file)
-            all_output_files.append(output_video_file)
-
-        status_msg = f"Task '{task_name}': Concatenating videos for comparison..."
-        yield updated_task_list, status_msg, None, gr.update(value=task_list_display), None
-
-        clips = []
-        for output_video_file in output_video_files:
-            clip = VideoFileClip(output_video_file)
-            if original_resolution:
-                status_msg = f"Task '{task_name}': Upscaling video to original resolution..."
-                yield updated_task_list, status_msg, None, gr.update(value=task_list_display), None
-                clip = clip.resize(newsize=original_resolution)
-            clips.append(clip)
-
-        original_clip = VideoFileClip(video_file.name)
-        clips.append(original_clip)
-        final_clip = concatenate_videoclips(clips)
-        comparison_video_file = os.path.join(archive_folder, f"{input_video_basename}_comparison_video_{timestamp}.mp4")
-        final_clip.write_videofile(comparison_video_file, codec='libx264')
-        all_output_files.append(comparison_video_file)
-
-        all_output_files = [os.path.abspath(file) for file in all_output_files]
-
-        # Update task status to "Completed"
-        updated_task_list[task_index]['status'] = "Completed"
-        task_list_display = [[t['task_name'], t['status']] for t in updated_task_list]
-        yield updated_task_list, f"Task '{task_name}': Processing complete!", comparison_video_file, gr.update(value=task_list_display), all_output_files
-
-    except Exception as e:
-        logging.error(f"Task '{task_name}': Error during processing: {e}")
-        updated_task_list[task_index]['status'] = "Error"
-        task_list_display = [[t['task_name'], t['status']] for t in updated_task_list]
-        yield updated_task_list, f"Task '{task_name}': Error during processing: {e}", None, gr.update(value=task_list_display), None
+def task_list_rows(task_list: List[Dict[str, Any]]) -> List[List[str]]:
+    return [[t['task_name'], t['status']] for t in task_list]
 
 
 def build_ui() -> gr.Blocks:
@@ -176,6 +35,25 @@ def build_ui() -> gr.Blocks:
                 use_video_audio = gr.Checkbox(label="Use Audio from Video", value=True)
                 audio_file = gr.File(label="Select Audio File", file_types=['audio'], visible=False)
                 iterations = gr.Number(label="Number of Iterations", value=1, precision=0, minimum=1)
+                streaming_tts = gr.Checkbox(
+                    label="Streaming TTS",
+                    value=False,
+                    info="Synthesize the text sentence by sentence and preview the audio while it is generated."
+                )
+                select_best = gr.Checkbox(
+                    label="Keep Best Takes",
+                    value=False,
+                    info="Score each TTS take with Whisper and lip-sync only the most intelligible ones."
+                )
+                keep_top = gr.Number(label="Takes to Lip-Sync", value=1, precision=0, minimum=1)
+                max_error = gr.Slider(
+                    label="Acceptable Word Error Rate",
+                    minimum=0,
+                    maximum=1,
+                    value=0.1,
+                    step=0.01,
+                    info="Stop generating takes once enough of them are at or below this word error rate."
+                )
                 downscale_percentage = gr.Slider(
                     label="Downscale Percentage",
                     minimum=10,
@@ -184,6 +62,17 @@ def build_ui() -> gr.Blocks:
                     step=1,
                     info="Select the percentage to downscale the video. Processed video will be upscaled back to original resolution."
                 )
+                comparison_layout = gr.Radio(
+                    label="Comparison Layout",
+                    choices=[("Sequential", "concat"), ("Side by side grid", "grid")],
+                    value="concat"
+                )
+                priority = gr.Number(
+                    label="Priority",
+                    value=0,
+                    precision=0,
+                    info="Tasks with a higher priority are scheduled first on each resource."
+                )
                 archive_folder = gr.Textbox(
                     label="Archive Folder Path",
                     placeholder="Enter the path to the archive folder",
@@ -191,6 +80,7 @@ def build_ui() -> gr.Blocks:
                 )
                 add_task_button = gr.Button("Add Task")
                 start_processing_button = gr.Button("Start Processing Tasks")
+                resume_button = gr.Button("Resume Failed Tasks")
             with gr.Column():
                 task_list = gr.State([])
                 gr.Markdown("## Task Scheduler")
@@ -201,8 +91,15 @@ def build_ui() -> gr.Blocks:
                     value=[]
                 )
                 output_message = gr.Textbox(label="Status", interactive=False)
+                scheduler_status = gr.Markdown()
+                with gr.Row():
+                    cancel_task_name = gr.Textbox(label="Task to Cancel", placeholder="Name of a queued or running task")
+                    cancel_task_button = gr.Button("Cancel Task")
+                tts_preview = gr.Audio(label="TTS Preview", interactive=False)
                 output_video = gr.Video(label="Output Video")
                 output_files = gr.File(label="Download Output Files", file_count="multiple")
+                with gr.Accordion("Stage Profile", open=False):
+                    stage_trace = gr.JSON(label="Trace of the latest task event")
 
         def toggle_audio_input(use_audio: bool) -> gr.update:
             """
@@ -231,6 +128,12 @@ def build_ui() -> gr.Blocks:
             iter_count: float,
             archive: str,
             downscale: float,
+            layout: str,
+            task_priority: float,
+            streaming: bool,
+            best: bool,
+            top: float,
+            error: float,
             current_tasks: List[Dict[str, Any]]
         ) -> Tuple[List[Dict[str, Any]], gr.update]:
             """
@@ -245,6 +148,12 @@ def build_ui() -> gr.Blocks:
                 iter_count: Number of iterations.
                 archive: Archive folder path.
                 downscale: Downscale percentage.
+                layout: Comparison video layout ("concat" or "grid").
+                task_priority: Scheduling priority, higher runs first.
+                streaming: Whether to synthesize the text in sentence chunks.
+                best: Whether to score the takes and lip-sync only the best ones.
+                top: Number of takes to lip-sync when keeping the best.
+                error: Word error rate below which a take is good enough.
                 current_tasks: Current list of tasks.
 
             Returns:
@@ -252,73 +161,152 @@ def build_ui() -> gr.Blocks:
             """
             updated_tasks = copy.deepcopy(current_tasks)
 
-            if not name:
-                name = f"Task_{len(updated_tasks) + 1}"
-
-            task = {
+            task = make_task({
                 'task_name': name,
                 'video_file': video,
                 'tts_text': text,
                 'use_video_audio': use_audio,
                 'audio_file': audio,
-                'iterations': int(iter_count),
+                'iterations': iter_count,
                 'archive_folder': archive,
-                'downscale_percentage': int(downscale),
-                'status': 'Pending'
-            }
+                'downscale_percentage': downscale,
+                'comparison_layout': layout,
+                'priority': task_priority,
+                'streaming_tts': streaming,
+                'select_best': best,
+                'keep_top': top,
+                'max_error': error
+            }, default_name=f"Task_{len(updated_tasks) + 1}")
             updated_tasks.append(task)
-            display_data = [[t['task_name'], t['status']] for t in updated_tasks]
-            return updated_tasks, gr.update(value=display_data)
+            return updated_tasks, gr.update(value=task_list_rows(updated_tasks))
 
         add_task_button.click(
             fn=add_task,
             inputs=[
                 task_name, video_file, tts_text, use_video_audio, audio_file,
-                iterations, archive_folder, downscale_percentage, task_list
+                iterations, archive_folder, downscale_percentage, comparison_layout, priority, streaming_tts,
+                select_best, keep_top, max_error, task_list
             ],
             outputs=[task_list, task_list_display]
         )
 
-        def start_processing(task_list_input: List[Dict[str, Any]]) -> Generator[Tuple[List[Dict[str, Any]], str, Optional[str], gr.update, Optional[List[str]]], None, None]:
+        def start_processing(task_list_input: List[Dict[str, Any]]) -> Generator[Tuple[List[Dict[str, Any]], str, Optional[str], gr.update, Optional[List[str]], str, gr.update, gr.update], None, None]:
             """
-            Processes all tasks in the task list.
+            Submits all pending tasks to the scheduler and streams their progress.
+
+            Tasks run concurrently: each stage waits for a worker of its resource pool
+            (TTS, lip sync, encode), so one task's TTS can overlap another's lip sync.
 
             Args:
                 task_list_input: List of tasks to process.
 
             Yields:
-                Updated task list, status message, output video, task list display, and output files.
+                Updated task list, status message, output video, task list display, output files,
+                the scheduler queue/throughput readout, the latest streamed TTS preview and the
+                profiling trace (wall/CPU time, peak RSS, I/O per stage) of the task that moved.
             """
+            scheduler = get_scheduler()
             if not task_list_input:
-                yield task_list_input, "No tasks to process.", None, gr.update(), None
+                yield task_list_input, "No tasks to process.", None, gr.update(), None, scheduler.describe(), gr.update(), gr.update()
+                return
+
+            updated_tasks = copy.deepcopy(task_list_input)
+            device = default_device()
+            listener: "queue.Queue" = queue.Queue()
+            jobs: Dict[str, Tuple[int, TaskContext]] = {}
+
+            for index, task in enumerate(updated_tasks):
+                if task['status'] != PENDING:
+                    continue
+                error = validate_task(task)
+                if error:
+                    task['status'] = ERROR
+                    yield updated_tasks, f"Task '{task['task_name']}': {error}", gr.update(), gr.update(value=task_list_rows(updated_tasks)), gr.update(), scheduler.describe(), gr.update(), gr.update()
+                    continue
+                ctx = TaskContext(task, device)
+                job = scheduler.submit(task['task_name'], build_stages(ctx), priority=task.get('priority', 0), listener=listener)
+                jobs[job.job_id] = (index, ctx)
+                startup.mark("first_task_submitted")
+
+            if not jobs:
+                yield updated_tasks, "No pending tasks to process.", gr.update(), gr.update(value=task_list_rows(updated_tasks)), gr.update(), scheduler.describe(), gr.update(), gr.update()
                 return
 
             accumulated_output_files = []
-            for index, task in enumerate(task_list_input):
-                task_params = {
-                    'video_file': task['video_file'],
-                    'tts_text': task['tts_text'],
-                    'use_video_audio': task['use_video_audio'],
-                    'audio_file': task['audio_file'],
-                    'iterations': task['iterations'],
-                    'archive_folder': task['archive_folder'],
-                    'downscale_percentage': task['downscale_percentage'],
-                    'task_name': task['task_name'],
-                    'task_list': task_list_input,
-                    'task_index': index
-                }
-                for outputs in process_video(**task_params):
-                    updated_tasks, status_msg, output_video_file, display_data, output_files = outputs
-                    if output_files:
-                        accumulated_output_files.extend(output_files)
-                    yield updated_tasks, status_msg, output_video_file, gr.update(value=display_data), accumulated_output_files if output_files else None
+            shown_previews: Dict[str, Any] = {}
+            remaining = set(jobs)
+            while remaining:
+                try:
+                    event = listener.get(timeout=1.0)
+                except queue.Empty:
+                    # Keep the queue depth readout fresh while stages are running
+                    yield updated_tasks, gr.update(), gr.update(), gr.update(), gr.update(), scheduler.describe(), gr.update(), gr.update()
+                    continue
+
+                index, ctx = jobs[event.job_id]
+                updated_tasks[index]['status'] = event.status
+                output_video_file, output_files_update = gr.update(), gr.update()
+                if event.final:
+                    remaining.discard(event.job_id)
+                    ctx.release_proxy()
+                    if event.status == COMPLETED:
+                        accumulated_output_files.extend(ctx.output_files)
+                        output_video_file, output_files_update = ctx.comparison_video_file, accumulated_output_files
+                preview = gr.update()
+                if ctx.preview_audio is not None and ctx.preview_audio is not shown_previews.get(event.job_id):
+                    preview = shown_previews[event.job_id] = ctx.preview_audio
+                # Every event marks a stage transition, after which the trace has a new record
+                trace = ctx.trace.to_dict()
+                yield updated_tasks, event.message, output_video_file, gr.update(value=task_list_rows(updated_tasks)), output_files_update, scheduler.describe(), preview, trace
 
         start_processing_button.click(
             fn=start_processing,
             inputs=[task_list],
-            outputs=[task_list, output_message, output_video, task_list_display, output_files]
+            outputs=[task_list, output_message, output_video, task_list_display, output_files, scheduler_status, tts_preview, stage_trace]
+        )
+
+        def resume_tasks(task_list_input: List[Dict[str, Any]]) -> Generator[Tuple[List[Dict[str, Any]], str, Optional[str], gr.update, Optional[List[str]], str, gr.update, gr.update], None, None]:
+            """
+            Re-submits tasks in Error (or Cancelled) state.
+
+            Stage outputs recorded in the archive folder's job journal are reused, so a
+            resumed task restarts from the stage that failed.
+
+            Args:
+                task_list_input: List of tasks.
+
+            Yields:
+                The same outputs as start_processing.
+            """
+            updated_tasks = copy.deepcopy(task_list_input or [])
+            for task in updated_tasks:
+                if task['status'] in (ERROR, CANCELLED):
+                    task['status'] = PENDING
+            yield from start_processing(updated_tasks)
+
+        resume_button.click(
+            fn=resume_tasks,
+            inputs=[task_list],
+            outputs=[task_list, output_message, output_video, task_list_display, output_files, scheduler_status, tts_preview, stage_trace]
         )
 
+        def cancel_task(name: str) -> str:
+            """
+            Cancels every queued or running task with the given name.
+
+            Args:
+                name: Task name as shown in the task list.
+
+            Returns:
+                A status message.
+            """
+            cancelled = get_scheduler().cancel_by_name(name)
+            if not cancelled:
+                return f"No queued or running task named '{name}'."
+            return f"Cancelling {cancelled} task(s) named '{name}'; running stages finish first."
+
+        cancel_task_button.click(fn=cancel_task, inputs=[cancel_task_name], outputs=[output_message])
+
         gr.Examples(
             examples=[
                 ["Bienvenue à cette belle conférence de 2023 sur le partage de savoir"],
@@ -329,6 +317,12 @@ def build_ui() -> gr.Blocks:
             label="Example Texts for TTS"
         )
 
+        def page_loaded() -> None:
+            # Time to the first page served, for the cold-start report (utils.startup)
+            startup.mark("first_page_load")
+
+        demo.load(fn=page_loaded)
+
     return demo
 
 
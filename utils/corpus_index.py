@@ -0,0 +1,502 @@
+import os
+import json
+import random
+import argparse
+import logging
+import threading
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from math import gcd
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+from utils.speech_detection import detect_speech_segments
+
+# Precomputed feature index of the GRID corpus.
+#
+# Experiments used to decode the same MPG/WAV clips again for every run. The indexing job
+# walks gridcorpus/audio and gridcorpus/video once and stores, in the index folder:
+#
+#   manifest.json   one entry per utterance: speaker, utterance, duration, sample rate,
+#                   speech segments, source file stamps and the offsets of its features
+#   pcm.f32         16 kHz mono PCM of every utterance, back to back (float32)
+#   mel.f32         log-mel spectrogram frames, N_MELS float32 values per frame
+#   faces.u8        optional FACE_SIZE x FACE_SIZE RGB face crops, one per video frame
+#
+# The arrays are memory-mapped, so an utterance's features are zero-copy slices found
+# through the offsets in its manifest entry. Data files are append-only: re-running the job
+# only processes new or modified sources and appends them; `compact` rewrites the files
+# without the regions no entry refers to any more. The manifest is replaced atomically after
+# the data is written, so an interrupted update leaves a consistent (older) index; the next
+# update first truncates the data files to the rows that manifest refers to, dropping any
+# torn or unreferenced tail before appending.
+#
+# Usage: python -m utils.corpus_index --corpus gridcorpus --index gridcorpus/index [--faces]
+
+INDEX_VERSION = 1
+SAMPLE_RATE = 16000
+N_FFT = 400  # 25 ms
+HOP_LENGTH = 160  # 10 ms
+N_MELS = 80
+FACE_SIZE = 96
+FFMPEG = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+
+ARRAYS = {
+    # name: (file, dtype, row shape)
+    'pcm': ("pcm.f32", np.float32, ()),
+    'mel': ("mel.f32", np.float32, (N_MELS,)),
+    'faces': ("faces.u8", np.uint8, (FACE_SIZE, FACE_SIZE, 3)),
+}
+
+Entry = Dict[str, Any]
+
+
+def row_bytes(name: str) -> int:
+    """Size in bytes of one row of a feature array."""
+    _, dtype, row_shape = ARRAYS[name]
+    return np.dtype(dtype).itemsize * int(np.prod(row_shape, dtype=np.int64))
+
+
+def mel_filterbank(sample_rate: int = SAMPLE_RATE, n_fft: int = N_FFT, n_mels: int = N_MELS) -> np.ndarray:
+    """Triangular filters on the HTK mel scale, shape (n_mels, n_fft // 2 + 1)."""
+    def to_mel(hz):
+        return 2595.0 * np.log10(1.0 + np.asarray(hz) / 700.0)
+
+    def to_hz(mel):
+        return 700.0 * (10 ** (np.asarray(mel) / 2595.0) - 1.0)
+
+    freqs = np.fft.rfftfreq(n_fft, d=1.0 / sample_rate)
+    edges = to_hz(np.linspace(to_mel(0.0), to_mel(sample_rate / 2), n_mels + 2))
+    lower, center, upper = edges[:-2, None], edges[1:-1, None], edges[2:, None]
+    rising = (freqs - lower) / (center - lower)
+    falling = (upper - freqs) / (upper - center)
+    return np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+
+
+_FILTERBANK = mel_filterbank()
+_WINDOW = np.hanning(N_FFT + 1)[:-1].astype(np.float32)  # Periodic Hann
+
+
+def log_mel(samples: np.ndarray) -> np.ndarray:
+    """log10 mel power spectrogram of 16 kHz PCM, shape (frames, N_MELS), centred frames."""
+    padded = np.pad(np.asarray(samples, dtype=np.float32), N_FFT // 2, mode='reflect' if len(samples) > N_FFT // 2 else 'constant')
+    frames = np.lib.stride_tricks.sliding_window_view(padded, N_FFT)[::HOP_LENGTH]
+    power = np.abs(np.fft.rfft(frames * _WINDOW, axis=1)) ** 2
+    return np.log10(np.maximum(power @ _FILTERBANK.T, 1e-10)).astype(np.float32)
+
+
+def read_pcm(path: str) -> np.ndarray:
+    """Reads an audio file as mono PCM at SAMPLE_RATE."""
+    try:
+        samples, sample_rate = sf.read(path, dtype='float32', always_2d=True)
+    except RuntimeError:
+        # Not a format libsndfile knows (e.g. the soundtrack of an MPG): decode with ffmpeg
+        command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", path,
+                   "-vn", "-ac", "1", "-ar", str(SAMPLE_RATE), "-f", "f32le", "pipe:1"]
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(f"decoding {path} failed: {result.stderr.decode(errors='replace').strip()}")
+        return np.frombuffer(result.stdout, np.float32)
+    samples = samples.mean(axis=1)
+    if sample_rate != SAMPLE_RATE:
+        factor = gcd(SAMPLE_RATE, sample_rate)
+        samples = resample_poly(samples, SAMPLE_RATE // factor, sample_rate // factor).astype(np.float32)
+    return samples
+
+
+def _raw_frames(path: str, video_filter: str, frames: Optional[int] = None) -> bytes:
+    command = [FFMPEG, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", path, "-an", "-vf", video_filter]
+    if frames:
+        command += ["-frames:v", str(frames)]
+    command += ["-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"decoding {path} failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def face_box(path: str, width: int, height: int) -> Tuple[int, int, int]:
+    """
+    Square crop (x, y, side) around the face in the first frame of a video.
+
+    GRID is filmed with a static camera and a seated speaker, so one box per clip is
+    enough. Uses OpenCV's frontal face cascade; falls back to a centred square.
+    """
+    side = min(width, height) * 2 // 3
+    fallback = ((width - side) // 2, (height - side) // 3, side)
+    try:
+        import cv2
+    except ImportError:
+        return fallback
+    frame = np.frombuffer(_raw_frames(path, f"scale={width}:{height}", frames=1), np.uint8)
+    if frame.size != width * height * 3:
+        return fallback
+    gray = cv2.cvtColor(frame.reshape(height, width, 3), cv2.COLOR_RGB2GRAY)
+    cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml"))
+    faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(40, 40))
+    if len(faces) == 0:
+        return fallback
+    x, y, w, h = max(faces, key=lambda box: box[2] * box[3])
+    # Widen the detection to include the chin and some context, kept inside the frame
+    side = min(int(max(w, h) * 1.4), width, height)
+    x = int(np.clip(x + w / 2 - side / 2, 0, width - side))
+    y = int(np.clip(y + h / 2 - side / 2 + 0.1 * h, 0, height - side))
+    return x, y, side
+
+
+def read_faces(path: str, width: int = 360, height: int = 288) -> np.ndarray:
+    """Decodes every frame of a video, cropped to the face and scaled to FACE_SIZE."""
+    x, y, side = face_box(path, width, height)
+    video_filter = f"scale={width}:{height},crop={side}:{side}:{x}:{y},scale={FACE_SIZE}:{FACE_SIZE}"
+    data = np.frombuffer(_raw_frames(path, video_filter), np.uint8)
+    return data.reshape(-1, FACE_SIZE, FACE_SIZE, 3)
+
+
+def _stamp(path: Optional[str]) -> Optional[List[int]]:
+    if not path:
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def find_sources(corpus: str) -> Dict[str, Dict[str, str]]:
+    """
+    Maps "speaker/utterance" to its audio and video files.
+
+    The speaker is the first folder under corpus/audio or corpus/video (s1, s2...), the
+    utterance the file name without extension, wherever the archive nested the files.
+    """
+    sources: Dict[str, Dict[str, str]] = {}
+    for kind, extensions in (("audio", (".wav",)), ("video", (".mpg", ".mp4"))):
+        root = os.path.join(corpus, kind)
+        if not os.path.isdir(root):
+            continue
+        for speaker in sorted(os.listdir(root)):
+            for folder, _, files in os.walk(os.path.join(root, speaker)):
+                for name in files:
+                    utterance, extension = os.path.splitext(name)
+                    if extension.lower() in extensions:
+                        sources.setdefault(f"{speaker}/{utterance}", {})[kind] = os.path.join(folder, name)
+    return sources
+
+
+def extract_features(key: str, files: Dict[str, str], faces: bool) -> Dict[str, Any]:
+    """Decodes one utterance and computes its features (run on the indexing pool)."""
+    speaker, utterance = key.split("/", 1)
+    features: Dict[str, Any] = {'key': key, 'speaker': speaker, 'utterance': utterance}
+    if 'audio' in files:
+        pcm = read_pcm(files['audio'])
+        features['pcm'] = pcm
+        features['mel'] = log_mel(pcm)
+        features['segments'] = [[round(s, 3), round(e, 3)] for s, e in detect_speech_segments(pcm, SAMPLE_RATE)]
+        features['duration'] = round(len(pcm) / SAMPLE_RATE, 3)
+    if faces and 'video' in files:
+        features['faces'] = read_faces(files['video'])
+        features.setdefault('duration', round(len(features['faces']) / 25.0, 3))
+    return features
+
+
+class CorpusIndex:
+    """
+    Read access to an index built by `build_index`.
+
+    Args:
+        index_dir: Folder holding manifest.json and the feature arrays.
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "manifest.json"), encoding='utf-8') as manifest:
+            self.manifest = json.load(manifest)
+        self.entries: Dict[str, Entry] = self.manifest['entries']
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, key: str) -> Entry:
+        return self.entries[key]
+
+    def array(self, name: str) -> np.ndarray:
+        """Memory-mapped view of a whole feature array ('pcm', 'mel' or 'faces')."""
+        with self._lock:
+            if name not in self._arrays:
+                file_name, dtype, row_shape = ARRAYS[name]
+                path = os.path.join(self.index_dir, file_name)
+                rows = os.path.getsize(path) // row_bytes(name) if os.path.exists(path) else 0
+                self._arrays[name] = (
+                    np.memmap(path, dtype=dtype, mode='r', shape=(rows,) + row_shape) if rows
+                    else np.zeros((0,) + row_shape, dtype)
+                )
+            return self._arrays[name]
+
+    def features(self, key: str, name: str) -> Optional[np.ndarray]:
+        """Zero-copy slice of one utterance's feature, or None if it was not indexed."""
+        span = self.entries[key].get(name)
+        if span is None:
+            return None
+        start, length = span
+        return self.array(name)[start:start + length]
+
+    def pcm(self, key: str) -> Optional[np.ndarray]:
+        return self.features(key, 'pcm')
+
+    def mel(self, key: str) -> Optional[np.ndarray]:
+        return self.features(key, 'mel')
+
+    def faces(self, key: str) -> Optional[np.ndarray]:
+        return self.features(key, 'faces')
+
+    def select(
+        self,
+        speakers: Optional[Sequence[str]] = None,
+        min_duration: float = 0.0,
+        max_duration: float = float('inf'),
+        require: Sequence[str] = ()
+    ) -> List[str]:
+        """Keys of the utterances matching the filters, in a stable order."""
+        return [
+            key for key, entry in sorted(self.entries.items())
+            if (speakers is None or entry['speaker'] in speakers)
+            and min_duration <= entry.get('duration', 0) <= max_duration
+            and all(entry.get(name) is not None for name in require)
+        ]
+
+    def batches(
+        self,
+        keys: Optional[Sequence[str]] = None,
+        batch_size: int = 32,
+        by: str = "duration",
+        shuffle: bool = False,
+        seed: int = 0
+    ) -> Iterator[List[str]]:
+        """
+        Groups utterance keys into batches.
+
+        Args:
+            keys: Utterances to batch (all by default).
+            batch_size: Maximum utterances per batch.
+            by: "duration" puts utterances of similar length together to limit padding;
+                "speaker" never mixes speakers within a batch.
+            shuffle: Shuffle the batch order (and the utterances within each speaker).
+            seed: Seed of the shuffle.
+        """
+        keys = list(self.entries) if keys is None else list(keys)
+        rng = random.Random(seed)
+        if by == "duration":
+            keys.sort(key=lambda k: (self.entries[k].get('duration', 0), k))
+            batches = [keys[i:i + batch_size] for i in range(0, len(keys), batch_size)]
+        elif by == "speaker":
+            groups: Dict[str, List[str]] = {}
+            for key in sorted(keys):
+                groups.setdefault(self.entries[key]['speaker'], []).append(key)
+            batches = []
+            for group in groups.values():
+                if shuffle:
+                    rng.shuffle(group)
+                batches.extend(group[i:i + batch_size] for i in range(0, len(group), batch_size))
+        else:
+            raise ValueError(f"Unknown batching '{by}', expected 'duration' or 'speaker'")
+        if shuffle:
+            rng.shuffle(batches)
+        return iter(batches)
+
+    def padded(self, keys: Sequence[str], name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Stacks one feature of several utterances, zero-padded: (batch array, lengths)."""
+        slices = [self.features(key, name) for key in keys]
+        lengths = np.array([0 if s is None else len(s) for s in slices])
+        _, dtype, row_shape = ARRAYS[name]
+        batch = np.zeros((len(keys), int(lengths.max(initial=0))) + row_shape, dtype)
+        for i, feature in enumerate(slices):
+            if feature is not None:
+                batch[i, :len(feature)] = feature
+        return batch, lengths
+
+
+def _empty_manifest(faces: bool) -> Dict[str, Any]:
+    return {
+        'version': INDEX_VERSION,
+        'sample_rate': SAMPLE_RATE,
+        'mel': {'n_fft': N_FFT, 'hop_length': HOP_LENGTH, 'n_mels': N_MELS},
+        'face_size': FACE_SIZE if faces else None,
+        'entries': {}
+    }
+
+
+def _write_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    path = os.path.join(index_dir, "manifest.json")
+    with open(f"{path}.partial", 'w', encoding='utf-8') as output:
+        json.dump(manifest, output)
+    os.replace(f"{path}.partial", path)
+
+
+def _truncate_to_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    # Rows past the last one the manifest refers to were written by an interrupted update
+    # (possibly ending in a partial row); appending after them would misplace every new row
+    for name, (file_name, _, _) in ARRAYS.items():
+        path = os.path.join(index_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        end_rows = max((entry[name][0] + entry[name][1] for entry in manifest['entries'].values() if entry.get(name)), default=0)
+        end = end_rows * row_bytes(name)
+        if os.path.getsize(path) > end:
+            logging.info(f"Truncating {path} to the {end_rows} rows referenced by the manifest")
+            os.truncate(path, end)
+
+
+def build_index(corpus: str, index_dir: str, faces: bool = False, workers: int = 4, checkpoint_every: int = 500) -> Dict[str, int]:
+    """
+    Creates or updates the index of a corpus.
+
+    Utterances whose source files are unchanged are kept as they are; new and modified
+    ones are processed on a thread pool and appended, and entries whose sources are gone
+    are dropped from the manifest.
+
+    Args:
+        corpus: Folder containing the audio/ and video/ trees.
+        index_dir: Folder of the index.
+        faces: Also store face crops of the videos.
+        workers: Utterances processed at once.
+        checkpoint_every: Number of new utterances between manifest saves.
+
+    Returns:
+        Counts of 'added', 'kept' and 'removed' utterances.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    manifest_path = os.path.join(index_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as existing:
+            manifest = json.load(existing)
+        if manifest.get('version') != INDEX_VERSION or manifest['mel']['n_mels'] != N_MELS:
+            raise ValueError(f"{index_dir} was built with other settings; remove it to rebuild")
+    else:
+        manifest = _empty_manifest(faces)
+    _truncate_to_manifest(index_dir, manifest)
+    faces = faces or bool(manifest.get('face_size'))
+    manifest['face_size'] = FACE_SIZE if faces else None
+
+    sources = find_sources(corpus)
+    entries = manifest['entries']
+    removed = [key for key in entries if key not in sources]
+    for key in removed:
+        del entries[key]
+    todo = {}
+    for key, files in sources.items():
+        entry = entries.get(key)
+        stamps = {kind: _stamp(files.get(kind)) for kind in ("audio", "video")}
+        if entry is None or entry.get('sources') != stamps or (faces and 'video' in files and entry.get('faces') is None):
+            todo[key] = files
+    kept = len(sources) - len(todo)
+
+    outputs = {name: open(os.path.join(index_dir, spec[0]), 'ab') for name, spec in ARRAYS.items() if name != 'faces' or faces}
+    row_counts = {name: handle.tell() // row_bytes(name) for name, handle in outputs.items()}
+    added = 0
+    try:
+        # At most 2 * workers utterances in flight: each finished one is written out and
+        # dropped before the next is submitted, so memory does not grow with the corpus
+        pending = iter(sorted(todo.items()))
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                for key, files in islice(pending, 2 * workers - len(in_flight)):
+                    in_flight.add(pool.submit(extract_features, key, files, faces))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                while done:
+                    try:
+                        features = done.pop().result()
+                    except Exception as e:
+                        logging.warning(f"Skipping utterance: {e}")
+                        continue
+                    key = features['key']
+                    entry = {
+                        'speaker': features['speaker'],
+                        'utterance': features['utterance'],
+                        'duration': features.get('duration', 0.0),
+                        'sample_rate': SAMPLE_RATE,
+                        'segments': features.get('segments'),
+                        'sources': {kind: _stamp(todo[key].get(kind)) for kind in ("audio", "video")},
+                        'files': {kind: os.path.relpath(path, corpus) for kind, path in todo[key].items()},
+                    }
+                    # Appended in completion order; the offsets record where each one landed
+                    for name, handle in outputs.items():
+                        data = features.get(name)
+                        if data is None:
+                            entry[name] = None
+                            continue
+                        handle.write(np.ascontiguousarray(data, ARRAYS[name][1]).tobytes())
+                        entry[name] = [row_counts[name], len(data)]
+                        row_counts[name] += len(data)
+                    entries[key] = entry
+                    added += 1
+                    if added % checkpoint_every == 0:
+                        for handle in outputs.values():
+                            handle.flush()
+                        _write_manifest(index_dir, manifest)
+                        logging.info(f"Indexed {added}/{len(todo)} new utterances")
+    finally:
+        for handle in outputs.values():
+            handle.close()
+        _write_manifest(index_dir, manifest)
+    return {'added': added, 'kept': kept, 'removed': len(removed)}
+
+
+def compact(index_dir: str) -> Dict[str, int]:
+    """
+    Rewrites the feature arrays without the regions no manifest entry refers to.
+
+    Returns:
+        The number of bytes reclaimed per array.
+    """
+    index = CorpusIndex(index_dir)
+    manifest = index.manifest
+    reclaimed = {}
+    for name, (file_name, dtype, _) in ARRAYS.items():
+        path = os.path.join(index_dir, file_name)
+        if not os.path.exists(path):
+            continue
+        source = index.array(name)
+        before = os.path.getsize(path)
+        row = 0
+        with open(f"{path}.partial", 'wb') as output:
+            for key in sorted(manifest['entries']):
+                entry = manifest['entries'][key]
+                if entry.get(name) is None:
+                    continue
+                start, length = entry[name]
+                output.write(np.ascontiguousarray(source[start:start + length]).tobytes())
+                entry[name] = [row, length]
+                row += length
+        reclaimed[name] = before - os.path.getsize(f"{path}.partial")
+    # Swap every array, then the manifest that points into them
+    for name, (file_name, _, _) in ARRAYS.items():
+        path = os.path.join(index_dir, file_name)
+        if os.path.exists(f"{path}.partial"):
+            os.replace(f"{path}.partial", path)
+    _write_manifest(index_dir, manifest)
+    return reclaimed
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Build or update the memory-mapped GRID feature index.")
+    parser.add_argument("--corpus", default="gridcorpus", help="Folder containing audio/ and video/")
+    parser.add_argument("--index", default=os.path.join("gridcorpus", "index"), help="Index folder")
+    parser.add_argument("--faces", action="store_true", help="Also store face crops of the videos")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--compact", action="store_true", help="Reclaim the space of replaced utterances")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    counts = build_index(args.corpus, args.index, args.faces, args.workers)
+    logging.info(f"Index updated: {counts['added']} added, {counts['kept']} unchanged, {counts['removed']} removed")
+    if args.compact:
+        reclaimed = compact(args.index)
+        logging.info(f"Compacted: {sum(reclaimed.values()) / 2 ** 20:.1f} MB reclaimed")
+
+
+if __name__ == "__main__":
+    main()
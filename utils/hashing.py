@@ -0,0 +1,48 @@
+import os
+import hashlib
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path, algorithm="sha256"):
+    """
+    Returns the hex digest of a file's content, read in 1 MB chunks.
+
+    Args:
+        path: Path to the file.
+        algorithm: Any algorithm name accepted by hashlib.
+
+    Returns:
+        The hex digest string.
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_values(*values, algorithm="sha256"):
+    """Returns a stable hex digest of the string representation of the given values."""
+    digest = hashlib.new(algorithm)
+    for value in values:
+        digest.update(repr(value).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+_file_hash_memo = {}
+
+
+def cached_hash_file(path, algorithm="sha256"):
+    """
+    Same as hash_file, but remembers digests for the lifetime of the process.
+
+    Entries are keyed by (path, size, modification time), so a file that is rewritten in
+    place is hashed again.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, algorithm)
+    if key not in _file_hash_memo:
+        _file_hash_memo[key] = hash_file(path, algorithm)
+    return _file_hash_memo[key]
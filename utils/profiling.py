@@ -0,0 +1,251 @@
+import os
+import json
+import logging
+import resource
+import threading
+from datetime import datetime
+from functools import wraps
+from time import perf_counter, process_time, sleep, thread_time, time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Lightweight instrumentation of the pipeline stages.
+#
+# `profile(name)` is a context manager and decorator that measures a block of work:
+#
+#   wall_seconds            elapsed time
+#   cpu_thread_seconds      CPU time of the calling thread
+#   cpu_process_seconds     CPU time of the whole process (includes concurrent stages and
+#                           native worker threads such as torch's)
+#   cpu_children_seconds    CPU time of the subprocesses (ffmpeg...) reaped during the block
+#   peak_rss_mb             highest resident set size sampled during the block
+#   read_bytes/write_bytes  bytes read and written by the process and its reaped children,
+#                           pipes included on Linux (rchar/wchar), storage I/O elsewhere
+#   subprocess_seconds      wall time spent in ffmpeg calls made from the calling thread
+#
+# Process-wide figures overlap when stages run concurrently on the scheduler's pools; the
+# thread figures do not. Records are appended to a Trace, one per task, saved as JSON next
+# to the task's outputs. RSS and I/O come from psutil (pinned in requirements.txt); the
+# /proc and getrusage readers below are only a fallback for environments without it.
+
+RSS_SAMPLE_SECONDS = float(os.environ.get("DEEPFAKE_PROFILE_SAMPLE_SECONDS", "0.05"))
+
+_local = threading.local()
+
+
+def _rss_bytes() -> int:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # High-water mark of the process, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _io_bytes() -> Dict[str, int]:
+    if psutil is not None:
+        try:
+            io = psutil.Process().io_counters()
+        except (AttributeError, psutil.Error):  # Not available on macOS
+            return {}
+        # read_chars/write_chars are /proc's rchar/wchar (pipes included); other platforms
+        # only count storage I/O
+        return {
+            'read_bytes': getattr(io, 'read_chars', io.read_bytes),
+            'write_bytes': getattr(io, 'write_chars', io.write_bytes),
+        }
+    try:
+        with open("/proc/self/io") as io:
+            counters = dict(line.split(": ") for line in io.read().splitlines())
+        return {'read_bytes': int(counters['rchar']), 'write_bytes': int(counters['wchar'])}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+class _RssSampler:
+    """Samples the resident set size while at least one profile is open."""
+
+    def __init__(self, interval: float = RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.active: List["profile"] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, block: "profile") -> None:
+        with self._lock:
+            self.active.append(block)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def remove(self, block: "profile") -> None:
+        with self._lock:
+            self.active.remove(block)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self.active:
+                    self._wake.wait()
+            rss = _rss_bytes()
+            with self._lock:
+                for block in self.active:
+                    block.peak_rss = max(block.peak_rss, rss)
+            sleep(self.interval)
+
+
+_sampler = _RssSampler()
+
+
+class Trace:
+    """
+    Profile records of one task, in completion order.
+
+    Args:
+        name: Task name.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time()
+        self.records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self.records.append(record)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            records = list(self.records)
+        totals = {
+            key: round(sum(r.get(key, 0) for r in records), 3)
+            for key in ("wall_seconds", "cpu_thread_seconds", "cpu_children_seconds", "subprocess_seconds")
+        }
+        totals['read_bytes'] = sum(r.get('read_bytes', 0) for r in records)
+        totals['write_bytes'] = sum(r.get('write_bytes', 0) for r in records)
+        totals['peak_rss_mb'] = max((r.get('peak_rss_mb', 0) for r in records), default=0)
+        return {
+            'task': self.name,
+            'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'elapsed_seconds': round(time() - self.started, 3),
+            'stages': records,
+            'totals': totals
+        }
+
+    def save(self, path: str) -> str:
+        """Writes the trace as JSON, atomically, and returns its path."""
+        tmp_path = f"{path}.{threading.get_ident()}.partial"
+        with open(tmp_path, 'w', encoding='utf-8') as output:
+            json.dump(self.to_dict(), output, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+class profile:
+    """
+    Measures a block of work; usable as a context manager or a decorator.
+
+        with profile("prepare", trace, resource="encode"):
+            ...
+
+        @profile("vad")
+        def detect(...): ...
+
+    The record is available as `.record` after the block and is appended to `trace`.
+
+    Args:
+        name: Label of the measured work.
+        trace: Trace receiving the record, if any.
+        **fields: Extra fields stored in the record.
+    """
+
+    def __init__(self, name: str, trace: Optional[Trace] = None, **fields):
+        self.name = name
+        self.trace = trace
+        self.fields = fields
+        self.record: Dict[str, Any] = {}
+        self.peak_rss = 0
+
+    def __call__(self, fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            # A fresh instance per call keeps concurrent calls apart
+            with profile(self.name, self.trace, **self.fields):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self) -> "profile":
+        self.record = dict(name=self.name, **self.fields)
+        self._start = time()
+        self._wall = perf_counter()
+        self._cpu_thread = thread_time()
+        self._cpu_process = process_time()
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._cpu_children = children.ru_utime + children.ru_stime
+        self._io = _io_bytes()
+        self.peak_rss = _rss_bytes()
+        _sampler.add(self)
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _local.stack.remove(self)
+        _sampler.remove(self)
+        wall = perf_counter() - self._wall
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self.peak_rss = max(self.peak_rss, _rss_bytes())
+        record = self.record
+        record.update(
+            thread=threading.current_thread().name,
+            start_offset=round(self._start - (self.trace.started if self.trace else self._start), 3),
+            wall_seconds=round(wall, 3),
+            cpu_thread_seconds=round(thread_time() - self._cpu_thread, 3),
+            cpu_process_seconds=round(process_time() - self._cpu_process, 3),
+            cpu_children_seconds=round(children.ru_utime + children.ru_stime - self._cpu_children, 3),
+            peak_rss_mb=round(self.peak_rss / 2 ** 20, 1),
+        )
+        io = _io_bytes()
+        for key, value in io.items():
+            record[key] = value - self._io.get(key, value)
+        if 'frames' in record and wall > 0:
+            record['frames_per_second'] = round(record['frames'] / wall, 2)
+        if exc_type is not None:
+            record['error'] = f"{exc_type.__name__}: {exc}"
+        if self.trace is not None:
+            self.trace.add(record)
+        logging.debug(f"Profile {self.name}: {record}")
+
+
+def current() -> Optional[profile]:
+    """Returns the innermost profile open on the calling thread, if any."""
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def annotate(**fields) -> None:
+    """Adds fields (timings reported by the code itself, sizes, cache hits...) to the open profile."""
+    block = current()
+    if block is not None:
+        block.record.update(fields)
+
+
+def record_subprocess(description: str, seconds: float) -> None:
+    """Accounts a subprocess call to the open profile of the calling thread."""
+    block = current()
+    if block is not None:
+        record = block.record
+        record['subprocess_seconds'] = round(record.get('subprocess_seconds', 0) + seconds, 3)
+        calls = record.setdefault('subprocesses', {})
+        calls[description] = calls.get(description, 0) + 1
@@ -1,40 +1,250 @@
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
-import speech_recognition as sr
-from moviepy.editor import VideoFileClip
-import os
+import logging
+import subprocess
+from typing import Iterator, List, Optional, Tuple
+import numpy as np
+import soundfile as sf
 
+# Offline voice-activity detection on decoded PCM.
+#
+# The signal is cut into short overlapping frames (NumPy strided views, no copies) and
+# each frame is classified from three cheap features:
+#   - log energy compared to an adaptive noise floor (see below),
+#   - spectral flatness (noise is flat, voiced speech is peaky),
+#   - the share of energy in the 300-3400 Hz speech band.
+# A hangover then keeps short pauses inside a segment, and segments shorter than
+# `min_speech_duration` are dropped. Long inputs are processed in fixed-size blocks so
+# memory does not grow with the file length.
+#
+# The noise floor is a decaying minimum of the frame energies: it drops to any quieter
+# frame at once and otherwise rises slowly (`noise_rise_db_per_second`), so even a long
+# stretch of speech without pauses is not taken for noise. It starts at the quietest of the
+# first `noise_warmup_seconds` of frames that do not look like speech spectrally (or at
+# `min_energy_db - energy_margin_db` when they all do). Those frames are held back until
+# the warm-up is complete, so the floor only depends on the frames seen so far and never
+# on where blocks start and end: streaming a file in blocks of any size gives the same
+# segments as processing it in one go.
 
-def detect_speech_start(mp4_file_path, min_speech_duration=1):
-    video = VideoFileClip(mp4_file_path)
-    audio = video.audio
-    audio_file_path = "temp_audio.wav"
-    audio.write_audiofile(audio_file_path)
-    audio = AudioSegment.from_wav(audio_file_path)
-    chunks = split_on_silence(audio, min_silence_len=500, silence_thresh=-40)
-    recognizer = sr.Recognizer()
-
-    current_time = 0
-    for chunk in chunks:
-        chunk_duration = len(chunk) / 1000
-        if chunk_duration >= min_speech_duration:
-            with chunk.export(format="wav") as chunk_file:
-                with sr.AudioFile(chunk_file) as source:
-                    audio_data = recognizer.record(source)
-                    try:
-                        recognizer.recognize_google(audio_data)
-                        print(f"Speech starts at {current_time:.2f} seconds")
-                        os.remove(audio_file_path)
-                        return current_time
-                    except sr.UnknownValueError:
-                        pass
-
-        current_time += chunk_duration
-
-    os.remove(audio_file_path)
-    print("No speech detected with the specified duration.")
-    return None
+Segment = Tuple[float, float]
+
+ANALYSIS_SAMPLE_RATE = 16000
+
+
+class VoiceActivityDetector:
+    """
+    Streaming frame-level voice-activity detector.
+
+    Feed decoded mono PCM blocks with `process`, then call `finish` to get the speech
+    segments as (start, end) times in seconds.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        frame_ms: float = 30.0,
+        hop_ms: float = 10.0,
+        energy_margin_db: float = 12.0,
+        min_energy_db: float = -60.0,
+        max_flatness: float = 0.5,
+        min_band_ratio: float = 0.4,
+        hangover_ms: float = 200.0,
+        min_speech_duration: float = 0.1,
+        min_silence_duration: float = 0.3,
+        noise_rise_db_per_second: float = 0.2,
+        noise_warmup_seconds: float = 0.5
+    ):
+        self.sample_rate = sample_rate
+        self.frame_len = int(sample_rate * frame_ms / 1000)
+        self.hop = int(sample_rate * hop_ms / 1000)
+        self.energy_margin_db = energy_margin_db
+        self.min_energy_db = min_energy_db
+        self.max_flatness = max_flatness
+        self.min_band_ratio = min_band_ratio
+        self.hangover_frames = int(round(hangover_ms / hop_ms))
+        self.min_speech_duration = min_speech_duration
+        self.min_silence_duration = min_silence_duration
+        self._noise_rise = noise_rise_db_per_second * self.hop / sample_rate  # dB per frame
+        self._noise_warmup_frames = max(1, int(noise_warmup_seconds * sample_rate / self.hop))
+
+        self._window = np.hanning(self.frame_len).astype(np.float32)
+        freqs = np.fft.rfftfreq(self.frame_len, d=1.0 / sample_rate)
+        self._band = (freqs >= 300) & (freqs <= 3400)
+
+        self._pending = np.zeros(0, dtype=np.float32)  # Samples not yet covered by a full frame
+        self._frame_index = 0
+        self._noise_db: Optional[float] = None  # Floor at the last frame classified
+        self._frames_since_speech = self.hangover_frames + 1
+        self._segment_start: Optional[int] = None
+        self._segments: List[Tuple[int, int]] = []
+
+    def process(self, block: np.ndarray) -> None:
+        """Consumes a block of mono float PCM samples at `sample_rate`."""
+        samples = np.concatenate([self._pending, np.asarray(block, dtype=np.float32)])
+        frame_count = (len(samples) - self.frame_len) // self.hop + 1 if len(samples) >= self.frame_len else 0
+        if frame_count == 0 or (self._noise_db is None and frame_count < self._noise_warmup_frames):
+            self._pending = samples
+            return
+        self._consume(samples)
+
+    def _consume(self, samples: np.ndarray) -> None:
+        frames = np.lib.stride_tricks.sliding_window_view(samples, self.frame_len)[::self.hop]
+        self._pending = samples[len(frames) * self.hop:]
+        self._classify(frames)
+
+    def _classify(self, frames: np.ndarray) -> None:
+        energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+
+        power = np.abs(np.fft.rfft(frames * self._window, axis=1)) ** 2 + 1e-12
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+        band_ratio = power[:, self._band].sum(axis=1) / power.sum(axis=1)
+
+        speech_like = (flatness < self.max_flatness) | (band_ratio > self.min_band_ratio)
+        if self._noise_db is None:
+            warmup = energy_db[:self._noise_warmup_frames][~speech_like[:self._noise_warmup_frames]]
+            self._noise_db = float(warmup.min()) if len(warmup) else self.min_energy_db - self.energy_margin_db
+
+        # Decaying minimum, frame by frame: floor[i] = min(floor[i - 1] + rise, energy[i]).
+        # Unrolled, floor[i] = rise * i + min(floor_before + rise, min over j <= i of
+        # (energy[j] - rise * j)), which a cumulative minimum computes for the whole block.
+        ramp = self._noise_rise * np.arange(len(energy_db))
+        floor = ramp + np.minimum(self._noise_db + self._noise_rise, np.minimum.accumulate(energy_db - ramp))
+        self._noise_db = float(floor[-1])
+        threshold = np.maximum(self.min_energy_db, floor + self.energy_margin_db)
+
+        raw = (energy_db > threshold) & speech_like
+
+        # Hangover: a frame counts as speech if any of the previous `hangover_frames` frames
+        # was speech. Distances to the last speech frame are carried across blocks.
+        indices = np.arange(len(raw))
+        last_speech = np.where(raw, indices, -1)
+        last_speech = np.maximum.accumulate(last_speech)
+        since = np.where(last_speech >= 0, indices - last_speech, self._frames_since_speech + indices + 1)
+        smoothed = since <= self.hangover_frames
+        self._frames_since_speech = int(since[-1])
+
+        self._update_segments(smoothed)
+        self._frame_index += len(raw)
+
+    def _update_segments(self, smoothed: np.ndarray) -> None:
+        padded = np.concatenate([[self._segment_start is not None], smoothed, [False]]).astype(np.int8)
+        changes = np.diff(padded)
+        starts = np.flatnonzero(changes == 1) + self._frame_index
+        ends = np.flatnonzero(changes == -1) + self._frame_index
+
+        if self._segment_start is not None:
+            starts = np.concatenate([[self._segment_start], starts])
+        # The trailing end produced by the padding only closes the segment at the end
+        # of the stream, so an open segment is carried to the next block.
+        if len(smoothed) and smoothed[-1]:
+            self._segment_start = int(starts[-1])
+            starts = starts[:-1]
+            ends = ends[:-1]
+        else:
+            self._segment_start = None
+        self._segments.extend(zip(starts.tolist(), ends.tolist()))
 
+    def finish(self) -> List[Segment]:
+        """Flushes the detector and returns the merged speech segments in seconds."""
+        if self._noise_db is None and len(self._pending) >= self.frame_len:
+            # Input shorter than the noise warm-up
+            self._consume(self._pending)
+        if self._segment_start is not None:
+            self._segments.append((self._segment_start, self._frame_index))
+            self._segment_start = None
 
-test_filepath = "D:/test_file0.mp4"
-detect_speech_start(test_filepath, 2)
+        frame_duration = self.hop / self.sample_rate
+        tail = (self.frame_len - self.hop) / self.sample_rate
+        merged: List[List[float]] = []
+        for start, end in self._segments:
+            start_time = start * frame_duration
+            end_time = end * frame_duration + tail
+            if merged and start_time - merged[-1][1] < self.min_silence_duration:
+                merged[-1][1] = end_time
+            else:
+                merged.append([start_time, end_time])
+        return [(start, end) for start, end in merged if end - start >= self.min_speech_duration]
+
+
+def read_audio_blocks(path: str, block_seconds: float = 30.0) -> Tuple[int, Iterator[np.ndarray]]:
+    """
+    Streams a media file as mono float32 blocks without writing temporary files.
+
+    Formats libsndfile understands (WAV, FLAC, OGG...) are read directly; anything else,
+    including video containers, is decoded through an ffmpeg pipe at 16 kHz.
+
+    Returns:
+        The sample rate and an iterator over blocks of at most `block_seconds` seconds.
+    """
+    try:
+        info = sf.info(path)
+    except RuntimeError:
+        info = None
+
+    if info is not None:
+        block_size = int(info.samplerate * block_seconds)
+
+        def sndfile_blocks():
+            for block in sf.blocks(path, blocksize=block_size, dtype='float32', always_2d=True):
+                yield block.mean(axis=1)
+
+        return info.samplerate, sndfile_blocks()
+
+    def ffmpeg_blocks():
+        command = [
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-i", path,
+            "-vn", "-ac", "1", "-ar", str(ANALYSIS_SAMPLE_RATE), "-f", "f32le", "pipe:1"
+        ]
+        block_bytes = int(ANALYSIS_SAMPLE_RATE * block_seconds) * 4
+        with subprocess.Popen(command, stdout=subprocess.PIPE) as process:
+            while True:
+                data = process.stdout.read(block_bytes)
+                if not data:
+                    break
+                yield np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.float32)
+        if process.returncode:
+            raise RuntimeError(f"ffmpeg failed to decode audio from {path}")
+
+    return ANALYSIS_SAMPLE_RATE, ffmpeg_blocks()
+
+
+def detect_speech_segments(samples: np.ndarray, sample_rate: int, **vad_options) -> List[Segment]:
+    """
+    Returns all speech segments in an in-memory PCM array.
+
+    Args:
+        samples: Mono (n,) or multichannel (n, channels) PCM array.
+        sample_rate: Sample rate of `samples`.
+        **vad_options: Forwarded to VoiceActivityDetector.
+
+    Returns:
+        A list of (start, end) times in seconds.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    vad = VoiceActivityDetector(sample_rate, **vad_options)
+    vad.process(samples)
+    return vad.finish()
+
+
+def detect_speech_segments_in_file(path: str, block_seconds: float = 30.0, **vad_options) -> List[Segment]:
+    """Streams an audio or video file through the detector in fixed-size blocks."""
+    sample_rate, blocks = read_audio_blocks(path, block_seconds)
+    vad = VoiceActivityDetector(sample_rate, **vad_options)
+    for block in blocks:
+        vad.process(block)
+    return vad.finish()
+
+
+def detect_speech_start(mp4_file_path, min_speech_duration=1):
+    # Also accepts an already decoded buffer (processing.decoded_audio.DecodedAudio)
+    if hasattr(mp4_file_path, 'samples'):
+        segments = detect_speech_segments(mp4_file_path.samples, mp4_file_path.sample_rate)
+    else:
+        segments = detect_speech_segments_in_file(mp4_file_path)
+    for start, end in segments:
+        if end - start >= min_speech_duration:
+            logging.info(f"Speech starts at {start:.2f} seconds")
+            return start
+
+    logging.info("No speech detected with the specified duration.")
+    return None
@@ -0,0 +1,101 @@
+import os
+import sys
+import logging
+import threading
+from datetime import datetime
+from time import perf_counter, time
+from typing import Any, Callable, Dict
+
+# Cold-start instrumentation.
+#
+# torch, Coqui TTS and Whisper take seconds to import and more to load their checkpoints,
+# so the entry points bind their server first and bring the models in from a background
+# warm-up thread (or on first use). This module records when each startup milestone is
+# reached, counted from the process start: entry point imported, server bound, first
+# request, each warm-up done. Milestones are logged as they happen and `report()` returns
+# them with the warm-up states and which heavy modules are loaded so far; the headless API
+# serves it at /startup and benchmarks.startup_benchmark collects it.
+
+HEAVY_MODULES = ("torch", "TTS", "whisper", "gradio")
+
+
+def process_start_time() -> float:
+    """Epoch time the process started, from /proc on Linux, else when this module was imported."""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as f:
+            # The command name (field 2) may contain spaces, so split after its closing parenthesis
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", encoding="ascii") as f:
+            uptime = float(f.read().split()[0])
+        # Process age from the system uptime: /proc/stat's boot time only has 1s resolution
+        return time() - (uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return time()
+
+
+_started = process_start_time()
+_clock_offset = time() - perf_counter()  # perf_counter is monotonic; used for the elapsed times
+_milestones: Dict[str, float] = {}
+_warm_ups: Dict[str, Dict[str, Any]] = {}
+_lock = threading.Lock()
+
+
+def elapsed() -> float:
+    """Seconds since the process started."""
+    return perf_counter() + _clock_offset - _started
+
+
+def mark(name: str) -> float:
+    """
+    Records a milestone the first time it is reached; later calls are ignored.
+
+    Returns:
+        Seconds from the process start to the (first) milestone.
+    """
+    with _lock:
+        if name in _milestones:
+            return _milestones[name]
+        seconds = _milestones[name] = round(elapsed(), 3)
+    logging.info(f"Startup: {name} after {seconds:.2f}s")
+    return seconds
+
+
+def warm_up(name: str, fn: Callable[[], Any]) -> threading.Thread:
+    """
+    Runs `fn` in a daemon thread and records how long it took.
+
+    Failures are logged, not raised: whatever was being warmed up is loaded again on first
+    use, where the error surfaces in the task that needs it.
+    """
+    def run() -> None:
+        started = perf_counter()
+        try:
+            fn()
+            state = {'status': "done"}
+        except Exception as e:
+            logging.warning(f"Warm-up '{name}' failed: {e}")
+            state = {'status': "failed", 'error': str(e)}
+        state['seconds'] = round(perf_counter() - started, 3)
+        with _lock:
+            _warm_ups[name].update(state)
+        mark(f"warm_up_{name}")
+
+    with _lock:
+        _warm_ups[name] = {'status': "running"}
+    thread = threading.Thread(target=run, name=f"warm-up-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def report() -> Dict[str, Any]:
+    """Milestones, warm-up states and loaded heavy modules, for logs and the /startup endpoint."""
+    with _lock:
+        milestones = dict(_milestones)
+        warm_ups = {name: dict(state) for name, state in _warm_ups.items()}
+    return {
+        'process_started': datetime.fromtimestamp(_started).isoformat(timespec="seconds"),
+        'uptime_seconds': round(elapsed(), 3),
+        'milestones': milestones,
+        'warm_ups': warm_ups,
+        'heavy_modules_loaded': {name: name in sys.modules for name in HEAVY_MODULES},
+    }